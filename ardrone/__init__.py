@@ -1,3 +1,12 @@
-from ardrone.drone import ARDrone
-
 __all__ = ['ARDrone']
+
+
+def __getattr__(name):
+    # import the drone only when it is used, so that importing a submodule
+    # (e.g. ardrone.navdata) does not import the network stack
+    if name == 'ARDrone':
+        from ardrone.drone import ARDrone
+
+        return ARDrone
+
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
@@ -0,0 +1,217 @@
+"""
+This module resends AT commands until the drone acknowledges them in its
+navdata state.
+"""
+
+import collections
+import concurrent.futures
+import threading
+
+import ardrone.constant
+import ardrone.metrics
+import ardrone.navdata
+
+
+class AcknowledgementTimeout(Exception):
+    """The drone did not acknowledge an operation in time."""
+
+
+# a command to (re)send and the navdata state condition that ends the step
+Step = collections.namedtuple('Step', ['send', 'done', 'resend'])
+
+
+def flag(name, value=True):
+    """Return a condition on a navdata state flag."""
+    mask = 1 << ardrone.navdata.STATE_SHIFTS[name]
+    return lambda state: bool(state & mask) == value
+
+
+class Operation(object):
+    """Acknowledged Operation.
+
+    Runs its steps one after another: a step sends its command when it
+    starts (and on every tick while resend is set) and ends once its
+    condition holds for the navdata state (a step whose condition already
+    holds is skipped). When the last step ended, then is called and the
+    future is resolved.
+    """
+
+    def __init__(self, name, steps, timeout, exclusive=False, then=None):
+        self.name = name
+        self.steps = collections.deque(steps)
+        self.exclusive = exclusive
+        self.then = then
+
+        self.future = concurrent.futures.Future()
+        self.started = ardrone.metrics.clock()
+        self.deadline = self.started + timeout
+        self.timeout = timeout
+        self.sent = False
+
+    def advance(self, state):
+        """Start or end steps for a navdata state and return whether all steps ended."""
+        while self.steps:
+            step = self.steps[0]
+            if state is not None and step.done(state):
+                self.steps.popleft()
+                self.sent = False
+                continue
+
+            if not self.sent:
+                step.send()
+                self.sent = True
+            return False
+
+        return True
+
+    def resend(self):
+        """Resend the command of the current step if it is to be repeated."""
+        if self.steps and self.sent and self.steps[0].resend:
+            self.steps[0].send()
+
+
+class Acknowledgements(object):
+    """Acknowledgements.
+
+    Tracks the operations of an ardrone.at.ATCommand until the navdata state
+    acknowledges them. Feed every navdata state with update() or pass a
+    state callable that is polled on every command tick. Operations touching
+    the shared command ACK flag (configuration) run one at a time.
+
+    The time from submitting an operation until it is acknowledged is kept
+    in a histogram per operation name.
+    """
+
+    def __init__(self, atcmd, state=None, timeout=10.0):
+        self.atcmd = atcmd
+        self.source = state
+        self.timeout = timeout
+
+        self.state = None
+        self.active = []
+        self.waiting = collections.deque()
+
+        self.latency = collections.defaultdict(ardrone.metrics.Histogram)
+        self.timeouts = collections.Counter()
+
+        self.lock = threading.RLock()
+
+        atcmd.listeners.append(self.tick)
+
+    def submit(self, name, steps, timeout=None, exclusive=False, then=None):
+        """Start an operation and return its future."""
+        operation = Operation(name, steps, self.timeout if timeout is None else timeout, exclusive, then)
+
+        with self.lock:
+            if exclusive and any(other.exclusive for other in self.active):
+                self.waiting.append(operation)
+            else:
+                self.start(operation)
+
+        return operation.future
+
+    def start(self, operation):
+        self.active.append(operation)
+        if operation.advance(self.state):
+            self.finish(operation)
+
+    def finish(self, operation):
+        self.active.remove(operation)
+        if operation.then is not None:
+            operation.then()
+        self.latency[operation.name].add(ardrone.metrics.clock() - operation.started)
+        if not operation.future.cancelled():
+            operation.future.set_result(self.state)
+
+        self.next(operation)
+
+    def fail(self, operation):
+        self.active.remove(operation)
+        self.timeouts[operation.name] += 1
+        if not operation.future.cancelled():
+            operation.future.set_exception(AcknowledgementTimeout('{} was not acknowledged within {} s'.format(operation.name, operation.timeout)))
+
+        self.next(operation)
+
+    def next(self, operation):
+        # start the next exclusive operation
+        if operation.exclusive and self.waiting:
+            self.start(self.waiting.popleft())
+
+    def update(self, state):
+        """Advance the operations with a new navdata state value."""
+        with self.lock:
+            self.state = state
+            for operation in list(self.active):
+                if operation.advance(state):
+                    self.finish(operation)
+
+    def tick(self):
+        """Resend, time out and drop cancelled operations (called on every command tick)."""
+        if self.source is not None:
+            state = self.source()
+            if state is not None and state != self.state:
+                self.update(state)
+
+        with self.lock:
+            now = ardrone.metrics.clock()
+            for operation in list(self.active):
+                if operation.future.cancelled():
+                    self.active.remove(operation)
+                    self.next(operation)
+                elif now > operation.deadline:
+                    self.fail(operation)
+                else:
+                    operation.resend()
+
+    def close(self):
+        """Cancel all pending operations."""
+        with self.lock:
+            for operation in self.active + list(self.waiting):
+                operation.future.cancel()
+            self.active = []
+            self.waiting.clear()
+
+    def stats(self):
+        """Return the time to acknowledge histograms and timeouts per operation."""
+        with self.lock:
+            return dict((name, dict(histogram.snapshot(), timeouts=self.timeouts[name])) for name, histogram in self.latency.items())
+
+    def takeoff(self, timeout=None):
+        """Take off until navdata reports the drone flying."""
+        # REF is held and resent by the command socket itself
+        self.atcmd.ref(True)
+        return self.submit('takeoff', [Step(lambda: None, flag('fly'), False)], timeout)
+
+    def land(self, timeout=None):
+        """Land until navdata reports the drone landed."""
+        self.atcmd.ref(False)
+        return self.submit('land', [Step(lambda: None, flag('fly', False), False)], timeout)
+
+    def reset(self, timeout=None):
+        """Send the emergency flag until the emergency state toggles, then clear it."""
+        with self.lock:
+            emergency = flag('emergency')(self.state) if self.state is not None else False
+
+        return self.submit('reset', [
+            Step(lambda: self.atcmd.ref(False, True), flag('emergency', not emergency), True),
+        ], timeout, then=lambda: self.atcmd.ref(False, False))
+
+    def config(self, option, value, timeout=None):
+        """Send a configuration until the drone acknowledges it and reset the ACK flag."""
+        return self.configs([(option, value)], timeout)
+
+    def configs(self, options, timeout=None):
+        """Send (option, value) configurations in one batch until the drone acknowledges them and reset the ACK flag."""
+        def send():
+            with self.atcmd.batch():
+                for option, value in options:
+                    self.atcmd.config(option, value)
+
+        ack = lambda: self.atcmd.ctrl(ardrone.constant.CONTROL_MODE_ACK)
+        return self.submit('config', [
+            # clear a stale ACK first
+            Step(ack, flag('command', False), True),
+            Step(send, flag('command'), True),
+            Step(ack, flag('command', False), True),
+        ], timeout, exclusive=True)
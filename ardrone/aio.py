@@ -0,0 +1,273 @@
+"""
+asyncio client for the AR.Drone.
+
+Every AsyncARDrone lives on one event loop: AT commands and navdata use
+datagram endpoints and video a stream connection, so a single loop can drive
+many drones without any additional processes. Only video decoding leaves the
+loop, in the default executor (a thread pool) of the loop.
+"""
+
+import asyncio
+import struct
+
+import ardrone.at
+import ardrone.constant
+import ardrone.drone
+import ardrone.navdata
+import ardrone.output
+import ardrone.pave
+
+
+async def frames(reader):
+    """Yield the ardrone.pave.Frame objects read from an asyncio.StreamReader.
+
+    Data that does not start with a PaVE signature is skipped up to the next
+    signature. Stops at the end of the stream.
+    """
+    frame_reader = ardrone.pave.FrameReader()
+    while True:
+        data = await reader.read(65536)
+        if not data:
+            return
+
+        frame_reader.feed(data)
+        for frame in frame_reader.frames():
+            yield frame
+
+
+class ATProtocol(ardrone.at.Commands, asyncio.DatagramProtocol):
+    """AT Command Protocol.
+
+    Sends AT commands from the event loop and schedules the communication
+    watchdog on the loop instead of in a timer thread. Commands must be sent
+    from the thread running the loop.
+    """
+
+    def __init__(self, loop, interval=0.2):
+        self.loop = loop
+        self.transport = None
+
+        self.seq = 1
+        self.interval = interval
+
+        self.comwdg_handle = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def halt(self):
+        """
+        Halts communication with the drone
+        """
+        if self.comwdg_handle is not None:
+            self.comwdg_handle.cancel()
+            self.comwdg_handle = None
+
+        if self.transport is not None:
+            self.transport.close()
+
+    def at(self, command, params=[]):
+        """
+        Encodes and sends AT command
+
+        Parameters:
+        command -- the command
+        params -- a list of elements which can be either int, float or string
+        """
+        if self.transport is None or self.transport.is_closing():
+            return
+
+        if self.comwdg_handle is not None:
+            self.comwdg_handle.cancel()
+
+        self.transport.sendto(ardrone.at.encode(command, self.seq, params))
+
+        self.seq += 1
+
+        self.comwdg_handle = self.loop.call_later(self.interval, self.comwdg)
+
+
+class NavdataProtocol(asyncio.DatagramProtocol):
+    """Navdata Protocol.
+
+    Requests navdata from the drone and hands every decoded packet to the
+    AsyncARDrone.
+    """
+
+    def __init__(self, drone):
+        self.drone = drone
+
+    def connection_made(self, transport):
+        transport.sendto(b'\x01\x00\x00\x00')
+
+    def datagram_received(self, data, addr):
+        try:
+            navdata = ardrone.navdata.NavdataView(data)
+        except struct.error:
+            return
+
+        self.drone.navdata = navdata
+        self.drone._publish(self.drone.navdata_queues, navdata)
+
+
+class AsyncARDrone(ardrone.drone.BaseARDrone):
+    """Asynchronous ARDrone Class.
+
+    asyncio counterpart of ARDrone. Use it as an asynchronous context manager
+    or call connect() and halt() yourself:
+
+        async with AsyncARDrone() as drone:
+            drone.takeoff()
+            async for navdata in drone.navdata_stream():
+                print(navdata['demo']['altitude'])
+
+    Every AsyncARDrone decodes its video with its own ardrone.video.Decoder,
+    so several drones can stream video in the same process. video_size and
+    video_crop scale and crop the frames while decoding (see ARDrone.__init__()).
+    """
+
+    def __init__(self, host='192.168.1.1', *, video=True, video_size=None, video_crop=None):
+        ardrone.output.check_video(video_size, video_crop)
+
+        self.host = host
+        self.video = video
+        self.video_size = video_size or (0, 0)
+        self.video_crop = video_crop
+
+        self.speed = 0.2
+
+        self.atcmd = None
+        self.nav_transport = None
+        self.video_task = None
+
+        self.frame = None
+        self.navdata = dict()
+
+        self.navdata_queues = []
+        self.frame_queues = []
+
+        self._image = None
+
+        self.time = 0
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.halt()
+
+    async def connect(self):
+        """Open the command, navdata and (optionally) video connections."""
+        loop = asyncio.get_running_loop()
+
+        transport, self.atcmd = await loop.create_datagram_endpoint(lambda: ATProtocol(loop), remote_addr=(self.host, ardrone.constant.COMMAND_PORT))
+        self.atcmd.config('general:navdata_demo', 'TRUE')
+        self.atcmd.config('control:altitude_max', '20000')
+
+        self.nav_transport, _ = await loop.create_datagram_endpoint(lambda: NavdataProtocol(self), remote_addr=(self.host, ardrone.constant.NAVDATA_PORT))
+
+        if self.video:
+            reader, writer = await asyncio.open_connection(self.host, ardrone.constant.VIDEO_PORT)
+            self.video_task = loop.create_task(self._receive_video(reader, writer))
+
+    async def halt(self):
+        """Shutdown the drone.
+
+        This method does not land or halt the actual drone, but closes all
+        connections related with this object and ends all streams.
+        """
+        if self.atcmd is not None:
+            self.atcmd.halt()
+
+        if self.nav_transport is not None:
+            self.nav_transport.close()
+
+        if self.video_task is not None:
+            self.video_task.cancel()
+            try:
+                await self.video_task
+            except asyncio.CancelledError:
+                pass
+
+        for queue in self.navdata_queues + self.frame_queues:
+            self._put(queue, None)
+
+    async def reset(self):
+        """Toggle the drone's emergency state."""
+        self.atcmd.ref(False, True)
+        await asyncio.sleep(0.1)
+        self.atcmd.ref(False, False)
+
+    @property
+    def image(self):
+        """Latest decoded frame as a PIL image."""
+        if self.frame is None:
+            return ardrone.output.blank(ardrone.output.PIL_IMAGE)
+
+        if self._image is None or self._image[0] is not self.frame:
+            width, height, image = self.frame
+            self._image = (self.frame, ardrone.output.convert(ardrone.output.PIL_IMAGE, image, width, height))
+
+        return self._image[1]
+
+    async def navdata_stream(self, maxsize=64):
+        """Iterate over every received navdata packet (as ardrone.navdata.NavdataView).
+
+        If the consumer falls more than maxsize packets behind, the oldest
+        packets are dropped.
+        """
+        async for navdata in self._stream(self.navdata_queues, maxsize):
+            yield navdata
+
+    async def frame_stream(self, maxsize=2):
+        """Iterate over decoded (width, height, image) frames.
+
+        If the consumer falls more than maxsize frames behind, the oldest
+        frames are dropped.
+        """
+        async for frame in self._stream(self.frame_queues, maxsize):
+            yield frame
+
+    async def _stream(self, queues, maxsize):
+        queue = asyncio.Queue(maxsize)
+        queues.append(queue)
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                yield item
+        finally:
+            queues.remove(queue)
+
+    def _put(self, queue, item):
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(item)
+
+    def _publish(self, queues, item):
+        for queue in queues:
+            self._put(queue, item)
+
+    async def _receive_video(self, reader, writer):
+        import ardrone.video
+
+        loop = asyncio.get_running_loop()
+        decoder = ardrone.video.Decoder()
+
+        try:
+            async for pave_frame in frames(reader):
+                try:
+                    # decode the frame
+                    frame = await loop.run_in_executor(None, decoder.decode, pave_frame.data, 'rgb24', self.video_size[0], self.video_size[1], self.video_crop)
+                except (ardrone.video.DecodeError, ValueError):
+                    # a ValueError means that video_crop does not fit the frames
+                    continue
+
+                self.frame = frame
+                self._publish(self.frame_queues, frame)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
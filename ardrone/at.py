@@ -1,8 +1,17 @@
+import contextlib
 import socket
 import struct
 import threading
 
 import ardrone.constant
+import ardrone.metrics
+
+
+_float = struct.Struct('f')
+_int = struct.Struct('i')
+
+# encoding templates by command and parameter types
+_templates = dict()
 
 
 def f2i(f):
@@ -11,32 +20,82 @@ def f2i(f):
     Arguments:
     f -- floating point value
     """
-    return struct.unpack('i', struct.pack('f', f))[0]
+    return _int.unpack(_float.pack(f))[0]
 
 
-class ATCommand(object):
-    def __init__(self, host):
-        """
-        Open a new AT command socket
+class Template(object):
+    """Precompiled encoder for a command with fixed parameter types.
 
-        Parameters:
-        host -- destination address
-        """
-        self.host = host
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    All numeric parameters are reinterpreted with a single struct round trip
+    (ints as ints and floats as ints).
+    """
 
-        self.seq = 1
-        self.interval = 0.2
+    def __init__(self, command, types):
+        fmt = ['AT*', command, '=%d']
+        self.index = []
+        self.strings = []
+        numbers = []
+        for i, t in enumerate(types):
+            if t == int:
+                fmt.append(',%d')
+                numbers.append('q')
+            elif t == float:
+                fmt.append(',%d')
+                numbers.append('f')
+            elif t == str:
+                fmt.append(',"%s"')
+            else:
+                # other types are not encoded
+                continue
+            self.index.append(i)
+            self.strings.append(t == str)
+        fmt.append('\r')
+
+        self.fmt = ''.join(fmt)
+        self.bytes_fmt = self.fmt.encode()
+
+        self.numbers = bool(numbers)
+        self.pack = struct.Struct('<' + ''.join(numbers)).pack
+        self.unpack = struct.Struct('<' + ''.join(numbers).replace('f', 'i')).unpack
+
+        # parameters are all numbers and all encoded
+        self.simple = not any(self.strings) and len(self.index) == len(types)
+
+    def encode(self, seq, params):
+        """Encode the command with the given sequence number and parameters."""
+        if self.simple:
+            return self.bytes_fmt % ((seq,) + self.unpack(self.pack(*params)))
+
+        values = [params[i] for i in self.index]
+        if self.numbers:
+            numbers = iter(self.unpack(self.pack(*[value for value, string in zip(values, self.strings) if not string])))
+            values = [value if string else next(numbers) for value, string in zip(values, self.strings)]
+
+        return (self.fmt % ((seq,) + tuple(values))).encode()
+
+
+def encode(command, seq, params=[]):
+    """
+    Encodes an AT command
 
-        self.lock = threading.Lock()
-        self.comwdg_timer = threading.Timer(self.interval, self.comwdg)
+    Parameters:
+    command -- the command
+    seq -- sequence number of the command
+    params -- a list of elements which can be either int, float or string
+    """
+    key = (command, tuple(map(type, params)))
+    template = _templates.get(key)
+    if template is None:
+        template = _templates[key] = Template(*key)
 
-    def halt(self):
-        """
-        Halts communication with the drone
-        """
-        with self.lock:
-            self.comwdg_timer.cancel()
+    return template.encode(seq, params)
+
+
+class Commands(object):
+    """AT command set.
+
+    Subclasses implement at() to encode and send the commands.
+    """
 
     def ref(self, takeoff, emergency=False):
         """
@@ -92,6 +151,15 @@ class ATCommand(object):
         """Set configuration parameters of the drone."""
         self.at('CONFIG', [str(option), str(value)])
 
+    def ctrl(self, mode):
+        """
+        Sends a control command (e.g. to acknowledge a configuration)
+
+        Parameters:
+        mode -- Integer: control mode (see ardrone.constant.CONTROL_MODE_*)
+        """
+        self.at('CTRL', [mode, 0])
+
     def comwdg(self):
         """
         Reset communication watchdog.
@@ -148,22 +216,207 @@ class ATCommand(object):
         command -- the command
         params -- a list of elements which can be either int, float or string
         """
-        params_str = []
-        for p in params:
-            if type(p) == int:
-                params_str.append('{:d}'.format(p))
-            elif type(p) == float:
-                params_str.append('{:d}'.format(f2i(p)))
-            elif type(p) == str:
-                params_str.append('"{:s}"'.format(p))
+        raise NotImplementedError()
+
+
+class ATCommand(Commands):
+    """AT Command Socket.
+
+    A single sender thread (or the owner calling tick()) ticks at a fixed
+    command rate. Once sent, the latest REF (without the emergency flag) and
+    PCMD commands are resent on every tick, and COMWDG is only sent when
+    nothing else was sent for interval seconds.
+
+    Commands sent within a batch() context (and the commands of a tick) are
+    coalesced into as few datagrams as possible.
+
+    metrics counts the commands, datagrams and bytes sent and the datagrams
+    that could not be sent (errors) and holds the histogram of the tick
+    lateness (jitter).
+    """
+
+    # commands whose latest parameters are resent on every tick
+    held_commands = ('REF', 'PCMD')
+
+    def __init__(self, host, rate=30, sock=None, port=ardrone.constant.COMMAND_PORT, sender=True):
+        """
+        Open a new AT command socket
+
+        Parameters:
+        host -- destination address
+        rate -- number of command ticks per second
+        sock -- UDP socket to send from (e.g. shared by several drones)
+        port -- destination port
+        sender -- False: do not start a sender thread and call tick() at
+            the command rate instead
+        """
+        self.host = host
+        self.port = port
+        self.sock = sock if sock is not None else socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        self.seq = 1
+        self.rate = rate
+        self.interval = 0.2
+
+        self.held = dict()
+        self.last = ardrone.metrics.clock()
+        self.queue = None
+
+        self.ticks = 0
+        self.metrics = ardrone.metrics.Metrics(['commands', 'datagrams', 'bytes', 'errors'], ['jitter'])
+
+        # callables called after every tick
+        self.listeners = []
+
+        self.lock = threading.RLock()
+        self.stopping = threading.Event()
+        if sender:
+            self.sender = threading.Thread(target=self.run)
+            self.sender.daemon = True
+            self.sender.start()
+        else:
+            self.sender = None
+
+    def halt(self):
+        """
+        Halts communication with the drone
+        """
+        self.stopping.set()
+        if self.sender is not None and self.sender is not threading.current_thread():
+            self.sender.join()
+
+    def ref(self, takeoff, emergency=False):
+        """
+        Basic behaviour of the drone: take-off/landing, emergency stop/reset)
+
+        Parameters:
+        takeoff -- True: Takeoff / False: Land
+        emergency -- True: Turn off the engines (sent only once)
+        """
+        with self.lock:
+            Commands.ref(self, takeoff, emergency)
+            if emergency:
+                # do not toggle the emergency state again on every tick
+                self.held.pop('REF', None)
+
+    def run(self):
+        """
+        Sends the held commands (or the watchdog reset) at the command rate
+        """
+        period = 1.0/self.rate
+        deadline = ardrone.metrics.clock() + period
+
+        while not self.stopping.wait(max(deadline - ardrone.metrics.clock(), 0)):
+            now = ardrone.metrics.clock()
+
+            self.tick(now - deadline)
+
+            deadline += period
+            if deadline < now:
+                # skip ticks we are too late for instead of bursting
+                deadline = now + period
+
+    def tick(self, jitter=0.0):
+        """
+        Sends the held commands (or the watchdog reset if idle)
 
+        Parameters:
+        jitter -- lateness of this tick in seconds
+        """
+        with self.lock:
+            self.ticks += 1
+            self.metrics.observe('jitter', jitter)
+
+            if self.held:
+                with self.batch():
+                    for command in self.held_commands:
+                        if command in self.held:
+                            self.send(command, self.held[command])
+            elif ardrone.metrics.clock() - self.last >= self.interval:
+                self.comwdg()
+
+        # outside of the lock, so listeners may take locks of their own
+        # before sending commands
+        for listener in self.listeners:
+            listener()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Coalesces all commands sent within the context into as few datagrams
+        as possible (keeping their order)
+        """
         with self.lock:
-            self.comwdg_timer.cancel()
+            if self.queue is not None:
+                # already batching
+                yield
+                return
+
+            self.queue = []
+            try:
+                yield
+            finally:
+                queue, self.queue = self.queue, None
+                self.flush(queue)
+
+    def flush(self, queue):
+        """
+        Sends encoded commands in datagrams of at most COMMAND_MAX_SIZE bytes
+        """
+        datagram = []
+        size = 0
+        for msg in queue:
+            if datagram and size + len(msg) > ardrone.constant.COMMAND_MAX_SIZE:
+                self.sendto(b''.join(datagram), len(datagram))
+                datagram = []
+                size = 0
+
+            datagram.append(msg)
+            size += len(msg)
+
+        if datagram:
+            self.sendto(b''.join(datagram), len(datagram))
 
-            msg = 'AT*{:s}={:d}{:s}\r'.format(command, self.seq, ''.join(',' + param for param in params_str))
-            self.sock.sendto(msg.encode(), (self.host, ardrone.constant.COMMAND_PORT))
+    def sendto(self, datagram, commands=1):
+        """
+        Sends a datagram of encoded commands to the drone
+        """
+        try:
+            self.sock.sendto(datagram, (self.host, self.port))
+        except socket.error:
+            # e.g. an unreachable network, the commands are resent anyway
+            self.metrics.count('errors')
+            return
+
+        self.metrics.count('commands', commands)
+        self.metrics.count('datagrams')
+        self.metrics.count('bytes', len(datagram))
+
+    def send(self, command, params=[]):
+        """
+        Encodes and sends (or queues while batching) AT command without
+        holding it
+        """
+        with self.lock:
+            msg = encode(command, self.seq, params)
+            if self.queue is not None:
+                self.queue.append(msg)
+            else:
+                self.sendto(msg)
 
             self.seq += 1
+            self.last = ardrone.metrics.clock()
+
+    def at(self, command, params=[]):
+        """
+        Encodes and sends AT command
+
+        Parameters:
+        command -- the command
+        params -- a list of elements which can be either int, float or string
+        """
+        with self.lock:
+            self.send(command, params)
 
-            self.comwdg_timer = threading.Timer(self.interval, self.comwdg)
-            self.comwdg_timer.start()
+            if command in self.held_commands:
+                self.held[command] = params
@@ -0,0 +1,253 @@
+"""
+This module caches the configuration of the AR.Drone.
+
+The drone sends its whole configuration as "section:key = value" lines over
+the control TCP port after a CTRL CFG_GET command. The parsed values let
+Configuration skip CONFIG commands that would not change anything.
+"""
+
+import concurrent.futures
+import socket
+import threading
+
+import ardrone.constant
+
+
+def parse_value(text):
+    """Parse a configuration value into a bool, int, float, tuple or str."""
+    text = text.strip()
+    if text in ('TRUE', 'FALSE'):
+        return text == 'TRUE'
+
+    # vectors are written as "{ x y z }"
+    if text.startswith('{') and text.endswith('}'):
+        return tuple(parse_value(item) for item in text[1:-1].split())
+
+    for convert in (int, float):
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+
+    return text
+
+
+def format_value(value):
+    """Format a configuration value as sent in a CONFIG command."""
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    elif isinstance(value, (tuple, list)):
+        return '{{ {} }}'.format(' '.join(format_value(item) for item in value))
+
+    return str(value)
+
+
+def parse(text):
+    """Parse a configuration dump into a dict of typed values by option name."""
+    values = dict()
+    for line in text.splitlines():
+        option, separator, value = line.partition('=')
+        if separator:
+            values[option.strip()] = parse_value(value)
+
+    return values
+
+
+def download(atcmd, host, port=ardrone.constant.CONTROL_PORT, timeout=5.0, idle=0.2):
+    """
+    Download the configuration dump of a drone
+
+    Parameters:
+    atcmd -- the ardrone.at.ATCommand of the drone
+    host -- address of the drone
+    port -- control TCP port
+    timeout -- seconds to wait for the dump (socket.timeout is raised
+        when nothing arrives)
+    idle -- seconds without data after which the dump is complete
+
+    The drone keeps the connection open after the dump, so it ends at a NUL
+    byte, when the connection is closed or when no data arrives for idle
+    seconds.
+    """
+    sock = socket.create_connection((host, port), timeout)
+    try:
+        with atcmd.batch():
+            # acknowledge a pending command first
+            atcmd.ctrl(ardrone.constant.CONTROL_MODE_ACK)
+            atcmd.ctrl(ardrone.constant.CONTROL_MODE_CFG_GET)
+
+        chunks = []
+        while True:
+            try:
+                data = sock.recv(65536)
+            except socket.timeout:
+                if chunks:
+                    break
+                raise
+
+            if not data:
+                break
+            chunks.append(data)
+            if b'\x00' in data:
+                break
+            sock.settimeout(idle)
+    finally:
+        sock.close()
+
+    return b''.join(chunks).split(b'\x00')[0].decode('utf-8', 'replace')
+
+
+def _resolved(result=None):
+    future = concurrent.futures.Future()
+    future.set_result(result)
+    return future
+
+
+def _gather(futures):
+    """Return a future resolved once all futures are (failing with the first error)."""
+    if len(futures) == 1:
+        return futures[0]
+
+    gathered = concurrent.futures.Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(future):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if gathered.done():
+            return
+        if future.cancelled():
+            gathered.cancel()
+        elif future.exception() is not None:
+            gathered.set_exception(future.exception())
+        elif last:
+            gathered.set_result(future.result())
+
+    for future in futures:
+        future.add_done_callback(done)
+
+    return gathered
+
+
+class Configuration(object):
+    """Configuration Cache.
+
+    Keeps the last known value of every configuration option of a drone,
+    either downloaded with fetch() or acknowledged by the drone after
+    set() or update(). Options whose value is already known (or on its way)
+    are not sent again, and the changed options of an update() are sent in
+    a single batch acknowledged through the navdata command flag (see
+    ardrone.ack.Acknowledgements.configs()).
+
+    values maps option names to parsed values (see parse_value()). sent and
+    skipped count the options sent and the options skipped as unchanged.
+    """
+
+    def __init__(self, acks, host, port=ardrone.constant.CONTROL_PORT):
+        self.acks = acks
+        self.host = host
+        self.port = port
+
+        self.values = dict()
+        # option -> (value, future) of options waiting for their ACK
+        self.pending = dict()
+
+        self.sent = 0
+        self.skipped = 0
+
+        # the acknowledgements call acknowledged() while holding their lock
+        # and update() calls them while holding ours, so sharing their
+        # (reentrant) lock keeps both in the same order
+        self.lock = acks.lock
+
+    def __getitem__(self, option):
+        return self.values[option]
+
+    def __contains__(self, option):
+        return option in self.values
+
+    def get(self, option, default=None):
+        return self.values.get(option, default)
+
+    def fetch(self, timeout=5.0):
+        """Download the whole configuration into the cache and return a copy of it."""
+        values = parse(download(self.acks.atcmd, self.host, self.port, timeout))
+        with self.lock:
+            self.values = values
+            return dict(values)
+
+    def clear(self):
+        """Forget all known values (e.g. after the drone rebooted)."""
+        with self.lock:
+            self.values = dict()
+
+    def set(self, option, value, timeout=None):
+        """Set an option and return a future resolved once it is acknowledged."""
+        return self.update([(option, value)], timeout)
+
+    def update(self, options, timeout=None):
+        """
+        Set several options and return a future resolved once all are acknowledged
+
+        Parameters:
+        options -- dict or (option, value) pairs
+        timeout -- seconds to wait for the ACK (see ardrone.ack)
+
+        Only the options whose value differs from the known one are sent. If
+        none does, the returned future is already resolved.
+        """
+        if hasattr(options, 'items'):
+            options = options.items()
+
+        with self.lock:
+            futures = []
+            changed = []
+            for option, value in options:
+                text = format_value(value)
+                value = parse_value(text)
+                pending = self.pending.get(option)
+                if pending is not None and pending[0] == value:
+                    futures.append(pending[1])
+                elif pending is None and option in self.values and self.values[option] == value:
+                    pass
+                else:
+                    changed.append((option, value, text))
+                    continue
+                self.skipped += 1
+
+            if changed:
+                future = self.acks.configs([(option, text) for option, value, text in changed], timeout)
+                for option, value, text in changed:
+                    self.pending[option] = (value, future)
+                self.sent += len(changed)
+                futures.append(future)
+
+        if not futures:
+            return _resolved(self.acks.state)
+
+        # the callbacks may run right away, so add them without the lock
+        if changed:
+            future.add_done_callback(lambda future: self.acknowledged(changed, future))
+
+        return _gather(futures)
+
+    def acknowledged(self, changed, future):
+        succeeded = not future.cancelled() and future.exception() is None
+        with self.lock:
+            for option, value, text in changed:
+                if self.pending.get(option, (None, None))[1] is future:
+                    self.pending.pop(option, None)
+                if succeeded:
+                    self.values[option] = value
+
+    def stats(self):
+        """Return the number of known, pending, sent and skipped options."""
+        with self.lock:
+            return {
+                'known': len(self.values),
+                'pending': len(self.pending),
+                'sent': self.sent,
+                'skipped': self.skipped,
+            }
@@ -1,3 +1,35 @@
 NAVDATA_PORT = 5554
 VIDEO_PORT = 5555
 COMMAND_PORT = 5556
+CONTROL_PORT = 5559
+
+# maximum size of an AT command datagram
+COMMAND_MAX_SIZE = 1024
+
+# PaVE video frame types
+FRAME_TYPE_UNKNOWN = 0
+FRAME_TYPE_IDR = 1
+FRAME_TYPE_I = 2
+FRAME_TYPE_P = 3
+FRAME_TYPE_HEADERS = 4
+
+# largest frame the drone streams (720p)
+VIDEO_MAX_WIDTH = 1280
+VIDEO_MAX_HEIGHT = 720
+
+# largest width or height the decoder scales frames to
+VIDEO_MAX_SIDE = 16384
+
+# navdata header
+NAVDATA_HEADER = 0x55667788
+
+# sequence number of the first navdata packet after a (re)start
+NAVDATA_SEQUENCE_DEFAULT = 1
+
+# maximum size of a navdata datagram
+NAVDATA_MAX_SIZE = 4096
+
+# CTRL command modes
+CONTROL_MODE_NONE = 0
+CONTROL_MODE_CFG_GET = 4
+CONTROL_MODE_ACK = 5
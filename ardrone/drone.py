@@ -2,43 +2,20 @@
 Python library for the AR.Drone.
 """
 
-import time
-import multiprocessing
-
-import PIL.Image
-
 import ardrone.at
-import ardrone.network
+import ardrone.constant
+import ardrone.metrics
+import ardrone.output
+import ardrone.subscription
 
 
-class ARDrone(object):
-    """ARDrone Class.
+class BaseARDrone(object):
+    """Base ARDrone Class.
 
-    Instantiate this class to control your drone and receive decoded video and
-    navdata.
+    Drone controls shared by ARDrone and ardrone.aio.AsyncARDrone. Subclasses
+    provide an ardrone.at.Commands instance in atcmd.
     """
 
-    def __init__(self, host='192.168.1.1'):
-        self.host = host
-
-        self.speed = 0.2
-
-        self.atcmd = ardrone.at.ATCommand(self.host)
-        self.atcmd.config('general:navdata_demo', 'TRUE')
-        self.atcmd.config('control:altitude_max', '20000')
-        self.video_pipe, video_pipe_other = multiprocessing.Pipe()
-        self.nav_pipe, nav_pipe_other = multiprocessing.Pipe()
-        self.com_pipe, com_pipe_other = multiprocessing.Pipe()
-        self.network_process = ardrone.network.ARDroneNetworkProcess(self.host, nav_pipe_other, video_pipe_other, com_pipe_other)
-        self.network_process.start()
-        self.ipc_thread = ardrone.network.IPCThread(self)
-        self.ipc_thread.start()
-
-        self.image = PIL.Image.new('RGB', (640, 360))
-        self.navdata = dict()
-
-        self.time = 0
-
     def takeoff(self):
         """Make the drone takeoff."""
         self.atcmd.ref(True)
@@ -83,15 +60,9 @@ class ARDrone(object):
         """Make the drone rotate right."""
         self.atcmd.pcmd(True, 0, 0, 0, self.speed)
 
-    def reset(self):
-        """Toggle the drone's emergency state."""
-        self.atcmd.ref(False, True)
-        time.sleep(0.1)
-        self.atcmd.ref(False, False)
-
     def trim(self):
         """Flat trim the drone."""
-        self.atcmd.ftrim
+        self.atcmd.ftrim()
 
     def set_cam(self, cam):
         """Set active camera.
@@ -107,6 +78,306 @@ class ARDrone(object):
         """
         self.speed = speed
 
+    def move(self, lr, fb, vv, va):
+        """Makes the drone move (translate/rotate).
+
+        Parameters:
+        lr -- left-right tilt: float [-1..1] negative: left, positive: right
+        fb -- front-back tilt: float [-1..1] negative: forwards, positive:
+            backwards
+        vv -- vertical speed: float [-1..1] negative: go down, positive: rise
+        va -- angular speed: float [-1..1] negative: spin left, positive: spin
+            right"""
+        self.atcmd.pcmd(True, lr, fb, vv, va)
+
+
+class ARDrone(BaseARDrone):
+    """ARDrone Class.
+
+    Instantiate this class to control your drone and receive decoded video and
+    navdata. Video and navdata are received in a network process; poll image
+    and navdata or subscribe to every decoded frame with on_frame().
+
+    takeoff(), land(), reset(), set_cam(), config() and configure() return
+    concurrent.futures.Future objects that are resolved once the navdata
+    state acknowledges the command (and fail with
+    ardrone.ack.AcknowledgementTimeout otherwise). Until then the commands
+    are resent at the command rate. stats() returns a snapshot of the
+    counters and timing histograms of the navdata, video and command paths.
+
+    The drone connects when it is created. It can also be used as a context
+    manager, which connects (if needed) on entry and halts on exit:
+
+        with ARDrone(connect=False) as drone:
+            drone.takeoff().result()
+
+    Using the controls before connect() raises RuntimeError.
+    """
+
+    def _connected(name):
+        # attributes created by connect()
+        def get(self):
+            value = getattr(self, '_' + name, None)
+            if value is None:
+                raise RuntimeError('not connected')
+            return value
+
+        def set(self, value):
+            setattr(self, '_' + name, value)
+
+        return property(get, set)
+
+    atcmd = _connected('atcmd')
+    acks = _connected('acks')
+    configuration = _connected('configuration')
+    metrics = _connected('metrics')
+    frame_counters = _connected('frame_counters')
+
+    del _connected
+
+    def __init__(self, host='192.168.1.1', *, shared_frames=False, frame_slots=3, shared_navdata=False, command_rate=30, history_size=0, output=ardrone.output.PIL_IMAGE, record=None, stats_file=None, stats_interval=1.0, video=True, connect=True, navdata_buffer=256*1024, video_size=None, video_crop=None, relay=None, relay_policy='skip'):
+        """
+        Create a drone and (unless connect is False) connect to it
+
+        Parameters (all but host keyword only):
+        host -- address of the drone
+        shared_frames -- True: pass decoded frames from the network process
+            through a ring of frame_slots (at least 3) shared memory slots
+            instead of pickling them through a pipe. image and frame use the
+            slot of the latest frame without copying it and stay unchanged
+            while they hold the latest frame (copy them to keep them longer);
+            subscribers get copies
+        frame_slots -- number of shared memory frame slots
+        shared_navdata -- True: overwrite a navdata snapshot in shared memory
+            instead of sending every packet through a pipe; navdata is only
+            materialized when it is accessed and navdata_snapshot.read()
+            gives cheap access to the raw fields
+        command_rate -- number of times per second the latest takeoff/land
+            and movement commands are resent
+        history_size -- number of navdata samples to keep in a columnar
+            ardrone.history.NavdataHistory in history (0: none; ValueError
+            with shared_navdata)
+        output -- type of image and of the frames passed to subscribers:
+            'pil' (PIL images), 'numpy' ((height, width, 3) RGB NumPy arrays
+            over the decoded buffer), 'yuv' ((Y, U, V) planes straight from
+            the decoder) or 'gray' (the luma plane as a (height, width)
+            memoryview), see ardrone.output
+        record -- directory to record the raw navdata and video streams to
+            (see ardrone.recorder)
+        stats_file, stats_interval -- file to append a JSON line of stats()
+            to every stats_interval seconds
+        video -- False: do not connect to the video stream or decode frames
+        connect -- False: create the drone without side effects and import
+            the network modules only in connect()
+        navdata_buffer -- receive buffer size of the navdata socket in bytes
+            (bursts are received in batches and stale and duplicate packets
+            are dropped, see ardrone.network.NavdataReceiver)
+        video_size, video_crop -- (width, height) the frames are scaled to
+            (a 0 keeps the aspect ratio) and (x, y, width, height) region
+            they are cropped to, in the same decoder pass as the color
+            conversion; e.g. video_size=(160, 90) with output='gray' makes
+            every frame much cheaper to convert and pass between processes.
+            Values the decoder would reject raise ValueError (see
+            ardrone.output.check_video())
+        relay, relay_policy -- local (host, port) or Unix socket path to
+            republish the raw video stream at and policy for slow clients
+            (see ardrone.relay)
+        """
+        ardrone.output.check(output)
+        ardrone.output.check_video(video_size, video_crop)
+        if shared_frames and frame_slots < 3:
+            raise ValueError('frame_slots must be at least 3')
+        if shared_navdata and history_size:
+            # only the latest packet reaches the shared snapshot
+            raise ValueError('history_size is not available with shared_navdata=True')
+
+        self.host = host
+        self.output = output
+        self.video = video
+
+        self.shared_frames = shared_frames
+        self.frame_slots = frame_slots
+        self.shared_navdata = shared_navdata
+        self.command_rate = command_rate
+        self.history_size = history_size
+        self.record = record
+        self.stats_file = stats_file
+        self.stats_interval = stats_interval
+        self.navdata_buffer = navdata_buffer
+        self.video_size = video_size
+        self.video_crop = video_crop
+        self.relay = relay
+        self.relay_policy = relay_policy
+
+        self.speed = 0.2
+
+        self.connected = False
+        self.atcmd = None
+        self.acks = None
+        self.frame_ring = None
+        self.navdata_snapshot = None
+        self.history = None
+        self.exporter = None
+        self.configuration = None
+        self.frame_subscribers = ardrone.subscription.Publisher('frame subscriber')
+
+        self._image = None
+        self.frame = None
+        self.navdata = dict()
+
+        self.time = 0
+
+        if connect:
+            self.connect()
+
+    def __enter__(self):
+        if not self.connected:
+            self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.halt()
+
+    def connect(self):
+        """Start sending commands and receiving navdata (and video)."""
+        # imported here so that importing ardrone stays cheap
+        import multiprocessing
+
+        import ardrone.history
+        import ardrone.ipc
+        import ardrone.network
+        import ardrone.pave
+
+        self.video_pipe, video_pipe_other = multiprocessing.Pipe()
+        self.nav_pipe, nav_pipe_other = multiprocessing.Pipe()
+        self.com_pipe, com_pipe_other = multiprocessing.Pipe()
+        self.frame_ring = None
+        if self.shared_frames and self.video:
+            # slots fit the largest frame the decoder can produce
+            self.frame_ring = ardrone.ipc.FrameRing(self.frame_slots, ardrone.output.size(self.output, *ardrone.output.frame_size(self.video_size, self.video_crop)))
+        self.navdata_snapshot = ardrone.ipc.NavdataSnapshot() if self.shared_navdata else None
+        self.frame_counters = multiprocessing.RawValue(ardrone.pave.FrameCounters)
+        self.history = ardrone.history.NavdataHistory(self.history_size) if self.history_size else None
+        self.start_commands(ardrone.at.ATCommand(self.host, self.command_rate), (lambda: getattr(self.navdata_snapshot.read(), 'state', None)) if self.shared_navdata else None)
+        # shared with the network process
+        self.metrics = ardrone.network.stream_metrics(shared=True)
+
+        self.network_process = ardrone.network.ARDroneNetworkProcess(
+            self.host, nav_pipe_other, video_pipe_other, com_pipe_other,
+            frame_ring=self.frame_ring,
+            navdata_snapshot=self.navdata_snapshot,
+            frame_counters=self.frame_counters,
+            pixel_format=ardrone.output.PIXEL_FORMATS[self.output],
+            record=self.record,
+            metrics=self.metrics,
+            video=self.video,
+            navdata_buffer=self.navdata_buffer,
+            video_size=self.video_size,
+            video_crop=self.video_crop,
+            relay=self.relay,
+            relay_policy=self.relay_policy,
+        )
+        self.network_process.start()
+        self.ipc_thread = ardrone.network.IPCThread(self)
+        self.ipc_thread.start()
+
+        if self.stats_file is not None:
+            self.exporter = ardrone.metrics.Exporter(self.stats, self.stats_file, self.stats_interval)
+            self.exporter.start()
+
+        self.connected = True
+
+    def start_commands(self, atcmd, state=None, control_port=ardrone.constant.CONTROL_PORT):
+        """
+        Start controlling the drone through a command sender
+
+        Parameters:
+        atcmd -- the ardrone.at.ATCommand of the drone
+        state -- callable returning the latest navdata state (None: the
+            state is fed to acks.update())
+        control_port -- control TCP port of the drone (for read_config())
+
+        Sends the default configuration and sets up the acknowledged
+        operations and the configuration cache on atcmd.
+        """
+        import ardrone.ack
+        import ardrone.config
+
+        self.atcmd = atcmd
+        with atcmd.batch():
+            atcmd.config('general:navdata_demo', 'TRUE')
+            atcmd.config('control:altitude_max', '20000')
+
+        self.acks = ardrone.ack.Acknowledgements(atcmd, state)
+        self.configuration = ardrone.config.Configuration(self.acks, self.host, control_port)
+
+    @property
+    def image(self):
+        """Latest decoded frame in the output format (a blank image until the first frame)."""
+        if self._image is None:
+            self._image = ardrone.output.blank(self.output)
+
+        return self._image
+
+    @image.setter
+    def image(self, image):
+        self._image = image
+
+    @property
+    def navdata(self):
+        """Latest navdata.
+
+        An ardrone.navdata.NavdataView that decodes fields when they are
+        read (call to_dict() for plain dicts), or a dict with
+        shared_navdata=True.
+        """
+        if self.navdata_snapshot is not None:
+            return self.navdata_snapshot.to_dict()
+
+        return self._navdata
+
+    @navdata.setter
+    def navdata(self, navdata):
+        self._navdata = navdata
+
+    def takeoff(self, timeout=None):
+        """Make the drone takeoff and return a future resolved once it flies."""
+        return self.acks.takeoff(timeout)
+
+    def land(self, timeout=None):
+        """Make the drone land and return a future resolved once it landed."""
+        return self.acks.land(timeout)
+
+    def reset(self, timeout=None):
+        """Toggle the drone's emergency state and return a future resolved once it toggled."""
+        return self.acks.reset(timeout)
+
+    def set_cam(self, cam, timeout=None):
+        """Set active camera and return a future resolved once it is acknowledged.
+
+        Valid values are 0 for the front camera and 1 for the bottom camera
+        """
+        return self.config('video:video_channel', cam, timeout)
+
+    def config(self, option, value, timeout=None):
+        """Set a configuration option and return a future resolved once it is acknowledged.
+
+        Nothing is sent if the option is known to have the value already.
+        """
+        return self.configuration.set(option, value, timeout)
+
+    def configure(self, options, timeout=None):
+        """Set the changed ones of several configuration options in one batch.
+
+        options is a dict or (option, value) pairs. Returns a future
+        resolved once all of them are acknowledged.
+        """
+        return self.configuration.update(options, timeout)
+
+    def read_config(self, timeout=5.0):
+        """Download the configuration of the drone and return it as a dict of typed values."""
+        return self.configuration.fetch(timeout)
+
     def halt(self):
         """Shutdown the drone.
 
@@ -115,20 +386,99 @@ class ARDrone(object):
         application to close all sockets, pipes, processes and threads related
         with this object.
         """
+        if not self.connected:
+            return
+        self.connected = False
+
+        if self.exporter is not None:
+            self.exporter.stop()
+            self.exporter = None
         self.atcmd.halt()
+        self.acks.close()
         self.ipc_thread.stop()
         self.ipc_thread.join()
-        self.network_process.terminate()
-        self.network_process.join()
+        # let the network process close its sockets and the recording
+        self.com_pipe.send('halt')
+        self.network_process.join(1)
+        if self.network_process.is_alive():
+            self.network_process.terminate()
+            self.network_process.join()
+        self.frame_subscribers.close()
+        if self.frame_ring is not None:
+            self.frame = None
+            self.frame_ring.close(unlink=True)
+
+    def on_frame(self, callback, policy=ardrone.subscription.DROP_OLDEST, maxsize=2):
+        """Call callback with every decoded frame (in the output format).
+
+        Every subscriber is called from a thread of its own and gets each
+        frame at most once through a queue of at most maxsize frames. policy
+        (ardrone.subscription.DROP_OLDEST, DROP_NEWEST or BLOCK) decides what
+        happens to new frames while the queue is full (BLOCK keeps a backlog
+        of up to 32 more frames for this subscriber only and then drops the
+        oldest of them). Returns the ardrone.subscription.Subscription; call
+        its cancel() to unsubscribe.
+        """
+        return self.frame_subscribers.subscribe(callback, policy, maxsize)
 
-    def move(self, lr, fb, vv, va):
-        """Makes the drone move (translate/rotate).
+    def navdata_history(self, last_n=None):
+        """Return the last last_n navdata samples as a dict of NumPy arrays.
 
-        Parameters:
-        lr -- left-right tilt: float [-1..1] negative: left, positive: right
-        fb -- front-back tilt: float [-1..1] negative: forwards, positive:
-            backwards
-        vv -- vertical speed: float [-1..1] negative: go down, positive: rise
-        va -- angular speed: float [-1..1] negative: spin left, positive: spin
-            right"""
-        self.atcmd.pcmd(True, lr, fb, vv, va)
+        Requires history_size > 0 (raises RuntimeError otherwise). See
+        ardrone.history.NavdataHistory for time range queries and gap
+        detection.
+        """
+        if not self.history_size:
+            raise RuntimeError('history disabled')
+        if self.history is None:
+            raise RuntimeError('not connected')
+
+        return self.history.last(last_n)
+
+    def stats(self):
+        """Return a snapshot of the metrics of the drone.
+
+        navdata -- packets, bytes, errors (undecodable packets) and lost
+            (sequence gaps) counters (see ardrone.network.stream_metrics())
+            and decode, pipe and age histograms
+        video -- bytes counters and the received, decoded, dropped and
+            failed frame counters and read, decode, pipe and age (end-to-end
+            frame age) histograms
+        commands -- commands, datagrams and bytes sent, datagrams that
+            could not be sent (errors) and the tick count and jitter
+            histogram
+        acks -- time to acknowledge histograms and timeouts of takeoff,
+            land, reset and config
+        config -- known, pending, sent and skipped (unchanged) options
+            (see ardrone.config.Configuration.stats())
+        subscribers -- delivered and dropped frames and the lag of every
+            frame subscriber
+
+        The age histograms measure the delivery latency from the reception
+        of a packet (or of the last byte of a frame) in the network process
+        until it reaches this object (only pipe delivery is measured, i.e.
+        not with shared_navdata=True). Histograms are summarized in seconds
+        (see ardrone.metrics.Histogram.snapshot()).
+        """
+        commands = self.atcmd.metrics.snapshot()
+        commands['ticks'] = self.atcmd.ticks
+        return {
+            'navdata': self.metrics['navdata'].snapshot(),
+            'video': dict(self.metrics['video'].snapshot(), **dict((name, getattr(self.frame_counters, name)) for name, ctype in self.frame_counters._fields_)),
+            'commands': commands,
+            'acks': self.acks.stats(),
+            'config': self.configuration.stats(),
+            'subscribers': self.frame_subscribers.stats(),
+        }
+
+    def frame_array(self):
+        """Return the latest frame as a read-only NumPy array without copying it.
+
+        Requires shared_frames=True and an RGB or gray output format.
+        """
+        if self.frame is None:
+            return None
+
+        import numpy
+
+        return numpy.asarray(self.frame)
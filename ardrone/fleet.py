@@ -0,0 +1,442 @@
+"""
+This module controls many AR.Drones from a single network loop.
+"""
+
+import collections
+import concurrent.futures
+import selectors
+import socket
+import struct
+import threading
+
+import ardrone.at
+import ardrone.constant
+import ardrone.drone
+import ardrone.history
+import ardrone.metrics
+import ardrone.navdata
+import ardrone.network
+import ardrone.output
+import ardrone.pave
+import ardrone.relay
+
+
+class FleetDrone(ardrone.drone.ARDrone):
+    """Fleet Drone.
+
+    Handle of a single drone of a Fleet with the same controls and data
+    attributes as ARDrone. Create it with Fleet.add() and remove it with
+    halt() (or Fleet.remove()).
+
+    All sockets are serviced by the network loop of the fleet and frames are
+    decoded by its decode workers, at most one frame of this drone at a time.
+    """
+
+    def __init__(self, fleet, host, *, command_port=ardrone.constant.COMMAND_PORT, navdata_port=ardrone.constant.NAVDATA_PORT, video_port=ardrone.constant.VIDEO_PORT, control_port=ardrone.constant.CONTROL_PORT, video=True, history_size=0, output=ardrone.output.PIL_IMAGE, navdata_buffer=256*1024, video_size=None, video_crop=None, relay=None, relay_policy='skip'):
+        ardrone.drone.ARDrone.__init__(
+            self, host,
+            video=video,
+            history_size=history_size,
+            output=output,
+            navdata_buffer=navdata_buffer,
+            video_size=video_size,
+            video_crop=video_crop,
+            relay=relay,
+            relay_policy=relay_policy,
+            connect=False,
+        )
+
+        self.fleet = fleet
+
+        self.start_commands(ardrone.at.ATCommand(self.host, fleet.rate, sock=fleet.command_socket, port=command_port, sender=False), control_port=control_port)
+
+        self.navdata_address = (self.host, navdata_port)
+        self.nav_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.nav_socket.setblocking(False)
+
+        self.video_socket = None
+        self.video_reader = None
+        if video:
+            self.video_socket = socket.create_connection((self.host, video_port))
+            self.video_socket.setblocking(False)
+            self.video_reader = ardrone.pave.FrameReader(self.video_socket)
+        self.video_scheduler = ardrone.pave.FrameScheduler()
+        self.decoder = None
+        if video:
+            # imported here so that fleets without video do not need the
+            # extension
+            import ardrone.video as video_module
+
+            self.decoder = video_module.Decoder()
+        self.video_relay = ardrone.relay.Relay(relay, relay_policy) if relay is not None and video else None
+        self.decoding = False
+
+        self.frame_counters = self.video_scheduler.counters
+        self.history = ardrone.history.NavdataHistory(history_size) if history_size else None
+        self.metrics = ardrone.network.stream_metrics()
+        self.navdata_receiver = ardrone.network.NavdataReceiver(self.nav_socket, self.metrics['navdata'], buffer_size=navdata_buffer)
+
+        self.frame_buffer = None
+        self.frame_size = (640, 360)
+
+        self.added = ardrone.metrics.clock()
+
+        self.connected = True
+
+        self.nav_socket.sendto(b'\x01\x00\x00\x00', self.navdata_address)
+
+    @property
+    def image(self):
+        """Latest decoded frame in the output format."""
+        if self.frame_buffer is None:
+            return ardrone.output.blank(self.output, *self.frame_size)
+
+        return ardrone.output.convert(self.output, self.frame_buffer, *self.frame_size)
+
+    def halt(self):
+        """Remove the drone from its fleet and close its sockets.
+
+        Like ARDrone.halt(), this does not land the actual drone.
+        """
+        self.fleet.remove(self)
+
+    def stats(self):
+        """Return the metrics of this drone (see ARDrone.stats()) and its navdata rate."""
+        stats = ardrone.drone.ARDrone.stats(self)
+        elapsed = ardrone.metrics.clock() - self.added
+        stats['host'] = self.host
+        stats['navdata_rate'] = stats['navdata']['packets']/elapsed if elapsed > 0 else 0.0
+        return stats
+
+    def close(self):
+        """Close the sockets of the drone (called by the network loop)."""
+        self.atcmd.halt()
+        self.acks.close()
+        self.frame_subscribers.close()
+        self.nav_socket.close()
+        if self.video_socket is not None:
+            self.video_socket.close()
+        if self.video_relay is not None:
+            self.video_relay.close()
+
+    def receive_navdata(self):
+        """Receive and decode a batch of new pending navdata packets.
+
+        Only one batch is received per call, so that a flooding drone cannot
+        starve the others (the selector reports the rest again).
+        """
+        metrics = self.metrics['navdata']
+        received = ardrone.metrics.clock()
+        for data in self.navdata_receiver.receive():
+            start = ardrone.metrics.clock()
+            try:
+                navdata = ardrone.navdata.NavdataView(data)
+            except struct.error:
+                metrics.count('errors')
+                continue
+
+            now = ardrone.metrics.clock()
+            metrics.observe('decode', now - start)
+            metrics.observe('age', now - received)
+            if self.history is not None:
+                self.history.append(navdata, received)
+            self.acks.update(navdata['state'].value)
+            self.navdata = navdata
+
+    def receive_video(self):
+        """Read the available video data and queue the complete frames.
+
+        Returns False once the video connection is closed.
+        """
+        metrics = self.metrics['video']
+
+        start = ardrone.metrics.clock()
+        buffered = len(self.video_reader.buf)
+        connected = self.video_reader.fill()
+        metrics.count('bytes', max(len(self.video_reader.buf) - buffered, 0))
+        frames = self.video_reader.frames()
+        if frames:
+            metrics.observe('read', ardrone.metrics.clock() - start)
+
+        if self.video_relay is not None:
+            for frame in frames:
+                self.video_relay.publish(frame)
+        self.video_scheduler.extend(frames)
+        return connected
+
+    def decode(self, frame):
+        """Decode a frame (called by the decode workers of the fleet).
+
+        Returns None if the frame could not be decoded.
+        """
+        start = ardrone.metrics.clock()
+        try:
+            width, height = self.video_size or (0, 0)
+            result = self.decoder.decode(frame.data, ardrone.output.PIXEL_FORMATS[self.output], width, height, self.video_crop)
+        except (ardrone.video.DecodeError, ValueError):
+            # a ValueError means that video_crop does not fit the frames
+            return None
+
+        self.metrics['video'].observe('decode', ardrone.metrics.clock() - start)
+        return result
+
+    def decoded(self, frame, result):
+        """Publish a decoded frame (called by the network loop).
+
+        A result of None counts the frame as failed (see
+        ardrone.pave.FrameScheduler.error()).
+        """
+        self.decoding = False
+
+        if result is None:
+            self.video_scheduler.error()
+            return
+
+        self.video_scheduler.decoded()
+        self.metrics['video'].observe('age', ardrone.metrics.clock() - frame.received)
+
+        width, height, image = result
+        self.frame_size = (width, height)
+        self.frame_buffer = image
+        if self.output == ardrone.output.GRAY_PLANE:
+            self.frame = memoryview(image).cast('B', (height, width))
+        elif self.output != ardrone.output.YUV_PLANES:
+            self.frame = memoryview(image).cast('B', (height, width, 3))
+
+        if self.frame_subscribers:
+            self.frame_subscribers.publish(ardrone.output.convert(self.output, image, width, height))
+
+
+class Fleet(object):
+    """Fleet of AR.Drones.
+
+    A single network thread multiplexes the navdata and video sockets of all
+    drones with a selector and ticks the AT commands of every drone at the
+    command rate through one shared UDP socket. Video frames are decoded by
+    a pool of decode_workers threads (the decoder releases the GIL), so
+    decoding never delays navdata or commands.
+
+        fleet = Fleet()
+        drones = [fleet.add(host) for host in hosts]
+        for drone in drones:
+            drone.takeoff()
+        ...
+        fleet.halt()
+    """
+
+    def __init__(self, rate=30, decode_workers=2):
+        """
+        Start the network loop of the fleet
+
+        Parameters:
+        rate -- number of command ticks per second
+        decode_workers -- number of threads decoding video frames
+        """
+        self.rate = rate
+
+        self.command_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        self.selector = selectors.DefaultSelector()
+        self.wakeup_receiver, self.wakeup_sender = socket.socketpair()
+        self.wakeup_receiver.setblocking(False)
+        self.wakeup_sender.setblocking(False)
+        self.selector.register(self.wakeup_receiver, selectors.EVENT_READ, ('wakeup', None))
+
+        self.drones = []
+        # drones to add or remove and decoded frames, handled by the loop
+        self.changes = collections.deque()
+        self.results = collections.deque()
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(decode_workers)
+
+        self.tick_jitter = ardrone.metrics.Histogram()
+
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __len__(self):
+        return len(self.drones)
+
+    def __iter__(self):
+        return iter(list(self.drones))
+
+    def add(self, host, **options):
+        """
+        Connect to a drone and return its FleetDrone handle
+
+        Parameters (all but host keyword only, see FleetDrone):
+        host -- address of the drone
+        command_port, navdata_port, video_port -- ports of the drone
+        video -- False: do not connect to the video stream
+        history_size -- number of navdata samples to keep in history
+        output -- format of image and of the frames passed to subscribers
+            (see ARDrone.__init__())
+        navdata_buffer -- receive buffer size of the navdata socket in bytes
+        video_size, video_crop -- size the frames are scaled to and region
+            they are cropped to by the decoder (see ARDrone.__init__())
+        relay, relay_policy -- local address to republish the raw video
+            stream at and policy for slow clients (see ardrone.relay)
+        control_port -- control TCP port of the drone (for read_config())
+        """
+        drone = FleetDrone(self, host, **options)
+        self.drones.append(drone)
+        self.changes.append(('add', drone))
+        self.wakeup()
+        return drone
+
+    def remove(self, drone):
+        """Stop controlling a drone and close its sockets."""
+        if drone in self.drones:
+            self.drones.remove(drone)
+            self.changes.append(('remove', drone))
+            self.wakeup()
+
+    def halt(self):
+        """Stop the network loop and close all sockets of the fleet.
+
+        This does not land the actual drones.
+        """
+        for drone in list(self.drones):
+            self.remove(drone)
+        self.stopping = True
+        self.wakeup()
+        self.thread.join()
+        self.executor.shutdown()
+
+        self.selector.close()
+        self.wakeup_receiver.close()
+        self.wakeup_sender.close()
+        self.command_socket.close()
+
+    def stats(self):
+        """Return the stats of every drone and the command tick lateness of the fleet."""
+        return {
+            'drones': [drone.stats() for drone in self],
+            'tick_jitter': self.tick_jitter.snapshot(),
+        }
+
+    def wakeup(self):
+        """Wake up the network loop."""
+        try:
+            self.wakeup_sender.send(b'\x00')
+        except socket.error:
+            # the loop is already being woken up
+            pass
+
+    def apply_changes(self):
+        """Register added and unregister removed drones.
+
+        Returns the removed drones, which are closed by the loop once it
+        handled all events of the current select() batch (closing them right
+        away could let a new socket reuse the descriptor of a pending event).
+        """
+        try:
+            while self.wakeup_receiver.recv(4096):
+                pass
+        except socket.error:
+            pass
+
+        removed = []
+        while self.changes:
+            change, drone = self.changes.popleft()
+            if change == 'add':
+                self.selector.register(drone.nav_socket, selectors.EVENT_READ, ('navdata', drone))
+                if drone.video_socket is not None:
+                    self.selector.register(drone.video_socket, selectors.EVENT_READ, ('video', drone))
+            else:
+                self.selector.unregister(drone.nav_socket)
+                if drone.video_socket is not None and not drone.video_reader.closed:
+                    self.selector.unregister(drone.video_socket)
+                removed.append(drone)
+
+        return removed
+
+    def receive(self, kind, drone):
+        """Handle an event of a socket of a drone.
+
+        Socket errors (e.g. a reset video connection) are counted in the
+        socket_errors metric of the drone, so that one failing drone cannot
+        stop the loop for the others. The video connection is given up after
+        an error.
+        """
+        try:
+            if kind == 'navdata':
+                drone.receive_navdata()
+                return
+            elif drone.receive_video():
+                return
+        except socket.error:
+            drone.metrics[kind].count('socket_errors')
+            if kind == 'navdata':
+                return
+
+        self.selector.unregister(drone.video_socket)
+        drone.video_reader.closed = True
+
+    def schedule(self, drone):
+        """Start decoding the next frame of a drone unless one is in flight."""
+        if drone.decoding or not drone.video_scheduler.pending():
+            return
+
+        frame = drone.video_scheduler.next()
+        if frame is None:
+            return
+
+        drone.decoding = True
+        future = self.executor.submit(drone.decode, frame)
+        future.add_done_callback(lambda future: self.finished(drone, frame, future))
+
+    def finished(self, drone, frame, future):
+        """Hand a decoded frame back to the network loop (called by the workers).
+
+        A failed decode (e.g. a ValueError for a crop outside of the frame)
+        is handed back as a result of None, so that the drone always goes on
+        decoding.
+        """
+        try:
+            result = future.result()
+        except Exception:
+            result = None
+
+        self.results.append((drone, frame, result))
+        self.wakeup()
+
+    def run(self):
+        period = 1.0/self.rate
+        deadline = ardrone.metrics.clock() + period
+
+        while not self.stopping:
+            events = self.selector.select(max(deadline - ardrone.metrics.clock(), 0))
+            removed = []
+            for key, mask in events:
+                kind, drone = key.data
+                if kind == 'wakeup':
+                    removed.extend(self.apply_changes())
+                elif drone in self.drones:
+                    # events of drones removed during this batch are skipped
+                    self.receive(kind, drone)
+
+            for drone in removed:
+                drone.close()
+
+            while self.results:
+                drone, frame, result = self.results.popleft()
+                if drone in self.drones:
+                    drone.decoded(frame, result)
+
+            now = ardrone.metrics.clock()
+            if now >= deadline:
+                self.tick_jitter.add(now - deadline)
+                for drone in list(self.drones):
+                    drone.atcmd.tick(now - deadline)
+
+                deadline += period
+                if deadline < now:
+                    # skip ticks we are too late for instead of bursting
+                    deadline = now + period
+
+            for drone in list(self.drones):
+                if drone.video_socket is not None:
+                    self.schedule(drone)
@@ -0,0 +1,130 @@
+"""
+This module keeps a history of navdata samples in columnar arrays.
+"""
+
+import array
+import threading
+
+
+# columns and their array type codes (shared with NumPy dtypes)
+COLUMNS = [
+    ('sequence', 'I'),
+    ('time', 'd'),
+    ('state', 'I'),
+    ('battery', 'I'),
+    ('altitude', 'I'),
+    ('theta', 'i'),
+    ('phi', 'i'),
+    ('psi', 'i'),
+    ('vx', 'f'),
+    ('vy', 'f'),
+    ('vz', 'f'),
+]
+
+DEMO_COLUMNS = ['battery', 'altitude', 'theta', 'phi', 'psi', 'vx', 'vy', 'vz']
+
+
+class NavdataHistory(object):
+    """Navdata History.
+
+    Fixed capacity ring of navdata samples with one array per column. Every
+    sample is stored at its navdata sequence number modulo the capacity, so
+    reordered packets land in the right place and lost packets show up as
+    gaps. Queries return NumPy arrays ordered by sequence number.
+    """
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+
+        self.columns = dict((name, array.array(typecode, [0])*capacity) for name, typecode in COLUMNS)
+        self.valid = array.array('B', [0])*capacity
+
+        self.latest = None
+
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        with self.lock:
+            return sum(self.valid)
+
+    def clear(self):
+        """Forget all samples."""
+        with self.lock:
+            self.valid = array.array('B', [0])*self.capacity
+            self.latest = None
+
+    def append(self, navdata, received):
+        """Store a decoded navdata packet received at the given clock time."""
+        sequence = navdata['sequence']
+        demo = navdata.get('demo')
+
+        with self.lock:
+            if self.latest is not None and sequence + self.capacity <= self.latest:
+                # the drone restarted its sequence numbers
+                self.valid = array.array('B', [0])*self.capacity
+                self.latest = None
+
+            if self.latest is None or sequence > self.latest:
+                # invalidate the slots of skipped sequence numbers
+                if self.latest is not None:
+                    for skipped in range(self.latest + 1, min(sequence, self.latest + 1 + self.capacity)):
+                        self.valid[skipped % self.capacity] = 0
+                self.latest = sequence
+
+            index = sequence % self.capacity
+
+            columns = self.columns
+            columns['sequence'][index] = sequence
+            columns['time'][index] = received
+            columns['state'][index] = navdata['state'].value
+            if demo is not None:
+                for name in DEMO_COLUMNS:
+                    columns[name][index] = demo[name]
+            else:
+                for name in DEMO_COLUMNS:
+                    columns[name][index] = 0
+
+            self.valid[index] = 1
+
+    def select(self, mask=None):
+        """Return the samples as a dict of NumPy arrays ordered by sequence number.
+
+        mask is called with the columns as NumPy arrays and the latest
+        sequence number and returns a boolean array of the samples to select.
+        """
+        import numpy
+
+        with self.lock:
+            valid = numpy.frombuffer(self.valid, dtype=numpy.uint8).astype(bool)
+            if mask is not None and self.latest is not None:
+                valid &= mask(dict((name, numpy.frombuffer(self.columns[name], dtype=typecode)) for name, typecode in COLUMNS), self.latest)
+
+            order = numpy.argsort(numpy.frombuffer(self.columns['sequence'], dtype='I')[valid], kind='stable')
+
+            return dict((name, numpy.frombuffer(self.columns[name], dtype=typecode)[valid][order]) for name, typecode in COLUMNS)
+
+    def last(self, n=None):
+        """Return the samples with the last n sequence numbers (all with n=None)."""
+        if n is None:
+            return self.select()
+
+        return self.select(lambda columns, latest: columns['sequence'].astype('i8') > latest - n)
+
+    def between(self, start, end):
+        """Return the samples received between the clock times start and end."""
+        return self.select(lambda columns, latest: (columns['time'] >= start) & (columns['time'] <= end))
+
+    def gaps(self):
+        """Return the missing sequence numbers in the history as (first, last) ranges."""
+        with self.lock:
+            if self.latest is None:
+                return []
+
+            sequences = sorted(self.columns['sequence'][index] for index in range(self.capacity) if self.valid[index])
+
+        gaps = []
+        for previous, sequence in zip(sequences, sequences[1:]):
+            if sequence - previous > 1:
+                gaps.append((previous + 1, sequence - 1))
+
+        return gaps
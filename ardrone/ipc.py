@@ -0,0 +1,254 @@
+"""
+This module provides shared memory structures for passing data from the
+ARDroneNetworkProcess to the ARDrone without pickling it through a pipe.
+"""
+
+import ctypes
+import mmap
+import multiprocessing
+import struct
+import time
+
+try:
+    import multiprocessing.shared_memory as shared_memory
+except ImportError:
+    shared_memory = None
+
+import ardrone.navdata
+
+
+class FrameRing(object):
+    """Shared Memory Frame Ring.
+
+    A fixed number of frame slots in shared memory. The network process
+    writes each decoded frame into the next slot and only sends the slot
+    index, size and sequence number over the video pipe. Readers get a
+    read-only view of the slot without copying it.
+
+    The reader pins the frame it currently uses with pin(), and the writer
+    skips the slot of the pinned frame, so the pinned frame stays unchanged
+    until the reader pins another one. Any other slot is reused after
+    slots - 2 further frames, so readers that keep such frames copy them and
+    check valid() after copying.
+    """
+
+    # each slot starts with the sequence number of the frame it holds
+    slot_header = struct.Struct('<Q')
+
+    def __init__(self, slots=3, slot_size=1280*720*3):
+        """
+        Allocate a new frame ring
+
+        Parameters:
+        slots -- number of frame slots (at least 3: the pinned frame, the
+            frame being written and the frame on its way to the reader)
+        slot_size -- maximum size of a decoded frame in bytes
+        """
+        if slots < 3:
+            raise ValueError('a frame ring needs at least 3 slots')
+
+        self.slots = slots
+        self.slot_size = slot_size
+        self.stride = self.slot_header.size + slot_size
+
+        if shared_memory is not None:
+            self.memory = shared_memory.SharedMemory(create=True, size=slots*self.stride)
+            self.buf = self.memory.buf
+        else:
+            # anonymous mappings are shared with forked children
+            self.memory = mmap.mmap(-1, slots*self.stride)
+            self.buf = memoryview(self.memory)
+
+        # sequence number of the frame pinned by the reader (0: none), only
+        # changed together with the slot headers while holding the lock
+        self.pinned = multiprocessing.RawValue(ctypes.c_uint64)
+        self.lock = multiprocessing.Lock()
+
+        self.slot = 0
+        self.sequence = 0
+
+    def __getstate__(self):
+        return (self.slots, self.slot_size, self.memory, self.pinned, self.lock, self.slot, self.sequence)
+
+    def __setstate__(self, state):
+        self.slots, self.slot_size, self.memory, self.pinned, self.lock, self.slot, self.sequence = state
+        self.stride = self.slot_header.size + self.slot_size
+        self.buf = self.memory.buf if shared_memory is not None else memoryview(self.memory)
+
+    def write(self, data):
+        """Copy a frame into the next free slot and return the slot index and sequence number.
+
+        Returns None for a frame larger than the slots.
+        """
+        if len(data) > self.slot_size:
+            return None
+
+        self.sequence += 1
+
+        with self.lock:
+            slot = self.slot
+            if self.pinned.value and self.header(slot) == self.pinned.value:
+                slot = (slot + 1) % self.slots
+
+            start = slot*self.stride
+            # invalidate slot while it is being overwritten
+            self.slot_header.pack_into(self.buf, start, 0)
+
+        self.buf[start + self.slot_header.size:start + self.slot_header.size + len(data)] = data
+        self.slot_header.pack_into(self.buf, start, self.sequence)
+
+        self.slot = (slot + 1) % self.slots
+
+        return slot, self.sequence
+
+    def header(self, slot):
+        """Return the sequence number of the frame in a slot (0 while it is being written)."""
+        return self.slot_header.unpack_from(self.buf, slot*self.stride)[0]
+
+    def view(self, slot, size):
+        """Return a read-only memoryview of the first size bytes of a slot."""
+        start = slot*self.stride + self.slot_header.size
+        view = self.buf[start:start + size]
+        if hasattr(view, 'toreadonly'):
+            view = view.toreadonly()
+        return view
+
+    def valid(self, slot, sequence):
+        """Check whether slot still holds the frame with the given sequence number."""
+        return self.header(slot) == sequence
+
+    def pin(self, slot, sequence):
+        """Keep the frame with the given sequence number in its slot instead of the previously pinned one.
+
+        Returns False (and pins nothing) if the slot no longer holds the
+        frame.
+        """
+        with self.lock:
+            if self.header(slot) != sequence:
+                return False
+
+            self.pinned.value = sequence
+            return True
+
+    def close(self, unlink=False):
+        """Release the shared memory (and remove it with unlink=True)."""
+        self.buf = None
+        try:
+            self.memory.close()
+        except BufferError:
+            # views of the frames are still in use and keep the mapping alive
+            pass
+        if unlink and shared_memory is not None:
+            self.memory.unlink()
+
+
+class NavdataFields(ctypes.Structure):
+    """Fixed layout of the navdata header and demo option."""
+
+    _fields_ = [
+        ('counter', ctypes.c_uint64),
+        ('header', ctypes.c_uint32),
+        ('state', ctypes.c_uint32),
+        ('sequence', ctypes.c_uint32),
+        ('vision', ctypes.c_uint32),
+        ('demo', ctypes.c_uint32),
+        ('ctrl_state', ctypes.c_uint32),
+        ('battery', ctypes.c_uint32),
+        ('theta', ctypes.c_int32),
+        ('phi', ctypes.c_int32),
+        ('psi', ctypes.c_int32),
+        ('altitude', ctypes.c_uint32),
+        ('vx', ctypes.c_float),
+        ('vy', ctypes.c_float),
+        ('vz', ctypes.c_float),
+        ('num_frames', ctypes.c_uint32),
+    ]
+
+
+class NavdataSnapshot(object):
+    """Shared Memory Navdata Snapshot.
+
+    Holds the latest navdata header and demo option in shared memory. The
+    network process overwrites it in place for every packet and readers copy
+    it out without any pickling. Writes are guarded by a sequence counter
+    (odd while a write is in progress) so readers never see a torn snapshot.
+    A reader that cannot get a consistent copy within read_attempts attempts
+    (e.g. because the writer died in the middle of a write) gets the last
+    consistent copy it read instead.
+    """
+
+    demo_fields = ardrone.navdata.OPTIONS[0][2]
+
+    # attempts of read() to copy the snapshot before it gives up
+    read_attempts = 100
+
+    def __init__(self):
+        self.fields = multiprocessing.RawValue(NavdataFields)
+        # last consistent copy read in this process
+        self.last = None
+
+    @property
+    def updates(self):
+        """Number of navdata packets written so far."""
+        return self.fields.counter // 2
+
+    def write(self, navdata):
+        """Overwrite the snapshot with a decoded navdata packet."""
+        fields = self.fields
+
+        fields.counter += 1
+
+        fields.header = navdata['header']
+        fields.state = navdata['state'].value
+        fields.sequence = navdata['sequence']
+        fields.vision = navdata['vision']
+
+        demo = navdata.get('demo')
+        if demo is not None:
+            fields.demo = 1
+            for name in self.demo_fields:
+                setattr(fields, name, demo[name])
+        else:
+            fields.demo = 0
+
+        fields.counter += 1
+
+    def read(self):
+        """Return a consistent private copy of the snapshot or None if nothing was written yet."""
+        fields = self.fields
+        copy = NavdataFields()
+
+        for attempt in range(self.read_attempts):
+            counter = fields.counter
+            # odd while a write is in progress
+            if not counter & 1:
+                ctypes.memmove(ctypes.byref(copy), ctypes.byref(fields), ctypes.sizeof(copy))
+
+                if copy.counter == counter and fields.counter == counter:
+                    if not counter:
+                        return None
+
+                    self.last = copy
+                    return copy
+
+            # let the writer finish
+            time.sleep(0)
+
+        return self.last
+
+    def to_dict(self):
+        """Materialize the snapshot in the format of ardrone.navdata.decode."""
+        copy = self.read()
+        if copy is None:
+            return dict()
+
+        data = dict()
+        data['state'] = dict(ardrone.navdata.State(copy.state))
+        data['header'] = copy.header
+        data['sequence'] = copy.sequence
+        data['vision'] = copy.vision
+
+        if copy.demo:
+            data['demo'] = dict((name, getattr(copy, name)) for name in self.demo_fields)
+
+        return data
@@ -0,0 +1,196 @@
+"""
+This module provides lightweight instrumentation for the AR.Drone data paths.
+"""
+
+import bisect
+import threading
+import time
+
+
+clock = getattr(time, 'monotonic', time.time)
+
+
+# bucket upper bounds in seconds from 100us to about 13s
+LATENCY_BOUNDS = [0.0001 * 1.5**i for i in range(30)]
+
+
+class Histogram(object):
+    """Histogram.
+
+    Counts samples in fixed buckets (by default exponentially growing latency
+    buckets in seconds). Samples are added without locking, so add them from
+    a single thread.
+    """
+
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        self.bounds = list(bounds)
+        self.counts = [0]*(len(self.bounds) + 1)
+
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        """Add a sample."""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """Return the upper bound of the bucket containing the p-th percentile.
+
+        The overflow bucket above the last bound has no upper bound, so
+        there the percentile is interpolated between the last bound and the
+        maximum.
+        """
+        if not self.count:
+            return None
+
+        rank = p/100.0*self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                if index < len(self.bounds):
+                    return min(self.bounds[index], self.max)
+
+                lower = self.bounds[-1]
+                return lower + (self.max - lower)*(rank - (seen - count))/count
+
+        return self.max
+
+    def snapshot(self):
+        """Return a summary of the histogram as a dict.
+
+        buckets are (upper bound, count) pairs, with an upper bound of None
+        for the overflow bucket, so the snapshot can be written as strict
+        JSON.
+        """
+        return {
+            'count': self.count,
+            'mean': self.total/self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': list(zip(self.bounds + [None], self.counts)),
+        }
+
+
+class SharedHistogram(Histogram):
+    """Shared Histogram.
+
+    Histogram kept in shared memory, so it can be filled by a process
+    started after its creation and read by its creator.
+    """
+
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        import multiprocessing
+
+        self.bounds = list(bounds)
+        self.counts = multiprocessing.RawArray('Q', len(self.bounds) + 1)
+        # count, total, min and max (NaN until the first sample)
+        self.values = multiprocessing.RawArray('d', [0.0, 0.0, float('nan'), float('nan')])
+
+    def _value(index):
+        def get(self):
+            value = self.values[index]
+            return None if value != value else value
+
+        def set(self, value):
+            self.values[index] = value
+
+        return property(get, set)
+
+    count = property(lambda self: int(self.values[0]), lambda self, value: self.values.__setitem__(0, value))
+    total = _value(1)
+    min = _value(2)
+    max = _value(3)
+
+    del _value
+
+
+class Metrics(object):
+    """Metrics.
+
+    Named counters and histograms of one data path. With shared=True they
+    live in shared memory (see SharedHistogram). Each counter and histogram
+    should only be updated from a single thread.
+    """
+
+    def __init__(self, counters=(), histograms=(), shared=False):
+        self.names = list(counters)
+        self.index = dict((name, index) for index, name in enumerate(self.names))
+        if shared:
+            import multiprocessing
+
+            self.counters = multiprocessing.RawArray('Q', len(self.names))
+        else:
+            self.counters = [0]*len(self.names)
+
+        histogram = SharedHistogram if shared else Histogram
+        self.histograms = dict((name, histogram()) for name in histograms)
+
+    def __getitem__(self, name):
+        return self.counters[self.index[name]]
+
+    def count(self, name, value=1):
+        """Add value to a counter."""
+        self.counters[self.index[name]] += value
+
+    def observe(self, name, value):
+        """Add a sample to a histogram."""
+        self.histograms[name].add(value)
+
+    def snapshot(self):
+        """Return the counters and histogram summaries as a dict."""
+        snapshot = dict((name, self.counters[index]) for index, name in enumerate(self.names))
+        for name, histogram in self.histograms.items():
+            snapshot[name] = histogram.snapshot()
+
+        return snapshot
+
+
+class Exporter(threading.Thread):
+    """Stats Exporter.
+
+    Appends the result of stats() as a JSON line (with the wall clock time
+    in 'time') to the file at path every interval seconds.
+    """
+
+    def __init__(self, stats, path, interval=1.0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.stats = stats
+        self.path = path
+        self.interval = interval
+
+        self.stopping = threading.Event()
+
+    def run(self):
+        with open(self.path, 'a') as stats_file:
+            while not self.stopping.wait(self.interval):
+                self.export(stats_file)
+
+            # a final snapshot on the way out
+            self.export(stats_file)
+
+    def export(self, stats_file):
+        import json
+
+        # fail rather than write non-standard JSON (Infinity, NaN)
+        stats_file.write(json.dumps(dict(self.stats(), time=time.time()), sort_keys=True, allow_nan=False) + '\n')
+        stats_file.flush()
+
+    def stop(self):
+        """Stop exporting after writing a last snapshot."""
+        self.stopping.set()
+        self.join()
@@ -1,82 +1,635 @@
+"""
+This module decodes the navdata packets sent by the AR.Drone.
+
+decode() returns a packet as a dict of dicts. NavdataView gives the same
+mapping interface over the raw packet and only unpacks the option fields
+and state flags that are actually read.
+"""
+
+import re
 import struct
 
+import ardrone.constant
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+
+# bit positions of the drone state flags in the navdata header
+STATE_BITS = [
+    ('fly',                  0),  # FLY MASK : (0) ardrone is landed, (1) ardrone is flying
+    ('video',                1),  # VIDEO MASK : (0) video disable, (1) video enable
+    ('vision',               2),  # VISION MASK : (0) vision disable, (1) vision enable
+    ('control',              3),  # CONTROL ALGO (0) euler angles control, (1) angular speed control
+    ('altitude',             4),  # ALTITUDE CONTROL ALGO : (0) altitude control inactive (1) altitude control active
+    ('user_feedback_start',  5),  # USER feedback : Start button state
+    ('command',              6),  # Control command ACK : (0) None, (1) one received
+    ('fw_file',              7),  # Firmware file is good (1)
+    ('fw_ver',               8),  # Firmware update is newer (1)
+    ('fw_upd',               9),  # Firmware update is ongoing (1)
+    ('navdata_demo',        10),  # Navdata demo : (0) All navdata, (1) only navdata demo
+    ('navdata_bootstrap',   11),  # Navdata bootstrap : (0) options sent in all or demo mode, (1) no navdata options sent
+    ('motors',              12),  # Motor status : (0) Ok, (1) Motors problem
+    ('com_lost',            13),  # Communication lost : (1) com problem, (0) Com is ok
+    ('vbat_low',            15),  # VBat low : (1) too low, (0) Ok
+    ('user_el',             16),  # User Emergency Landing : (1) User EL is ON, (0) User EL is OFF
+    ('timer_elapsed',       17),  # Timer elapsed : (1) elapsed, (0) not elapsed
+    ('angles_out_of_range', 19),  # Angles : (0) Ok, (1) out of range
+    ('ultrasound',          21),  # Ultrasonic sensor : (0) Ok, (1) deaf
+    ('cutout',              22),  # Cutout system detection : (0) Not detected, (1) detected
+    ('pic_version',         23),  # PIC Version number OK : (0) a bad version number, (1) version number is OK
+    ('atcodec_thread_on',   24),  # ATCodec thread ON : (0) thread OFF (1) thread ON
+    ('navdata_thread_on',   25),  # Navdata thread ON : (0) thread OFF (1) thread ON
+    ('video_thread_on',     26),  # Video thread ON : (0) thread OFF (1) thread ON
+    ('acq_thread_on',       27),  # Acquisition thread ON : (0) thread OFF (1) thread ON
+    ('ctrl_watchdog',       28),  # CTRL watchdog : (1) delay in control execution (> 5ms), (0) control is well scheduled
+    ('adc_watchdog',        29),  # ADC Watchdog : (1) delay in uart2 dsr (> 5ms), (0) uart2 is good
+    ('com_watchdog',        30),  # Communication Watchdog : (1) com problem, (0) Com is ok
+    ('emergency',           31),  # Emergency landing : (0) no emergency, (1) emergency
+]
+
+STATE_NAMES = [name for name, bit in STATE_BITS]
+STATE_SHIFTS = dict(STATE_BITS)
+
+
+# option blocks by id_nr: name, payload layout and field names (a tuple of
+# name and count denotes an array field)
+OPTIONS = {
+    0: ('demo', '<IIfffIfffI', [
+        'ctrl_state', 'battery', 'theta', 'phi', 'psi', 'altitude', 'vx', 'vy', 'vz', 'num_frames',
+    ]),
+    1: ('time', '<I', [
+        'time',
+    ]),
+    2: ('raw_measures', '<3H3h2hIHHHHHHHHHIih', [
+        ('raw_accs', 3), ('raw_gyros', 3), ('raw_gyros_110', 2), 'vbat_raw',
+        'us_debut_echo', 'us_fin_echo', 'us_association_echo', 'us_distance_echo',
+        'us_courbe_temps', 'us_courbe_valeur', 'us_courbe_ref', 'flag_echo_ini', 'nb_echo',
+        'sum_echo', 'alt_temp_raw', 'gradient',
+    ]),
+    3: ('phys_measures', '<fH3f3fIII', [
+        'accs_temp', 'gyro_temp', ('phys_accs', 3), ('phys_gyros', 3), 'alim3v3', 'vref_epson', 'vref_idg',
+    ]),
+    4: ('gyros_offsets', '<3f', [
+        ('offset_g', 3),
+    ]),
+    5: ('euler_angles', '<ff', [
+        'theta_a', 'phi_a',
+    ]),
+    6: ('references', '<8i6fI5fi', [
+        'ref_theta', 'ref_phi', 'ref_theta_i', 'ref_phi_i', 'ref_pitch', 'ref_roll', 'ref_yaw', 'ref_psi',
+        'vx_ref', 'vy_ref', 'theta_mod', 'phi_mod', 'k_v_x', 'k_v_y', 'k_mode',
+        'ui_time', 'ui_theta', 'ui_phi', 'ui_psi', 'ui_psi_accuracy', 'ui_seq',
+    ]),
+    7: ('trims', '<3f', [
+        'angular_rates_trim_r', 'euler_angles_trim_theta', 'euler_angles_trim_phi',
+    ]),
+    8: ('rc_references', '<5i', [
+        'rc_ref_pitch', 'rc_ref_roll', 'rc_ref_yaw', 'rc_ref_gaz', 'rc_ref_ag',
+    ]),
+    9: ('pwm', '<4B4B4f3if3if4H2f', [
+        ('motor', 4), ('sat_motor', 4), 'gaz_feed_forward', 'gaz_altitude', 'altitude_integral', 'vz_ref',
+        'u_pitch', 'u_roll', 'u_yaw', 'yaw_u_i', 'u_pitch_planif', 'u_roll_planif', 'u_yaw_planif',
+        'u_gaz_planif', ('current_motor', 4), 'altitude_prop', 'altitude_der',
+    ]),
+    10: ('altitude', '<ifiiff3fI2fI', [
+        'altitude_vision', 'altitude_vz', 'altitude_ref', 'altitude_raw', 'obs_acc_z', 'obs_alt',
+        ('obs_x', 3), 'obs_state', ('est_vb', 2), 'est_state',
+    ]),
+    11: ('vision_raw', '<3f', [
+        'vision_tx_raw', 'vision_ty_raw', 'vision_tz_raw',
+    ]),
+    12: ('vision_of', '<5f5f', [
+        ('of_dx', 5), ('of_dy', 5),
+    ]),
+    13: ('vision_data', '<Ii4fi3fiI3f3fII2f', [
+        'vision_state', 'vision_misc', 'vision_phi_trim', 'vision_phi_ref_prop', 'vision_theta_trim',
+        'vision_theta_ref_prop', 'new_raw_picture', 'theta_capture', 'phi_capture', 'psi_capture',
+        'altitude_capture', 'time_capture', ('body_v', 3), 'delta_phi', 'delta_theta', 'delta_psi',
+        'gold_defined', 'gold_reset', 'gold_x', 'gold_y',
+    ]),
+    14: ('vision_perf', '<6f20f', [
+        'time_szo', 'time_corners', 'time_compute', 'time_tracking', 'time_trans', 'time_update',
+        ('time_custom', 20),
+    ]),
+    15: ('trackers_send', '<30i60i', [
+        ('locked', 30), ('point', 60),
+    ]),
+    16: ('vision_detect', '<I4I4I4I4I4I4I4f36f12f4I', [
+        'nb_detected', ('type', 4), ('xc', 4), ('yc', 4), ('width', 4), ('height', 4), ('dist', 4),
+        ('orientation_angle', 4), ('rotation', 36), ('translation', 12), ('camera_source', 4),
+    ]),
+    17: ('watchdog', '<I', [
+        'watchdog',
+    ]),
+    18: ('adc_data_frame', '<I32B', [
+        'version', ('data_frame', 32),
+    ]),
+    19: ('video_stream', '<BIIIIfIIIiiiiiII', [
+        'quant', 'frame_size', 'frame_number', 'atcmd_ref_seq', 'atcmd_mean_ref_gap', 'atcmd_var_ref_gap',
+        'atcmd_ref_quality', 'out_bitrate', 'desired_bitrate', 'data1', 'data2', 'data3', 'data4', 'data5',
+        'tcp_queue_level', 'fifo_queue_level',
+    ]),
+    20: ('games', '<II', [
+        'double_tap_counter', 'finish_line_counter',
+    ]),
+    21: ('pressure_raw', '<ihii', [
+        'up', 'ut', 'temperature_meas', 'pression_meas',
+    ]),
+    22: ('magneto', '<3h3f3f3f3fbIf2f', [
+        ('mag', 3), ('magneto_raw', 3), ('magneto_rectified', 3), ('magneto_offset', 3),
+        'heading_unwrapped', 'heading_gyro_unwrapped', 'heading_fusion_unwrapped', 'magneto_calibration_ok',
+        'magneto_state', 'magneto_radius', 'error_mean', 'error_var',
+    ]),
+    23: ('wind_speed', '<13f', [
+        'wind_speed', 'wind_angle', 'wind_compensation_theta', 'wind_compensation_phi',
+        'state_x1', 'state_x2', 'state_x3', 'state_x4', 'state_x5', 'state_x6',
+        'magneto_debug1', 'magneto_debug2', 'magneto_debug3',
+    ]),
+    24: ('kalman_pressure', '<10fififfii', [
+        'offset_pressure', 'est_z', 'est_zdot', 'est_bias_pwm', 'est_biais_pression', 'offset_us',
+        'prediction_us', 'cov_alt', 'cov_pwm', 'cov_vitesse', 'bool_effet_sol', 'somme_inno',
+        'flag_rejet_us', 'u_multisinus', 'gaz_altitude', 'flag_multisinus', 'flag_multisinus_debut',
+    ]),
+    25: ('hdvideo_stream', '<7I', [
+        'hdvideo_state', 'storage_fifo_nb_packets', 'storage_fifo_size', 'usbkey_size',
+        'usbkey_freespace', 'frame_number', 'usbkey_remaining_time',
+    ]),
+    26: ('wifi', '<I', [
+        'link_quality',
+    ]),
+    27: ('zimmu_3000', '<if', [
+        'vzimmu_lsb', 'vzfind',
+    ]),
+    0xffff: ('checksum', '<I', [
+        'checksum',
+    ]),
+}
+
+# demo angles are sent in millidegrees
+DEMO_ANGLES = ['theta', 'phi', 'psi']
+
+# conversions of option fields by option name and field name
+CONVERSIONS = {
+    'demo': dict((a, lambda value: int(value / 1000)) for a in DEMO_ANGLES),
+}
+
+
+_header = struct.Struct('<IIII')
+_option_header = struct.Struct('<HH')
+
+# a struct format item, e.g. '3f'
+_format_item = re.compile(r'(\d*)([xcbB?hHiIlLqQnNefdspP])')
+
+
+class State(Mapping):
+    """Drone state flags of a navdata packet.
+
+    The flags are only extracted from the state word when they are accessed.
+    """
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __getitem__(self, key):
+        return self.value >> STATE_SHIFTS[key] & 1
+
+    def __iter__(self):
+        return iter(STATE_NAMES)
+
+    def __len__(self):
+        return len(STATE_NAMES)
+
+    def __reduce__(self):
+        return (State, (self.value,))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class Option(object):
+    """Precompiled decoder for a single navdata option block."""
+
+    def __init__(self, name, fmt, fields):
+        self.name = name
+        self.struct = struct.Struct(fmt)
+        self.size = self.struct.size
+        self.conversions = CONVERSIONS.get(name, {})
+
+        # one character per value
+        codes = ''.join(code*int(count or 1) for count, code in _format_item.findall(fmt))
+
+        self.names = []
+        self.fields = []
+        # unpack_from, offset, whether it is an array field and conversion by
+        # field name
+        self.readers = dict()
+        index = 0
+        for field in fields:
+            if isinstance(field, tuple):
+                field, count = field
+                self.fields.append((field, index, index + count))
+                self.readers[field] = (struct.Struct('<' + codes[index:index + count]).unpack_from, struct.calcsize('<' + codes[:index]), True, None)
+                index += count
+            else:
+                self.fields.append((field, index, None))
+                self.readers[field] = (struct.Struct('<' + codes[index]).unpack_from, struct.calcsize('<' + codes[:index]), False, self.conversions.get(field))
+                index += 1
+            self.names.append(field)
+
+        self.flat = index == len(self.names)
+
+        if index != len(self.struct.unpack(bytes(bytearray(self.size)))):
+            raise ValueError('fields do not match layout of navdata option {}'.format(name))
+
+    def decode(self, buf, offset):
+        """Decode the option payload starting at offset of buf."""
+        values = self.struct.unpack_from(buf, offset)
+
+        if self.flat:
+            data = dict(zip(self.names, values))
+        else:
+            data = dict((name, values[start] if stop is None else list(values[start:stop])) for name, start, stop in self.fields)
+
+        if self.conversions:
+            for name, conversion in self.conversions.items():
+                data[name] = conversion(data[name])
+
+        return data
+
+    def value(self, buf, offset, name):
+        """Decode a single field of the option payload starting at offset of buf."""
+        unpack_from, field_offset, array, conversion = self.readers[name]
+        values = unpack_from(buf, offset + field_offset)
+        if array:
+            return list(values)
+
+        return values[0] if conversion is None else conversion(values[0])
+
+
+_options = dict((id_nr, Option(*option)) for id_nr, option in OPTIONS.items())
+_options_by_name = dict((option.name, option) for option in _options.values())
+
+HEADER_FIELDS = ('state', 'header', 'sequence', 'vision')
+
+
+class OptionView(Mapping):
+    """Lazily decoded option block of a NavdataView.
+
+    Every access unpacks only the requested field from the packet.
+    """
+
+    __slots__ = ('option', 'buf', 'offset')
+
+    def __init__(self, option, buf, offset):
+        self.option = option
+        self.buf = buf
+        self.offset = offset
+
+    def __getitem__(self, key):
+        return self.option.value(self.buf, self.offset, key)
+
+    def __iter__(self):
+        return iter(self.option.names)
+
+    def __len__(self):
+        return len(self.option.names)
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def to_dict(self):
+        """Decode all fields of the option into a dict."""
+        return self.option.decode(self.buf, self.offset)
+
+
+class NavdataView(Mapping):
+    """Lazily decoded navdata packet.
+
+    Behaves like the dict returned by decode() but only unpacks the header
+    and locates the option blocks when it is created. Option blocks are
+    OptionView mappings that unpack single fields when they are read and
+    state is a State. Use to_dict() for the plain dict of decode().
+
+    A view keeps a reference to packet and pickles as the raw packet.
+
+    Arguments:
+    packet -- bytes-like object containing a single navdata datagram
+    """
+
+    __slots__ = ('packet', 'header', 'state_value', 'sequence', 'vision', 'offsets')
+
+    def __init__(self, packet):
+        self.packet = packet
+        self.header, self.state_value, self.sequence, self.vision = _header.unpack_from(packet, 0)
+
+        # payload offsets by option name
+        self.offsets = offsets = dict()
+        end = len(packet)
+        offset = _header.size
+        while offset + _option_header.size <= end:
+            id_nr, size = _option_header.unpack_from(packet, offset)
+            if offset + size > end:
+                break
+
+            option = _options.get(id_nr)
+            if option is not None and size - _option_header.size >= option.size:
+                offsets[option.name] = offset + _option_header.size
+
+            offset += max(size, _option_header.size)
+
+    def __getitem__(self, key):
+        offset = self.offsets.get(key)
+        if offset is not None:
+            return OptionView(_options_by_name[key], self.packet, offset)
+        elif key == 'state':
+            return State(self.state_value)
+        elif key in HEADER_FIELDS:
+            return getattr(self, key)
+
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in HEADER_FIELDS or key in self.offsets
+
+    def __iter__(self):
+        for key in HEADER_FIELDS:
+            yield key
+        for key in self.offsets:
+            yield key
+
+    def __len__(self):
+        return len(HEADER_FIELDS) + len(self.offsets)
+
+    def __reduce__(self):
+        return (NavdataView, (bytes(self.packet),))
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def to_dict(self):
+        """Decode the packet into the dict returned by decode()."""
+        data = dict()
+        data['state'] = dict(State(self.state_value))
+        data['header'] = self.header
+        data['sequence'] = self.sequence
+        data['vision'] = self.vision
+
+        for name, offset in self.offsets.items():
+            data[name] = _options_by_name[name].decode(self.packet, offset)
+
+        return data
+
 
 def decode(packet):
-    """Decode a navdata packet."""
-    offset = 0
-
-    _ = struct.unpack_from('IIII', packet, offset)
-    s = _[1]
-    state = dict()
-    state['fly']                 = s       & 1  # FLY MASK : (0) ardrone is landed, (1) ardrone is flying
-    state['video']               = s >>  1 & 1  # VIDEO MASK : (0) video disable, (1) video enable
-    state['vision']              = s >>  2 & 1  # VISION MASK : (0) vision disable, (1) vision enable
-    state['control']             = s >>  3 & 1  # CONTROL ALGO (0) euler angles control, (1) angular speed control
-    state['altitude']            = s >>  4 & 1  # ALTITUDE CONTROL ALGO : (0) altitude control inactive (1) altitude control active
-    state['user_feedback_start'] = s >>  5 & 1  # USER feedback : Start button state
-    state['command']             = s >>  6 & 1  # Control command ACK : (0) None, (1) one received
-    state['fw_file']             = s >>  7 & 1  # Firmware file is good (1)
-    state['fw_ver']              = s >>  8 & 1  # Firmware update is newer (1)
-    state['fw_upd']              = s >>  9 & 1  # Firmware update is ongoing (1)
-    state['navdata_demo']        = s >> 10 & 1  # Navdata demo : (0) All navdata, (1) only navdata demo
-    state['navdata_bootstrap']   = s >> 11 & 1  # Navdata bootstrap : (0) options sent in all or demo mode, (1) no navdata options sent
-    state['motors']              = s >> 12 & 1  # Motor status : (0) Ok, (1) Motors problem
-    state['com_lost']            = s >> 13 & 1  # Communication lost : (1) com problem, (0) Com is ok
-    state['vbat_low']            = s >> 15 & 1  # VBat low : (1) too low, (0) Ok
-    state['user_el']             = s >> 16 & 1  # User Emergency Landing : (1) User EL is ON, (0) User EL is OFF
-    state['timer_elapsed']       = s >> 17 & 1  # Timer elapsed : (1) elapsed, (0) not elapsed
-    state['angles_out_of_range'] = s >> 19 & 1  # Angles : (0) Ok, (1) out of range
-    state['ultrasound']          = s >> 21 & 1  # Ultrasonic sensor : (0) Ok, (1) deaf
-    state['cutout']              = s >> 22 & 1  # Cutout system detection : (0) Not detected, (1) detected
-    state['pic_version']         = s >> 23 & 1  # PIC Version number OK : (0) a bad version number, (1) version number is OK
-    state['atcodec_thread_on']   = s >> 24 & 1  # ATCodec thread ON : (0) thread OFF (1) thread ON
-    state['navdata_thread_on']   = s >> 25 & 1  # Navdata thread ON : (0) thread OFF (1) thread ON
-    state['video_thread_on']     = s >> 26 & 1  # Video thread ON : (0) thread OFF (1) thread ON
-    state['acq_thread_on']       = s >> 27 & 1  # Acquisition thread ON : (0) thread OFF (1) thread ON
-    state['ctrl_watchdog']       = s >> 28 & 1  # CTRL watchdog : (1) delay in control execution (> 5ms), (0) control is well scheduled
-    state['adc_watchdog']        = s >> 29 & 1  # ADC Watchdog : (1) delay in uart2 dsr (> 5ms), (0) uart2 is good
-    state['com_watchdog']        = s >> 30 & 1  # Communication Watchdog : (1) com problem, (0) Com is ok
-    state['emergency']           = s >> 31 & 1  # Emergency landing : (0) no emergency, (1) emergency
+    """Decode a navdata packet.
+
+    Arguments:
+    packet -- bytes-like object containing a single navdata datagram
+    """
+    buf = memoryview(packet)
+    end = len(buf)
+
+    header, state, sequence, vision = _header.unpack_from(buf, 0)
 
     data = dict()
-    data['state'] = state
-    data['header'] = _[0]
-    data['sequence'] = _[2]
-    data['vision'] = _[3]
-
-    offset += struct.calcsize('IIII')
-
-    demo_fields = [
-        'ctrl_state',
-        'battery',
-        'theta',
-        'phi',
-        'psi',
-        'altitude',
-        'vx',
-        'vy',
-        'vz',
-        'num_frames'
+    data['state'] = dict(State(state))
+    data['header'] = header
+    data['sequence'] = sequence
+    data['vision'] = vision
+
+    offset = _header.size
+    while offset + _option_header.size <= end:
+        id_nr, size = _option_header.unpack_from(buf, offset)
+        if offset + size > end:
+            break
+
+        option = _options.get(id_nr)
+        if option is not None and size - _option_header.size >= option.size:
+            data[option.name] = option.decode(buf, offset + _option_header.size)
+
+        offset += max(size, _option_header.size)
+
+    return data
+
+
+# NumPy types of the struct format codes of the demo option
+_numpy_types = {'I': '<u4', 'i': '<i4', 'f': '<f4'}
+
+_demo_option = _options_by_name['demo']
+_demo_codes = ''.join(code*int(count or 1) for count, code in _format_item.findall(OPTIONS[0][1]))
+# name, NumPy type and payload offset of the demo fields
+_demo_fields = [
+    (name, _numpy_types[code], struct.calcsize('<' + _demo_codes[:index]))
+    for index, (name, code) in enumerate(zip(OPTIONS[0][2], _demo_codes))
+]
+
+# fields of the structured arrays returned by decode_many(): the header
+# fields, whether the packet had a demo option and the demo fields (zero
+# without a demo option, with the angles in degrees)
+MANY_FIELDS = [('sequence', '<u4'), ('state', '<u4'), ('vision', '<u4'), ('demo', '?')] + [(name, numpy_type) for name, numpy_type, offset in _demo_fields]
+
+# bytes of navdata handled per worker task by decode_many()
+MANY_CHUNK_SIZE = 32*1024*1024
+
+_navdata_magic = struct.pack('<I', ardrone.constant.NAVDATA_HEADER)
+_checksum_id = 0xffff
+
+
+def _layout(buf, offset, end):
+    """Return the size and demo option offset (or None) of the packet at offset.
+
+    The size is None if there is no complete packet ending with a checksum
+    option at offset.
+    """
+    if offset + _header.size > end or buf[offset:offset + 4] != _navdata_magic:
+        return None, None
+
+    position = offset + _header.size
+    demo = None
+    while position + _option_header.size <= end:
+        id_nr, size = _option_header.unpack_from(buf, position)
+        if size < _option_header.size or position + size > end:
+            break
+
+        if id_nr == 0 and size - _option_header.size >= _demo_option.size:
+            demo = position - offset
+        position += size
+
+        if id_nr == _checksum_id:
+            return position - offset, demo
+
+    return None, None
+
+
+def _run_dtype(numpy, size, demo):
+    """Return the dtype of packets of size bytes with the demo option at demo."""
+    fields = [
+        ('header', '<u4', 0),
+        ('state', '<u4', 4),
+        ('sequence', '<u4', 8),
+        ('vision', '<u4', 12),
+        ('first_id', '<u2', 16),
+        ('checksum_id', '<u2', size - 8),
+        ('checksum_size', '<u2', size - 6),
     ]
-    angles = ['theta', 'phi', 'psi']
-    while True:
+    if demo is not None:
+        fields.append(('demo_id', '<u2', demo))
+        fields.extend((name, numpy_type, demo + _option_header.size + offset) for name, numpy_type, offset in _demo_fields)
+
+    names, formats, offsets = zip(*fields)
+    return numpy.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': size})
+
+
+def _decode_range(buf, start, end):
+    """Decode the packets between start and end of buf into a structured array."""
+    import numpy
+
+    runs = []
+    position = start
+    while position < end:
+        size, demo = _layout(buf, position, end)
+        if size is None:
+            # skip garbage up to the next packet header
+            position = buf.find(_navdata_magic, position + 1, end)
+            if position < 0:
+                break
+            continue
+
+        # view the following packets with the same layout as one array and
+        # check them in growing windows, so a change of layout costs little
+        count = (end - position)//size
+        view = numpy.ndarray((count,), _run_dtype(numpy, size, demo), buf, position)
+        first_id = view['first_id'][0]
+        run = 1
+        window = 64
+        while run < count:
+            window_view = view[run:run + window]
+            valid = (window_view['header'] == ardrone.constant.NAVDATA_HEADER) & (window_view['first_id'] == first_id) & (window_view['checksum_id'] == _checksum_id) & (window_view['checksum_size'] == 8)
+            if demo is not None:
+                valid &= window_view['demo_id'] == 0
+            if not valid.all():
+                run += int(valid.argmin())
+                break
+            run += len(window_view)
+            window *= 2
+
+        runs.append((view[:run], demo is not None))
+        position += run*size
+
+    result = numpy.zeros(sum(len(view) for view, has_demo in runs), MANY_FIELDS)
+    index = 0
+    for view, has_demo in runs:
+        rows = result[index:index + len(view)]
+        for name in ('sequence', 'state', 'vision'):
+            rows[name] = view[name]
+        if has_demo:
+            rows['demo'] = True
+            for name, numpy_type, offset in _demo_fields:
+                rows[name] = view[name]
+        index += len(view)
+
+    for name in DEMO_ANGLES:
+        result[name] /= 1000
+
+    return result
+
+
+def _decode_file_range(path, start, end):
+    import mmap
+
+    with open(path, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
         try:
-            id_nr, size = struct.unpack_from('HH', packet, offset)
-            offset += struct.calcsize('HH')
-        except struct.error:
-            break
+            return _decode_range(buf, start, end)
+        finally:
+            buf.close()
 
-        values = []
-        for i in range(size - struct.calcsize('HH')):
-            values.append(struct.unpack_from('c', packet, offset)[0])
-            offset += struct.calcsize('c')
 
-        if id_nr == 0:
-            values = struct.unpack_from('IIfffIfffI', b''.join(values))
-            demo = dict(zip(demo_fields, values))
-            for a in angles:
-                demo[a] = int(demo[a] / 1000)
+def _decode_bytes(data):
+    return _decode_range(data, 0, len(data))
 
-            data['demo'] = demo
 
-    return data
+def _split(buf, end, chunk_size):
+    """Return (start, end) ranges of about chunk_size bytes starting at packet headers."""
+    ranges = []
+    start = 0
+    while start < end:
+        split = buf.find(_navdata_magic, start + chunk_size, end) if start + chunk_size < end else -1
+        while split >= 0 and _layout(buf, split, end)[0] is None:
+            split = buf.find(_navdata_magic, split + 1, end)
+        if split < 0:
+            split = end
+        ranges.append((start, split))
+        start = split
+
+    return ranges
+
+
+def decode_many(source, processes=None, chunk_size=MANY_CHUNK_SIZE):
+    """Decode many concatenated navdata packets into a NumPy structured array.
+
+    Arguments:
+    source -- bytes-like object, path (str or os.PathLike) or binary file
+        of concatenated navdata datagrams (files with a path are read
+        through mmap, others with read())
+    processes -- number of worker processes (None: one per CPU) inputs of
+        more than chunk_size bytes are split across
+    chunk_size -- approximate number of bytes per worker task
+
+    Returns one row per packet with the fields of MANY_FIELDS (e.g.
+    result['altitude'] is a column). Runs of packets with the same layout
+    (the same option blocks) are read with a single NumPy view instead of
+    packet by packet. Bytes that are not part of a packet ending with a
+    checksum option are skipped.
+    """
+    import mmap
+    import os
+
+    import numpy
+
+    path = None
+    if isinstance(source, str) or hasattr(source, '__fspath__'):
+        path = os.fspath(source)
+    elif hasattr(source, 'read'):
+        name = getattr(source, 'name', None)
+        if isinstance(name, (str, bytes)) or hasattr(name, '__fspath__'):
+            path = os.fspath(name)
+        else:
+            # e.g. io.BytesIO or a file opened from a descriptor
+            source = source.read()
+            if not isinstance(source, (bytes, bytearray)):
+                raise TypeError('navdata must be read from a binary file, not a {}'.format(type(source).__name__))
+
+    if path is not None:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return numpy.zeros(0, MANY_FIELDS)
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+        buf = source if hasattr(source, 'find') else bytes(source)
+
+    try:
+        end = len(buf)
+        if processes is None:
+            processes = os.cpu_count() or 1
+        if processes == 1 or end <= chunk_size:
+            return _decode_range(buf, 0, end)
+
+        import concurrent.futures
+
+        ranges = _split(buf, end, chunk_size)
+        with concurrent.futures.ProcessPoolExecutor(min(processes, len(ranges))) as executor:
+            if path is not None:
+                # workers map the file themselves instead of receiving data
+                futures = [executor.submit(_decode_file_range, path, start, stop) for start, stop in ranges]
+            else:
+                futures = [executor.submit(_decode_bytes, bytes(buf[start:stop])) for start, stop in ranges]
+            return numpy.concatenate([future.result() for future in futures])
+    finally:
+        if path is not None:
+            buf.close()
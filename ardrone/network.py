@@ -2,84 +2,301 @@
 This module provides access to the data provided by the AR.Drone.
 """
 
+import errno
 import select
 import socket
 import struct
 import threading
 import multiprocessing
 
-import PIL.Image
-
 import ardrone.constant
+import ardrone.metrics
 import ardrone.navdata
-import ardrone.video
+import ardrone.output
+import ardrone.recorder
+import ardrone.relay
+import ardrone.pave
+
+
+def stream_metrics(shared=False):
+    """Return the navdata and video ardrone.metrics.Metrics of a drone.
+
+    navdata counts received packets and bytes, undecodable packets (errors),
+    packets missing from the sequence (lost), packets that arrived after a
+    newer one (reordered) and repeated packets (duplicates); video counts
+    received bytes, frames overwritten in the frame ring before they were
+    read (stale) and frames too large for the frame ring (oversize). Both count failed socket reads of a fleet drone
+    (socket_errors). Histograms hold the time to read (video only) and decode, the
+    time spent in the pipe to the drone object (pipe) and the time from
+    reception until delivery to the drone object (age).
+    """
+    return {
+        'navdata': ardrone.metrics.Metrics(['packets', 'bytes', 'errors', 'lost', 'reordered', 'duplicates', 'socket_errors'], ['decode', 'pipe', 'age'], shared),
+        'video': ardrone.metrics.Metrics(['bytes', 'stale', 'oversize', 'socket_errors'], ['read', 'decode', 'pipe', 'age'], shared),
+    }
+
+
+# navdata state word and sequence number (after the header word)
+_state_sequence = struct.Struct('<II')
+_state_offset = 4
+
+# state flags set while the drone (re)starts its navdata sequence
+_restart_flags = 1 << ardrone.navdata.STATE_SHIFTS['navdata_bootstrap'] | 1 << ardrone.navdata.STATE_SHIFTS['com_watchdog']
+
+
+class NavdataReceiver(object):
+    """Navdata Receiver.
+
+    Drains the datagrams pending on a non-blocking navdata socket with one
+    recv_into per datagram into a preallocated pool of batch buffers, so
+    receiving a packet allocates nothing. A packet is only copied (to bytes
+    of its own size) once it is accepted:
+
+    - a batch is ordered by navdata sequence number, so packets reordered
+      within a burst are handled in order
+    - packets with a sequence number not newer than the last accepted one
+      are dropped and counted as reordered or duplicates
+    - skipped sequence numbers are counted as lost (packets arriving late
+      are therefore counted as lost and as reordered)
+    - a packet with the navdata bootstrap or com watchdog flag set (like
+      the SDK does), with the first sequence number of a restarted drone or
+      with a sequence number more than window below the last one means that
+      the drone restarted its sequence and is accepted
+
+    Parameters:
+    sock -- navdata socket
+    metrics -- navdata ardrone.metrics.Metrics (see stream_metrics())
+    batch -- maximum number of datagrams per receive()
+    buffer_size -- SO_RCVBUF size of the socket in bytes (None: keep the
+        system default)
+    window -- how many sequence numbers a packet may lag behind before it
+        is taken for a restarted sequence
+    """
+
+    def __init__(self, sock, metrics, batch=32, buffer_size=256*1024, window=256):
+        self.sock = sock
+        self.metrics = metrics
+        self.window = window
+
+        if buffer_size is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, buffer_size)
+
+        self.buffers = [memoryview(bytearray(ardrone.constant.NAVDATA_MAX_SIZE)) for _ in range(batch)]
+        self.last = None
+
+    def receive(self):
+        """Return the accepted packets pending on the socket (as bytes) in sequence order.
+
+        Returns an empty list when no datagram is pending.
+        """
+        metrics = self.metrics
+
+        pending = []
+        for buf in self.buffers:
+            try:
+                size = self.sock.recv_into(buf)
+            except socket.error as err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+
+            metrics.count('packets')
+            metrics.count('bytes', size)
+            if size < _state_offset + _state_sequence.size:
+                metrics.count('errors')
+                continue
+
+            state, sequence = _state_sequence.unpack_from(buf, _state_offset)
+            pending.append((sequence, state, size, buf))
+
+        if len(pending) > 1:
+            pending.sort(key=lambda packet: packet[0])
+
+        packets = []
+        for sequence, state, size, buf in pending:
+            last = self.last
+            if last is not None and (state & _restart_flags or sequence < last and sequence <= ardrone.constant.NAVDATA_SEQUENCE_DEFAULT):
+                # the drone restarted its sequence
+                last = None
+            elif last is not None and sequence <= last and sequence + self.window > last:
+                metrics.count('duplicates' if sequence == last else 'reordered')
+                continue
+
+            if last is not None and sequence > last + 1:
+                metrics.count('lost', sequence - last - 1)
+            self.last = sequence
+
+            packets.append(bytes(buf[:size]))
+
+        return packets
 
 
 class ARDroneNetworkProcess(multiprocessing.Process):
     """ARDrone Network Process.
 
     This process collects data from the video and navdata port, converts the
-    data and sends it to the IPCThread.
+    data and sends it to the IPCThread. The navdata and video paths are
+    instrumented with the (shared) metrics of stream_metrics().
     """
 
-    def __init__(self, host, nav_pipe, video_pipe, com_pipe):
+    # seconds between checks whether the workers should stop
+    poll_interval = 0.1
+
+    def __init__(self, host, nav_pipe, video_pipe, com_pipe, *, frame_ring=None, navdata_snapshot=None, frame_counters=None, pixel_format='rgb24', record=None, metrics=None, video=True, navdata_buffer=256*1024, video_size=None, video_crop=None, relay=None, relay_policy=ardrone.relay.SKIP):
         multiprocessing.Process.__init__(self)
         self.nav_pipe = nav_pipe
         self.video_pipe = video_pipe
         self.com_pipe = com_pipe
+        self.frame_ring = frame_ring
+        self.navdata_snapshot = navdata_snapshot
+        self.frame_counters = frame_counters
+        self.pixel_format = pixel_format
+        self.video_size = video_size or (0, 0)
+        self.video_crop = video_crop
+        self.relay = relay
+        self.relay_policy = relay_policy
+        self.record = record
+        self.metrics = metrics if metrics is not None else stream_metrics()
+        self.video = video
+        self.navdata_buffer = navdata_buffer
         self.host = host
 
     def run(self):
-        video_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        video_socket.connect((self.host, ardrone.constant.VIDEO_PORT))
-
         nav_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         nav_socket.setblocking(False)
         nav_socket.sendto(b'\x01\x00\x00\x00', (self.host, ardrone.constant.NAVDATA_PORT))
 
-        stopping = False
-        while not stopping:
-            inputready, outputready, exceptready = select.select([nav_socket, video_socket, self.com_pipe], [], [])
-            for i in inputready:
-                if i == video_socket:
-                    # get first few bytes of header
-                    data = video_socket.recv(12, socket.MSG_WAITALL)
-                    if len(data) != 12:
-                        continue
+        # the recorder is opened in this process and shared by the workers
+        self.recorder = ardrone.recorder.Recorder(self.record) if self.record is not None else None
+        self.video_relay = ardrone.relay.Relay(self.relay, self.relay_policy) if self.relay is not None and self.video else None
 
-                    # decode relevant portions of the header
-                    sig_p, sig_a, sig_v, sig_e, version, codec, header, payload = struct.unpack('4cBBHI', data)
+        # navdata and video are received in independent threads so that
+        # navdata is never delayed by video decoding
+        self.stopping = threading.Event()
+        workers = [threading.Thread(target=self.receive_navdata, args=(nav_socket,))]
 
-                    # check signature (and ignore packet otherwise)
-                    if sig_p != b'P' or sig_a != b'a' or sig_v != b'V' or sig_e != b'E':
-                        continue
+        video_socket = None
+        if self.video:
+            video_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            video_socket.connect((self.host, ardrone.constant.VIDEO_PORT))
+            video_socket.setblocking(False)
+            workers.append(threading.Thread(target=self.receive_video, args=(video_socket,)))
 
-                    # get remaining frame
-                    data += video_socket.recv(header - 12 + payload, socket.MSG_WAITALL)
-
-                    try:
-                        # decode the frame
-                        image = ardrone.video.decode(data)
-                        self.video_pipe.send(image)
-                    except ardrone.video.DecodeError:
-                        pass
-                elif i == nav_socket:
-                    while 1:
-                        try:
-                            data = nav_socket.recvfrom(65535)
-                        except IOError:
-                            # we consumed every packet from the socket and
-                            # continue with the last one
-                            break
-                    navdata = ardrone.navdata.decode(data)
-                    self.nav_pipe.send(navdata)
-                elif i == self.com_pipe:
-                    _ = self.com_pipe.recv()
-                    stopping = True
-                    break
-        video_socket.close()
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        _ = self.com_pipe.recv()
+
+        self.stopping.set()
+        for worker in workers:
+            worker.join()
+
+        if video_socket is not None:
+            video_socket.close()
         nav_socket.close()
 
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.video_relay is not None:
+            self.video_relay.close()
+
+    def receive_navdata(self, nav_socket):
+        """Receive, decode and forward every new navdata packet."""
+        metrics = self.metrics['navdata']
+        receiver = NavdataReceiver(nav_socket, metrics, buffer_size=self.navdata_buffer)
+
+        while not self.stopping.is_set():
+            inputready, outputready, exceptready = select.select([nav_socket], [], [], self.poll_interval)
+            if not inputready:
+                continue
+
+            received = ardrone.metrics.clock()
+            packets = receiver.receive()
+
+            start = ardrone.metrics.clock()
+            navdata = []
+            for data in packets:
+                if self.recorder is not None:
+                    self.recorder.navdata(data, received)
+
+                try:
+                    navdata.append(ardrone.navdata.NavdataView(data))
+                except struct.error:
+                    metrics.count('errors')
+            if not navdata:
+                continue
+
+            # per packet
+            metrics.observe('decode', (ardrone.metrics.clock() - start)/len(navdata))
+
+            if self.navdata_snapshot is not None:
+                # overwrite the shared snapshot in place (only the latest
+                # packet of a burst is visible anyway)
+                self.navdata_snapshot.write(navdata[-1])
+            else:
+                # a burst is sent as one message
+                self.nav_pipe.send((received, ardrone.metrics.clock(), navdata))
+
+    def receive_video(self, video_socket):
+        """Receive, schedule, decode and forward video frames."""
+        import ardrone.video
+
+        video_reader = ardrone.pave.FrameReader(video_socket)
+        video_scheduler = ardrone.pave.FrameScheduler(counters=self.frame_counters)
+        metrics = self.metrics['video']
+
+        while not self.stopping.is_set():
+            if not video_reader.closed:
+                # do not wait for input while there are frames to decode
+                inputready, outputready, exceptready = select.select([video_socket], [], [], 0 if video_scheduler.pending() else self.poll_interval)
+                if inputready:
+                    start = ardrone.metrics.clock()
+                    buffered = len(video_reader.buf)
+                    video_reader.fill()
+                    metrics.count('bytes', max(len(video_reader.buf) - buffered, 0))
+                    frames = video_reader.frames()
+                    if frames:
+                        metrics.observe('read', ardrone.metrics.clock() - start)
+                    if self.recorder is not None:
+                        for frame in frames:
+                            self.recorder.video(frame)
+                    if self.video_relay is not None:
+                        for frame in frames:
+                            self.video_relay.publish(frame)
+                    video_scheduler.extend(frames)
+            elif not video_scheduler.pending():
+                self.stopping.wait(self.poll_interval)
+                continue
+
+            # decode at most one frame per iteration so we can skip ahead
+            frame = video_scheduler.next()
+            if frame is None:
+                continue
+
+            start = ardrone.metrics.clock()
+            try:
+                # decode the frame
+                width, height, image = ardrone.video.decode(frame.data, self.pixel_format, self.video_size[0], self.video_size[1], self.video_crop)
+            except (ardrone.video.DecodeError, ValueError):
+                # a ValueError means that video_crop does not fit the frames
+                video_scheduler.error()
+                continue
+            metrics.observe('decode', ardrone.metrics.clock() - start)
+
+            video_scheduler.decoded()
+
+            if self.frame_ring is not None:
+                # only send the location of the frame
+                location = self.frame_ring.write(image)
+                if location is None:
+                    metrics.count('oversize')
+                    continue
+                slot, sequence = location
+                self.video_pipe.send((frame.received, ardrone.metrics.clock(), slot, width, height, sequence))
+            else:
+                self.video_pipe.send((frame.received, ardrone.metrics.clock(), width, height, image))
+
 
 class IPCThread(threading.Thread):
     """Inter Process Communication Thread.
@@ -95,15 +312,74 @@ class IPCThread(threading.Thread):
 
     def run(self):
         while not self.stopping:
-            inputready, outputready, exceptready = select.select([self.drone.video_pipe, self.drone.nav_pipe], [], [], 1)
+            pipes = [self.drone.video_pipe]
+            if self.drone.navdata_snapshot is None:
+                pipes.append(self.drone.nav_pipe)
+            inputready, outputready, exceptready = select.select(pipes, [], [], 1)
             for i in inputready:
                 if i == self.drone.video_pipe:
+                    output = self.drone.output
+                    frame_ring = self.drone.frame_ring
+                    metrics = self.drone.metrics['video']
+                    latest = None
                     while self.drone.video_pipe.poll():
-                        width, height, image = self.drone.video_pipe.recv()
-                    self.drone.image = PIL.Image.frombuffer('RGB', (width, height), image, 'raw', 'RGB', 0, 1)
+                        if frame_ring is not None:
+                            received, sent, slot, width, height, sequence = self.drone.video_pipe.recv()
+                        else:
+                            received, sent, width, height, image = self.drone.video_pipe.recv()
+                        now = ardrone.metrics.clock()
+                        metrics.observe('pipe', now - sent)
+                        metrics.observe('age', now - received)
+
+                        publish = bool(self.drone.frame_subscribers)
+                        if not publish and self.drone.video_pipe.poll():
+                            # only the latest frame is kept
+                            continue
+
+                        if frame_ring is not None:
+                            if publish:
+                                # subscribers keep frames for longer than
+                                # the writer keeps them in the ring, so they
+                                # get a copy (dropped if the writer started
+                                # overwriting the slot before it was done)
+                                image = bytes(frame_ring.view(slot, ardrone.output.size(output, width, height)))
+                                if not frame_ring.valid(slot, sequence):
+                                    metrics.count('stale')
+                                    continue
+                            latest = (slot, sequence, width, height)
+                        else:
+                            latest = (image, width, height)
+
+                        if publish:
+                            self.drone.frame_subscribers.publish(ardrone.output.convert(output, image, width, height))
+                    if latest is None:
+                        continue
+                    if frame_ring is not None:
+                        # the latest frame stays in its slot until the next
+                        # one is pinned
+                        slot, sequence, width, height = latest
+                        if not frame_ring.pin(slot, sequence):
+                            metrics.count('stale')
+                            continue
+                        image = frame_ring.view(slot, ardrone.output.size(output, width, height))
+                        if output == ardrone.output.GRAY_PLANE:
+                            self.drone.frame = image.cast('B', (height, width))
+                        elif output != ardrone.output.YUV_PLANES:
+                            self.drone.frame = image.cast('B', (height, width, 3))
+                    else:
+                        image, width, height = latest
+                    self.drone.image = ardrone.output.convert(output, image, width, height)
                 elif i == self.drone.nav_pipe:
+                    metrics = self.drone.metrics['navdata']
                     while self.drone.nav_pipe.poll():
-                        navdata = self.drone.nav_pipe.recv()
+                        received, sent, burst = self.drone.nav_pipe.recv()
+                        now = ardrone.metrics.clock()
+                        for navdata in burst:
+                            metrics.observe('pipe', now - sent)
+                            metrics.observe('age', now - received)
+                            if self.drone.history is not None:
+                                self.drone.history.append(navdata, received)
+                            self.drone.acks.update(navdata['state'].value)
                     self.drone.navdata = navdata
 
     def stop(self):
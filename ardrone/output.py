@@ -0,0 +1,131 @@
+"""
+This module converts decoded video frames into the output formats of an
+ARDrone.
+"""
+
+import ardrone.constant
+
+
+# output formats
+PIL_IMAGE = 'pil'
+NUMPY_ARRAY = 'numpy'
+YUV_PLANES = 'yuv'
+GRAY_PLANE = 'gray'
+
+# pixel format the decoder produces for each output format
+PIXEL_FORMATS = {
+    PIL_IMAGE: 'rgb24',
+    NUMPY_ARRAY: 'rgb24',
+    YUV_PLANES: 'yuv420p',
+    GRAY_PLANE: 'gray8',
+}
+
+
+def check(output):
+    """Raise ValueError for an unknown output format."""
+    if output not in PIXEL_FORMATS:
+        raise ValueError('output must be one of {}'.format(', '.join(sorted(PIXEL_FORMATS))))
+
+
+def check_video(video_size, video_crop):
+    """Raise ValueError for a video_size or video_crop the decoder would reject.
+
+    video_size is None or a (width, height) pair of sizes from 0 (keep the
+    aspect ratio) to ardrone.constant.VIDEO_MAX_SIDE and video_crop None or
+    an (x, y, width, height) region within the largest frame of the drone.
+    """
+    if video_size is not None:
+        if len(video_size) != 2 or not all(isinstance(side, int) for side in video_size):
+            raise ValueError('video_size must be a (width, height) pair of ints')
+        if not all(0 <= side <= ardrone.constant.VIDEO_MAX_SIDE for side in video_size):
+            raise ValueError('video_size must be between 0 and {:d}'.format(ardrone.constant.VIDEO_MAX_SIDE))
+
+    if video_crop is not None:
+        if len(video_crop) != 4 or not all(isinstance(value, int) for value in video_crop):
+            raise ValueError('video_crop must be an (x, y, width, height) tuple of ints')
+        x, y, width, height = video_crop
+        if x < 0 or y < 0 or width <= 0 or height <= 0 or x + width > ardrone.constant.VIDEO_MAX_WIDTH or y + height > ardrone.constant.VIDEO_MAX_HEIGHT:
+            raise ValueError('video_crop must lie within a {:d}x{:d} frame'.format(ardrone.constant.VIDEO_MAX_WIDTH, ardrone.constant.VIDEO_MAX_HEIGHT))
+
+
+def frame_size(video_size, video_crop):
+    """Return the largest (width, height) of the frames decoded with video_size and video_crop.
+
+    Like the decoder, a missing side of video_size keeps the aspect ratio of
+    the (cropped) frame, which is at most the largest frame of the drone.
+    """
+    if video_crop is not None:
+        crop_width, crop_height = video_crop[2:]
+    else:
+        crop_width, crop_height = ardrone.constant.VIDEO_MAX_WIDTH, ardrone.constant.VIDEO_MAX_HEIGHT
+
+    width, height = video_size or (0, 0)
+    if width == 0 and height == 0:
+        return crop_width, crop_height
+    elif width == 0:
+        width = (crop_width*height + crop_height//2)//crop_height
+    elif height == 0:
+        height = (crop_height*width + crop_width//2)//crop_width
+
+    return min(width, ardrone.constant.VIDEO_MAX_SIDE), min(height, ardrone.constant.VIDEO_MAX_SIDE)
+
+
+def size(output, width, height):
+    """Return the size in bytes of a decoded frame buffer for the output format."""
+    if PIXEL_FORMATS[output] == 'yuv420p':
+        return width*height + 2*((width + 1)//2)*((height + 1)//2)
+    elif PIXEL_FORMATS[output] == 'gray8':
+        return width*height
+
+    return width*height*3
+
+
+def yuv_planes(buf, width, height):
+    """Split a yuv420p buffer into (Y, U, V) 2-D memoryviews without copying."""
+    chroma_width, chroma_height = (width + 1)//2, (height + 1)//2
+    luma_size, chroma_size = width*height, chroma_width*chroma_height
+
+    view = memoryview(buf)
+    return (
+        view[:luma_size].cast('B', (height, width)),
+        view[luma_size:luma_size + chroma_size].cast('B', (chroma_height, chroma_width)),
+        view[luma_size + chroma_size:luma_size + 2*chroma_size].cast('B', (chroma_height, chroma_width)),
+    )
+
+
+def convert(output, buf, width, height):
+    """Convert a decoded frame buffer to the output format.
+
+    Arguments:
+    output -- PIL_IMAGE: a PIL image, NUMPY_ARRAY: a (height, width, 3)
+        uint8 RGB array, YUV_PLANES: (Y, U, V) planes as 2-D memoryviews
+        (use numpy.asarray on them for arrays), GRAY_PLANE: the luma plane
+        as a 2-D memoryview
+    buf -- the buffer returned by the decoder for the pixel format of output
+    width, height -- size of the frame
+
+    NUMPY_ARRAY, YUV_PLANES and GRAY_PLANE frames share the memory of buf instead of
+    copying it.
+    """
+    if output == PIL_IMAGE:
+        import PIL.Image
+
+        return PIL.Image.frombuffer('RGB', (width, height), buf, 'raw', 'RGB', 0, 1)
+    elif output == NUMPY_ARRAY:
+        import numpy
+
+        return numpy.frombuffer(buf, dtype=numpy.uint8, count=width*height*3).reshape((height, width, 3))
+    elif output == GRAY_PLANE:
+        return memoryview(buf)[:width*height].cast('B', (height, width))
+    else:
+        return yuv_planes(buf, width, height)
+
+
+def blank(output, width=640, height=360):
+    """Return a black frame in the output format."""
+    if output == PIL_IMAGE:
+        import PIL.Image
+
+        return PIL.Image.new('RGB', (width, height))
+
+    return None
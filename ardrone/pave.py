@@ -0,0 +1,209 @@
+"""
+This module reads and schedules the PaVE framed H.264 video stream of the
+AR.Drone.
+"""
+
+import collections
+import ctypes
+import errno
+import socket
+import struct
+
+import ardrone.constant
+import ardrone.metrics
+
+
+HEADER = struct.Struct('<4sBBHIHHHHIIBBBBIIHBBBB2sI12s')
+
+Header = collections.namedtuple('Header', [
+    'signature',
+    'version',
+    'video_codec',
+    'header_size',
+    'payload_size',
+    'encoded_stream_width',
+    'encoded_stream_height',
+    'display_width',
+    'display_height',
+    'frame_number',
+    'timestamp',
+    'total_chunks',
+    'chunk_index',
+    'frame_type',
+    'control',
+    'stream_byte_position_lw',
+    'stream_byte_position_uw',
+    'stream_id',
+    'total_slices',
+    'slice_index',
+    'header1_size',
+    'header2_size',
+    'reserved1',
+    'advertised_size',
+    'reserved2',
+])
+
+# received is the clock time at which the frame was completely read
+Frame = collections.namedtuple('Frame', ['header', 'data', 'received'])
+
+# signature, version, codec, header size and payload size
+PREFIX = struct.Struct('<4sBBHI')
+
+KEYFRAME_TYPES = (ardrone.constant.FRAME_TYPE_IDR, ardrone.constant.FRAME_TYPE_I)
+
+
+def is_keyframe(frame):
+    """Check whether a frame can be decoded without any previous frames."""
+    return frame.header.frame_type in KEYFRAME_TYPES
+
+
+class FrameCounters(ctypes.Structure):
+    """Video frame counters (can be placed in shared memory)."""
+
+    _fields_ = [
+        ('received', ctypes.c_uint64),
+        ('decoded', ctypes.c_uint64),
+        ('dropped', ctypes.c_uint64),
+        ('errors', ctypes.c_uint64),
+    ]
+
+
+class FrameReader(object):
+    """PaVE Frame Reader.
+
+    Reads whatever is available from a non-blocking video socket (or is
+    handed to feed() when sock is None) and splits it into complete frames,
+    skipping to the next signature when out of sync.
+    """
+
+    def __init__(self, sock=None):
+        self.sock = sock
+        self.buf = bytearray()
+        self.closed = False
+
+    def feed(self, data):
+        """Add received data to the buffer."""
+        self.buf += data
+
+    def fill(self):
+        """Read all available data and return False if the connection was closed."""
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except socket.error as err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return True
+                raise
+
+            if not data:
+                self.closed = True
+                return False
+
+            self.buf += data
+
+    def frames(self):
+        """Return the complete frames in the buffer."""
+        frames = []
+        offset = 0
+        end = len(self.buf)
+        received = ardrone.metrics.clock()
+
+        while end - offset >= PREFIX.size:
+            signature, version, codec, header_size, payload_size = PREFIX.unpack_from(self.buf, offset)
+
+            # skip to the next signature if we are out of sync
+            if signature != b'PaVE':
+                offset = self.buf.find(b'PaVE', offset + 1)
+                if offset < 0:
+                    offset = max(end - 3, 0)
+                    break
+                continue
+
+            size = header_size + payload_size
+            if end - offset < size:
+                break
+
+            data = bytes(self.buf[offset:offset + size])
+            if header_size >= HEADER.size:
+                header = Header(*HEADER.unpack_from(data))
+            else:
+                header = Header(signature, version, codec, header_size, payload_size, *((0,)*17 + (b'', 0, b'')))
+            frames.append(Frame(header, data, received))
+
+            offset += size
+
+        del self.buf[:offset]
+
+        return frames
+
+
+class FrameScheduler(object):
+    """Latency Prioritized Frame Scheduler.
+
+    Queues received frames and picks the next frame worth decoding. When more
+    than one frame is queued, everything before the newest keyframe (IDR or
+    I-frame) is dropped. P-frames more than max_delay milliseconds older than
+    the newest received frame are dropped as well, after which every P-frame
+    is dropped until the next keyframe (as it could not be decoded
+    correctly).
+    """
+
+    def __init__(self, max_delay=100, counters=None):
+        self.max_delay = max_delay
+        self.counters = counters if counters is not None else FrameCounters()
+
+        self.queue = collections.deque()
+        self.need_keyframe = True
+
+    def pending(self):
+        """Return whether any frames are queued."""
+        return bool(self.queue)
+
+    def extend(self, frames):
+        """Queue received frames."""
+        self.queue.extend(frames)
+        self.counters.received += len(frames)
+
+    def drop(self, count=1):
+        """Count dropped frames."""
+        self.counters.dropped += count
+
+    def next(self):
+        """Return the next frame to decode or None."""
+        queue = self.queue
+
+        if len(queue) > 1:
+            # skip ahead to the newest keyframe
+            for index in range(len(queue) - 1, 0, -1):
+                if is_keyframe(queue[index]):
+                    for _ in range(index):
+                        queue.popleft()
+                    self.drop(index)
+                    break
+
+        while queue:
+            frame = queue.popleft()
+
+            if is_keyframe(frame):
+                self.need_keyframe = False
+                return frame
+
+            if not self.need_keyframe:
+                delay = queue[-1].header.timestamp - frame.header.timestamp if queue else 0
+                if delay <= self.max_delay:
+                    return frame
+
+            # cannot decode this frame (in time)
+            self.need_keyframe = True
+            self.drop()
+
+        return None
+
+    def decoded(self):
+        """Count a successfully decoded frame."""
+        self.counters.decoded += 1
+
+    def error(self):
+        """Count a frame that failed to decode and wait for the next keyframe."""
+        self.counters.errors += 1
+        self.need_keyframe = True
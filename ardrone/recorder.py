@@ -0,0 +1,360 @@
+"""
+This module records the raw navdata and video streams of a flight and
+replays them.
+
+A recording is a directory of segment files holding the raw packets and
+one index file per stream:
+
+    segment-000000.bin   magic, start time and records of (clock time,
+    segment-000001.bin   stream, sequence number, size) headers followed by
+    ...                  the raw navdata datagram or PaVE frame
+    navdata.idx          fixed size (clock time, sequence number, segment,
+    video.idx            offset, size) entries in recording order
+
+Times are ardrone.metrics.clock() values of the recording process, so only
+differences between them are meaningful.
+"""
+
+import bisect
+import collections
+import heapq
+import mmap
+import os
+import struct
+import threading
+import time
+
+import ardrone.metrics
+import ardrone.navdata
+import ardrone.pave
+
+
+MAGIC = b'ARDREC01'
+
+# magic and wall clock time of the start of the segment
+SEGMENT_HEADER = struct.Struct('<8sd')
+# clock time, stream, sequence number and size of a record
+RECORD_HEADER = struct.Struct('<dB3xII')
+# clock time, sequence number, segment, data offset and size of a record
+INDEX_ENTRY = struct.Struct('<dIIQI')
+
+NAVDATA = 0
+VIDEO = 1
+
+STREAMS = {
+    NAVDATA: 'navdata',
+    VIDEO: 'video',
+}
+
+Record = collections.namedtuple('Record', ['stream', 'time', 'sequence', 'data'])
+
+
+def segment_name(segment):
+    """Return the file name of a segment."""
+    return 'segment-{:06d}.bin'.format(segment)
+
+
+class Recorder(object):
+    """Flight Recorder.
+
+    Appends raw packets to the segments of a recording directory, starting
+    a new segment once segment_size bytes are exceeded. Writes are buffered
+    and flushed at least every flush_interval seconds. Safe to use from
+    several threads.
+    """
+
+    def __init__(self, path, segment_size=256*1024*1024, flush_interval=1.0):
+        self.path = path
+        self.segment_size = segment_size
+        self.flush_interval = flush_interval
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self.segment = -1
+        self.segment_file = None
+        self.offset = 0
+        self.index_files = dict((stream, open(os.path.join(path, name + '.idx'), 'ab')) for stream, name in STREAMS.items())
+
+        self.records = 0
+        self.bytes = 0
+        self.flushed = ardrone.metrics.clock()
+
+        self.lock = threading.RLock()
+
+        self.open_segment()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open_segment(self):
+        """Start a new segment file."""
+        if self.segment_file is not None:
+            self.segment_file.close()
+
+        self.segment += 1
+        while os.path.exists(os.path.join(self.path, segment_name(self.segment))):
+            # append to an existing recording
+            self.segment += 1
+
+        self.segment_file = open(os.path.join(self.path, segment_name(self.segment)), 'wb')
+        self.segment_file.write(SEGMENT_HEADER.pack(MAGIC, time.time()))
+        self.offset = SEGMENT_HEADER.size
+
+    def write(self, stream, data, received, sequence=0):
+        """
+        Appends a raw packet to the recording
+
+        Parameters:
+        stream -- NAVDATA or VIDEO
+        data -- bytes-like raw packet
+        received -- clock time at which the packet was received
+        sequence -- navdata sequence or video frame number
+        """
+        size = len(data)
+
+        with self.lock:
+            if self.offset + RECORD_HEADER.size + size > self.segment_size and self.offset > SEGMENT_HEADER.size:
+                self.open_segment()
+
+            self.segment_file.write(RECORD_HEADER.pack(received, stream, sequence, size))
+            self.segment_file.write(data)
+            self.index_files[stream].write(INDEX_ENTRY.pack(received, sequence, self.segment, self.offset + RECORD_HEADER.size, size))
+            self.offset += RECORD_HEADER.size + size
+
+            self.records += 1
+            self.bytes += size
+
+            now = ardrone.metrics.clock()
+            if now - self.flushed >= self.flush_interval:
+                self.flush()
+                self.flushed = now
+
+    def navdata(self, data, received):
+        """Record a raw navdata datagram."""
+        sequence = struct.unpack_from('<I', data, 8)[0] if len(data) >= 12 else 0
+        self.write(NAVDATA, data, received, sequence)
+
+    def video(self, frame):
+        """Record a PaVE frame (an ardrone.pave.Frame)."""
+        self.write(VIDEO, frame.data, frame.received, frame.header.frame_number)
+
+    def flush(self):
+        """Write buffered records to the files."""
+        with self.lock:
+            self.segment_file.flush()
+            for index_file in self.index_files.values():
+                index_file.flush()
+
+    def close(self):
+        """Flush and close the recording."""
+        with self.lock:
+            self.segment_file.close()
+            for index_file in self.index_files.values():
+                index_file.close()
+
+
+class Index(object):
+    """Memory mapped index of one stream of a recording.
+
+    Behaves like a read-only sequence of (time, sequence, segment, offset,
+    size) tuples, so it can be bisected.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.length = size//INDEX_ENTRY.size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.length else None
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError('index entry out of range')
+
+        return INDEX_ENTRY.unpack_from(self.map, index*INDEX_ENTRY.size)
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+
+class _Times(object):
+    """Sequence of the times of an Index (for bisect)."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, index):
+        return self.index[index][0]
+
+
+class _Sequences(_Times):
+    """Sequence of the sequence numbers of an Index (for bisect)."""
+
+    def __getitem__(self, index):
+        return self.index[index][1]
+
+
+class Replayer(object):
+    """Flight Replayer.
+
+    Gives random access to the records of a recording without reading it
+    into memory: indexes and segments are memory mapped and record data is
+    returned as memoryviews of the mapped segments.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        self.indexes = dict((stream, Index(os.path.join(path, name + '.idx'))) for stream, name in STREAMS.items())
+        self.segments = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return sum(len(index) for index in self.indexes.values())
+
+    def close(self):
+        """Unmap the recording."""
+        for index in self.indexes.values():
+            index.close()
+        for segment_file, segment_map in self.segments.values():
+            try:
+                segment_map.close()
+            except BufferError:
+                # records are still referenced and keep the mapping alive
+                pass
+            segment_file.close()
+        self.segments.clear()
+
+    def span(self):
+        """Return the clock times of the first and last record (or None)."""
+        times = [(index[0][0], index[-1][0]) for index in self.indexes.values() if len(index)]
+        if not times:
+            return None
+
+        return min(start for start, end in times), max(end for start, end in times)
+
+    def segment(self, segment):
+        """Return the memory map of a segment."""
+        if segment not in self.segments:
+            segment_file = open(os.path.join(self.path, segment_name(segment)), 'rb')
+            self.segments[segment] = (segment_file, mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ))
+
+        return self.segments[segment][1]
+
+    def record(self, stream, position):
+        """Return the record at a position of the index of a stream."""
+        received, sequence, segment, offset, size = self.indexes[stream][position]
+        return Record(stream, received, sequence, memoryview(self.segment(segment))[offset:offset + size])
+
+    def find_time(self, stream, received):
+        """Return the index position of the first record at or after a clock time."""
+        return bisect.bisect_left(_Times(self.indexes[stream]), received)
+
+    def find_sequence(self, stream, sequence):
+        """Return the index position of the first record with at least a sequence number.
+
+        Assumes the sequence numbers increase through the recording (i.e.
+        the drone was not restarted).
+        """
+        return bisect.bisect_left(_Sequences(self.indexes[stream]), sequence)
+
+    def records(self, start=None, end=None, streams=(NAVDATA, VIDEO)):
+        """Iterate over the records between the clock times start and end in time order."""
+        def stream_records(stream):
+            index = self.indexes[stream]
+            position = self.find_time(stream, start) if start is not None else 0
+            while position < len(index):
+                record = self.record(stream, position)
+                if end is not None and record.time > end:
+                    return
+                yield record
+                position += 1
+
+        return heapq.merge(*[stream_records(stream) for stream in streams], key=lambda record: record.time)
+
+    def play(self, speed=1.0, start=None, end=None, video=True, pixel_format='rgb24', video_size=None, video_crop=None):
+        """
+        Replays the recording through the normal decode path
+
+        Parameters:
+        speed -- playback speed relative to real time (None: as fast as
+            possible)
+        start, end -- clock times to replay between
+        video -- False: skip the video stream
+        pixel_format -- pixel format of the decoded frames
+        video_size, video_crop -- size the frames are scaled to and region
+            they are cropped to (see ardrone.video.decode)
+
+        Yields (NAVDATA, time, navdata) and (VIDEO, time, (width, height,
+        image)) tuples. Like live video, frames are scheduled by an
+        ardrone.pave.FrameScheduler, so when decoding falls behind the
+        requested speed, frames are skipped up to the next keyframe.
+        """
+        if video:
+            # bound under another name, as a local ardrone would shadow the
+            # module for navdata only replays
+            import ardrone.video as video_module
+
+            decoder = video_module.Decoder()
+            width, height = video_size or (0, 0)
+            scheduler = ardrone.pave.FrameScheduler()
+
+        streams = (NAVDATA, VIDEO) if video else (NAVDATA,)
+
+        first = None
+        started = ardrone.metrics.clock()
+        for record in self.records(start, end, streams):
+            if first is None:
+                first = record.time
+
+            late = False
+            if speed is not None:
+                delay = started + (record.time - first)/speed - ardrone.metrics.clock()
+                if delay > 0:
+                    time.sleep(delay)
+                late = delay < -scheduler.max_delay/1000.0 if video else False
+
+            if record.stream == NAVDATA:
+                try:
+                    yield NAVDATA, record.time, ardrone.navdata.decode(record.data)
+                except struct.error:
+                    continue
+            elif len(record.data) >= ardrone.pave.HEADER.size:
+                header = ardrone.pave.Header(*ardrone.pave.HEADER.unpack_from(record.data))
+                scheduler.extend([ardrone.pave.Frame(header, record.data, record.time)])
+
+                # while behind, queue frames so the scheduler can skip ahead
+                if late:
+                    continue
+
+                while scheduler.pending():
+                    frame = scheduler.next()
+                    if frame is None:
+                        break
+
+                    try:
+                        image = decoder.decode(frame.data, pixel_format, width, height, video_crop)
+                    except video_module.DecodeError:
+                        scheduler.error()
+                        continue
+
+                    scheduler.decoded()
+                    yield VIDEO, frame.received, image
@@ -0,0 +1,306 @@
+"""
+This module relays the raw PaVE framed H.264 video stream of the AR.Drone
+to local consumers.
+
+The video port of the drone accepts a single connection. A Relay
+republishes the frames received on that connection over a local TCP port or
+Unix socket to any number of clients, which read the same PaVE stream as
+they would from the drone (e.g. with frames()) and decode only what they
+need.
+"""
+
+import collections
+import errno
+import os
+import select
+import selectors
+import socket
+import stat
+import threading
+
+import ardrone.metrics
+import ardrone.pave
+
+
+# policies for a client that falls more than max_backlog bytes behind
+SKIP = 'skip'
+DISCONNECT = 'disconnect'
+
+POLICIES = (SKIP, DISCONNECT)
+
+
+def _family(address):
+    """Return the socket family of a (host, port) or Unix socket path address."""
+    return socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+
+
+class RelayClient(object):
+    """Relay Client.
+
+    Queue of the frames still to be sent to one client of a Relay.
+    """
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+
+        # frames (as memoryviews) still to be sent
+        self.queue = collections.deque()
+        self.backlog = 0
+        # whether the first queued frame was sent in part
+        self.partial = False
+        # clients join (and rejoin after skipping) at a keyframe
+        self.need_keyframe = True
+
+        self.sent = 0
+        self.skipped = 0
+        self.connected = ardrone.metrics.clock()
+
+    def queue_frame(self, data):
+        self.queue.append(memoryview(data))
+        self.backlog += len(data)
+
+    def skip(self):
+        """Drop the queued frames except for the rest of a partially sent one."""
+        rest = self.queue.popleft() if self.partial else None
+        self.skipped += len(self.queue)
+        self.queue.clear()
+        self.backlog = 0
+        if rest is not None:
+            self.queue.append(rest)
+            self.backlog = len(rest)
+        self.need_keyframe = True
+
+    def send(self):
+        """Send as much of the queue as the socket takes and return whether it is empty."""
+        while self.queue:
+            data = self.queue[0]
+            try:
+                sent = self.sock.send(data)
+            except socket.error as err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return False
+                raise
+
+            self.backlog -= sent
+            if sent < len(data):
+                self.queue[0] = data[sent:]
+                self.partial = True
+                return False
+
+            self.queue.popleft()
+            self.partial = False
+            self.sent += 1
+
+        return True
+
+    def stats(self):
+        return {
+            'address': self.address,
+            'sent': self.sent,
+            'skipped': self.skipped,
+            'backlog': self.backlog,
+            'seconds': ardrone.metrics.clock() - self.connected,
+        }
+
+
+class Relay(object):
+    """PaVE Video Relay.
+
+    Listens on address, a (host, port) tuple for TCP or a path for a Unix
+    socket, and sends every published ardrone.pave.Frame to all connected
+    clients from a thread of its own. New clients join at the next keyframe
+    (IDR or I-frame), so they can decode from their first frame on.
+
+    When a client falls more than max_backlog bytes behind, policy decides
+    what happens:
+
+    - SKIP: drop its queued frames and resume at the next keyframe
+    - DISCONNECT: close its connection
+
+    Publishing never blocks, so slow clients cannot delay the drone
+    connection or each other.
+    """
+
+    def __init__(self, address, policy=SKIP, max_backlog=1024*1024):
+        if policy not in POLICIES:
+            raise ValueError('unknown relay policy {!r}'.format(policy))
+
+        self.policy = policy
+        self.max_backlog = max_backlog
+
+        family = _family(address)
+        if family == socket.AF_UNIX and os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+            # left behind by a relay that was not closed
+            os.unlink(address)
+
+        self.server = socket.socket(family, socket.SOCK_STREAM)
+        if family != socket.AF_UNIX:
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(address)
+        self.server.listen(8)
+        self.server.setblocking(False)
+        self.address = self.server.getsockname()
+
+        self.selector = selectors.DefaultSelector()
+        self.wakeup_receiver, self.wakeup_sender = socket.socketpair()
+        self.wakeup_receiver.setblocking(False)
+        self.wakeup_sender.setblocking(False)
+        self.selector.register(self.server, selectors.EVENT_READ, None)
+        self.selector.register(self.wakeup_receiver, selectors.EVENT_READ, None)
+
+        self.clients = []
+        # frames published since the loop last looked
+        self.frames = collections.deque()
+
+        self.published = 0
+        self.disconnected = 0
+
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, name='video relay')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def publish(self, frame):
+        """Queue a frame for all clients."""
+        self.published += 1
+        self.frames.append(frame)
+        self.wakeup()
+
+    def wakeup(self):
+        try:
+            self.wakeup_sender.send(b'\x00')
+        except socket.error:
+            # the loop is already awake (or closed)
+            pass
+
+    def close(self):
+        """Disconnect all clients and stop listening."""
+        self.stopping = True
+        self.wakeup()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+
+        for client in list(self.clients):
+            self.disconnect(client)
+        self.selector.close()
+        self.server.close()
+        self.wakeup_receiver.close()
+        self.wakeup_sender.close()
+
+        if _family(self.address) == socket.AF_UNIX and os.path.exists(self.address):
+            os.unlink(self.address)
+
+    def stats(self):
+        """Return the frame counters of the relay and of each client."""
+        return {
+            'published': self.published,
+            'disconnected': self.disconnected,
+            'clients': [client.stats() for client in list(self.clients)],
+        }
+
+    def accept(self):
+        while True:
+            try:
+                sock, address = self.server.accept()
+            except socket.error as err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+
+            sock.setblocking(False)
+            client = RelayClient(sock, address)
+            self.clients.append(client)
+            self.selector.register(sock, selectors.EVENT_READ, client)
+
+    def disconnect(self, client):
+        self.clients.remove(client)
+        self.selector.unregister(client.sock)
+        client.sock.close()
+
+    def dispatch(self, frame):
+        """Queue a frame for every client according to the policy."""
+        keyframe = ardrone.pave.is_keyframe(frame)
+        for client in list(self.clients):
+            if client.backlog + len(frame.data) > self.max_backlog:
+                if self.policy == DISCONNECT:
+                    self.disconnected += 1
+                    self.disconnect(client)
+                    continue
+                client.skip()
+
+            if client.need_keyframe:
+                if not keyframe:
+                    client.skipped += 1
+                    continue
+                client.need_keyframe = False
+
+            client.queue_frame(frame.data)
+
+    def flush(self, client):
+        """Send what a client can take and only wait for writability while data is left."""
+        try:
+            done = client.send()
+        except socket.error:
+            self.disconnect(client)
+            return
+
+        self.selector.modify(client.sock, selectors.EVENT_READ if done else selectors.EVENT_READ | selectors.EVENT_WRITE, client)
+
+    def run(self):
+        while not self.stopping:
+            for key, events in self.selector.select():
+                if key.fileobj is self.server:
+                    self.accept()
+                elif key.fileobj is self.wakeup_receiver:
+                    try:
+                        self.wakeup_receiver.recv(4096)
+                    except socket.error:
+                        pass
+                elif key.data in self.clients:
+                    client = key.data
+                    if events & selectors.EVENT_READ:
+                        # clients do not send anything, so this is a hang up
+                        try:
+                            data = client.sock.recv(4096)
+                        except socket.error:
+                            data = b''
+                        if not data:
+                            self.disconnect(client)
+                            continue
+                    if events & selectors.EVENT_WRITE:
+                        self.flush(client)
+
+            while self.frames:
+                self.dispatch(self.frames.popleft())
+                for client in list(self.clients):
+                    if client.queue:
+                        self.flush(client)
+
+
+def frames(address, timeout=None):
+    """Connect to a Relay and yield the ardrone.pave.Frame objects it sends.
+
+    Stops when the relay closes the connection or no data arrives for
+    timeout seconds.
+    """
+    sock = socket.socket(_family(address), socket.SOCK_STREAM)
+    try:
+        sock.connect(address)
+        sock.setblocking(False)
+        reader = ardrone.pave.FrameReader(sock)
+        while not reader.closed:
+            inputready, outputready, exceptready = select.select([sock], [], [], timeout)
+            if not inputready:
+                return
+            reader.fill()
+            for frame in reader.frames():
+                yield frame
+    finally:
+        sock.close()
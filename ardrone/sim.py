@@ -0,0 +1,525 @@
+"""
+This module simulates an AR.Drone on the local host so the library can be
+exercised and benchmarked without hardware.
+
+Run a simulator until interrupted with:
+
+    python -m ardrone.sim [--video stream.h264]
+"""
+
+import argparse
+import collections
+import re
+import select
+import socket
+import struct
+import threading
+import time
+
+import ardrone.constant
+import ardrone.metrics
+import ardrone.navdata
+import ardrone.pave
+
+
+_float = struct.Struct('f')
+_int = struct.Struct('i')
+
+_command = re.compile(br'AT\*([A-Z_0-9]+)=(\d+)((?:,(?:"[^"]*"|[^,\r]*))*)\r')
+_param = re.compile(br',("[^"]*"|[^,\r]*)')
+
+# values of the navdata options the simulator does not fill in
+_zero_options = dict(
+    (id_nr, struct.unpack(fmt, bytes(bytearray(struct.calcsize(fmt)))))
+    for id_nr, (name, fmt, fields) in ardrone.navdata.OPTIONS.items()
+    if id_nr not in (0, 1, 0xffff)
+)
+
+# configuration the simulator starts with (an excerpt of a real dump)
+CONFIG_DUMP = '''general:num_version_config = 1
+general:num_version_mb = 33
+general:num_version_soft = 2.4.8
+general:drone_serial = XXXXXXXXXX
+general:navdata_demo = FALSE
+general:navdata_options = 105971713
+general:com_watchdog = 2
+general:video_enable = TRUE
+general:vision_enable = TRUE
+general:vbat_min = 9000
+control:accs_offset = { -2.0870000e+03 2.0430000e+03 2.0820000e+03 }
+control:altitude_max = 3000
+control:altitude_min = 50
+control:control_level = 0
+control:euler_angle_max = 2.0943952e-01
+control:control_vz_max = 7.0000000e+02
+control:control_yaw = 1.7453293e+00
+control:outdoor = FALSE
+control:flight_without_shell = FALSE
+control:flying_mode = 0
+network:ssid_single_player = ardrone2_000000
+network:wifi_mode = 0
+video:camif_fps = 30
+video:codec_fps = 30
+video:bitrate = 1000
+video:max_bitrate = 4000
+video:bitrate_control_mode = 0
+video:video_codec = 129
+video:video_channel = 0
+video:video_on_usb = FALSE
+leds:leds_anim = 0,0,0
+detect:detect_type = 10
+syslog:output = 7
+userbox:userbox_cmd = 0
+gps:latitude = 5.0000000000000000e+02
+gps:longitude = 5.0000000000000000e+02
+custom:application_id = 00000000
+custom:profile_id = 00000000
+custom:session_id = 00000000
+'''
+
+# NAL unit types of coded slices
+NAL_SLICE = 1
+NAL_IDR = 5
+
+
+def i2f(i):
+    """Interpret a signed integer as IEEE-754 floating-point value.
+
+    Arguments:
+    i -- integer as encoded in an AT command
+    """
+    return _float.unpack(_int.pack(i))[0]
+
+
+def parse(datagram):
+    """
+    Parses the AT commands of a datagram into (command, seq, params) tuples
+
+    Parameters:
+    datagram -- bytes of one or more AT commands
+
+    Numeric parameters are returned as ints (use i2f() for floats) and
+    string parameters as str.
+    """
+    commands = []
+    for match in _command.finditer(datagram):
+        params = []
+        for param in _param.findall(match.group(3)):
+            if param.startswith(b'"'):
+                params.append(param[1:-1].decode())
+            else:
+                params.append(int(param))
+        commands.append((match.group(1).decode(), int(match.group(2)), params))
+
+    return commands
+
+
+def encode_navdata(state, sequence, options, vision=0):
+    """
+    Encodes a navdata packet with a checksum
+
+    Parameters:
+    state -- drone state flags
+    sequence -- sequence number of the packet
+    options -- list of (id_nr, values) option blocks laid out as in
+        ardrone.navdata.OPTIONS
+    vision -- vision flag
+    """
+    data = [struct.pack('<IIII', ardrone.constant.NAVDATA_HEADER, state, sequence, vision)]
+    for id_nr, values in options:
+        payload = struct.pack(ardrone.navdata.OPTIONS[id_nr][1], *values)
+        data.append(struct.pack('<HH', id_nr, 4 + len(payload)) + payload)
+    data = b''.join(data)
+
+    return data + struct.pack('<HHI', 0xffff, 8, sum(bytearray(data)) & 0xffffffff)
+
+
+def encode_frame(number, frame_type, timestamp, payload, width=640, height=360):
+    """Wrap an H.264 frame in a PaVE header."""
+    return ardrone.pave.HEADER.pack(
+        b'PaVE', 2, 4, ardrone.pave.HEADER.size, len(payload),
+        width, (height + 15)//16*16, width, height,
+        number, timestamp, 1, 0, frame_type, 0,
+        0, 0, 0, 1, 0, 0, 0, b'', 0, b'',
+    ) + payload
+
+
+def synthetic_frames(count=30, gop=15, keyframe_size=20000, frame_size=4000):
+    """
+    Returns (frame_type, payload) frames of filler NAL units
+
+    The frames exercise framing, scheduling and bandwidth like a real stream
+    but do not decode to images. Use load_h264() or load_pave() for frames
+    that can be decoded.
+    """
+    frames = []
+    for index in range(count):
+        keyframe = index % gop == 0
+        size = keyframe_size if keyframe else frame_size
+        frame_type = ardrone.constant.FRAME_TYPE_IDR if keyframe else ardrone.constant.FRAME_TYPE_P
+        frames.append((frame_type, b'\x00\x00\x00\x01\x0c' + b'\xff'*(size - 6) + b'\x80'))
+
+    return frames
+
+
+def load_h264(path):
+    """
+    Returns the (frame_type, payload) frames of an H.264 Annex B stream
+
+    Parameters:
+    path -- file of the elementary stream (one slice per frame), e.g. from
+        ffmpeg -i input -c:v libx264 -bsf:v h264_mp4toannexb -f h264 path
+    """
+    with open(path, 'rb') as stream:
+        data = stream.read()
+
+    starts = [match.start() for match in re.finditer(b'\x00\x00\x01', data)]
+
+    frames = []
+    pending = b''
+    for start, end in zip(starts, starts[1:] + [len(data)]):
+        # a zero byte before the next start code is trailing padding
+        pending += data[start:end]
+
+        nal_type = bytearray(data[start + 3:start + 4])[0] & 0x1f
+        if nal_type in (NAL_SLICE, NAL_IDR):
+            frames.append((ardrone.constant.FRAME_TYPE_IDR if nal_type == NAL_IDR else ardrone.constant.FRAME_TYPE_P, pending))
+            pending = b''
+
+    return frames
+
+
+def load_pave(path):
+    """
+    Returns the (frame_type, payload) frames of a recorded PaVE stream
+
+    Parameters:
+    path -- file of the raw video stream as received from the drone
+    """
+    with open(path, 'rb') as stream:
+        data = stream.read()
+
+    frames = []
+    offset = 0
+    while len(data) - offset >= ardrone.pave.HEADER.size:
+        header = ardrone.pave.Header(*ardrone.pave.HEADER.unpack_from(data, offset))
+        if header.signature != b'PaVE':
+            offset = data.find(b'PaVE', offset + 1)
+            if offset < 0:
+                break
+            continue
+
+        start = offset + header.header_size
+        frames.append((header.frame_type, data[start:start + header.payload_size]))
+        offset = start + header.payload_size
+
+    return frames
+
+
+class Simulator(object):
+    """AR.Drone Simulator.
+
+    Listens on the command, navdata and video ports of host and behaves like
+    a (very idealized) drone:
+
+    - AT commands are parsed and applied in sequence number order. REF takes
+      off, lands and toggles the emergency state (when the emergency flag is
+      raised), PCMD tilts and turns the
+      drone, CONFIG stores the option and sets the command ACK state flag
+      until a CTRL ACK command is received.
+    - A CTRL CFG_GET command sends the configuration (starting out as
+      CONFIG_DUMP) to the clients of the control port.
+    - Navdata is sent at navdata_rate packets per second (by default 15 in
+      demo mode and 200 otherwise, like the drone) to whoever sent the last
+      datagram to the navdata port. Outside of demo mode the packets carry
+      all options of ardrone.navdata.OPTIONS.
+    - The (frame_type, payload) frames are streamed at fps frames per second
+      to the client of the video port, looping forever.
+
+    Point an ARDrone at the simulator with ARDrone('127.0.0.1').
+    """
+
+    # seconds between checks whether the workers should stop
+    poll_interval = 0.1
+
+    def __init__(self, host='127.0.0.1', navdata_rate=None, fps=30, frames=None, command_port=ardrone.constant.COMMAND_PORT, navdata_port=ardrone.constant.NAVDATA_PORT, video_port=ardrone.constant.VIDEO_PORT, control_port=ardrone.constant.CONTROL_PORT):
+        self.host = host
+        self.navdata_rate = navdata_rate
+        self.fps = fps
+        self.frames = frames if frames is not None else synthetic_frames()
+
+        self.lock = threading.Lock()
+
+        # drone state
+        self.seq = 0
+        self.flying = False
+        self.emergency = False
+        self.emergency_flag = False
+        self.ack = False
+        self.demo = False
+        self.pcmd = (0, 0.0, 0.0, 0.0, 0.0)
+        self.psi = 0.0
+        self.altitude = 0
+        self.config = collections.OrderedDict(line.split(' = ', 1) for line in CONFIG_DUMP.splitlines())
+        self.config_requested = threading.Event()
+
+        # statistics
+        self.commands = collections.Counter()
+        self.ignored = 0
+        self.navdata_sent = 0
+        self.frames_sent = 0
+
+        self.command_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.command_socket.bind((host, command_port))
+        self.command_socket.settimeout(self.poll_interval)
+
+        self.nav_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.nav_socket.bind((host, navdata_port))
+
+        self.video_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.video_server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.video_server.bind((host, video_port))
+        self.video_server.listen(1)
+
+        self.control_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.control_server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.control_server.bind((host, control_port))
+        self.control_server.listen(4)
+
+        self.stopping = threading.Event()
+        self.workers = [
+            threading.Thread(target=self.receive_commands),
+            threading.Thread(target=self.send_navdata),
+            threading.Thread(target=self.send_video),
+            threading.Thread(target=self.serve_control),
+        ]
+        for worker in self.workers:
+            worker.daemon = True
+            worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.halt()
+
+    def halt(self):
+        """Stop the simulator and close its sockets."""
+        self.stopping.set()
+        for worker in self.workers:
+            worker.join()
+
+        self.command_socket.close()
+        self.nav_socket.close()
+        self.video_server.close()
+        self.control_server.close()
+
+    def state(self):
+        """Return the state flags of the simulated drone."""
+        shifts = ardrone.navdata.STATE_SHIFTS
+
+        state = 0
+        for name in ('atcodec_thread_on', 'navdata_thread_on', 'video_thread_on', 'acq_thread_on'):
+            state |= 1 << shifts[name]
+        if self.flying:
+            state |= 1 << shifts['fly']
+        if self.ack:
+            state |= 1 << shifts['command']
+        if self.demo:
+            state |= 1 << shifts['navdata_demo']
+        if self.emergency:
+            state |= 1 << shifts['emergency']
+
+        return state
+
+    def apply(self, command, seq, params):
+        """Apply a single AT command."""
+        with self.lock:
+            # the drone resets its sequence number with seq 1 and ignores
+            # older commands otherwise
+            if seq != 1 and seq <= self.seq:
+                self.ignored += 1
+                return
+            self.seq = seq
+
+            self.commands[command] += 1
+
+            if command == 'REF':
+                emergency_flag = bool(params[0] & 0b100000000)
+                if emergency_flag and not self.emergency_flag:
+                    # the emergency state toggles when the flag is raised
+                    self.emergency = not self.emergency
+                    self.flying = False
+                elif not emergency_flag:
+                    self.flying = bool(params[0] & 0b1000000000) and not self.emergency
+                self.emergency_flag = emergency_flag
+            elif command == 'PCMD':
+                self.pcmd = (params[0],) + tuple(i2f(param) for param in params[1:5])
+            elif command == 'CONFIG':
+                key, value = params
+                self.config[key] = value
+                if key == 'general:navdata_demo':
+                    self.demo = value.upper() == 'TRUE'
+                self.ack = True
+            elif command == 'CTRL':
+                if params[0] == ardrone.constant.CONTROL_MODE_ACK:
+                    self.ack = False
+                elif params[0] == ardrone.constant.CONTROL_MODE_CFG_GET:
+                    self.config_requested.set()
+
+    def receive_commands(self):
+        """Receive and apply AT commands."""
+        while not self.stopping.is_set():
+            try:
+                data = self.command_socket.recv(65535)
+            except socket.timeout:
+                continue
+
+            for command in parse(data):
+                self.apply(*command)
+
+    def options(self, elapsed):
+        """Return the option blocks of the next navdata packet."""
+        with self.lock:
+            progressive, lr, fb, vv, va = self.pcmd if self.flying and self.pcmd[0] & 1 else (0, 0.0, 0.0, 0.0, 0.0)
+            if self.flying:
+                self.altitude = max(min(self.altitude + int(vv*50), 3000), 500)
+                self.psi = (self.psi + va*5 + 180) % 360 - 180
+            else:
+                self.altitude = 0
+
+            demo = [
+                0x30000 if self.flying else 0x20000,
+                max(100 - int(elapsed/60), 0),
+                fb*-12000.0,
+                lr*12000.0,
+                self.psi*1000.0,
+                self.altitude,
+                fb*-2000.0,
+                lr*2000.0,
+                vv*1000.0,
+                self.frames_sent,
+            ]
+
+            options = [(0, demo)]
+            if not self.demo:
+                options.append((1, [int(elapsed*1000000)]))
+                for id_nr in sorted(_zero_options):
+                    options.append((id_nr, _zero_options[id_nr]))
+
+            return options
+
+    def send_navdata(self):
+        """Send navdata at the navdata rate to the last client."""
+        address = None
+        sequence = 1
+        started = ardrone.metrics.clock()
+        deadline = started
+
+        while not self.stopping.is_set():
+            rate = self.navdata_rate or (15 if self.demo else 200)
+
+            timeout = self.poll_interval if address is None else max(deadline - ardrone.metrics.clock(), 0)
+            readable, _, _ = select.select([self.nav_socket], [], [], timeout)
+            if readable:
+                _, address = self.nav_socket.recvfrom(65535)
+                continue
+
+            if address is None:
+                continue
+
+            now = ardrone.metrics.clock()
+            if now < deadline:
+                continue
+
+            packet = encode_navdata(self.state(), sequence, self.options(now - started))
+            try:
+                self.nav_socket.sendto(packet, address)
+            except socket.error:
+                pass
+            else:
+                self.navdata_sent += 1
+            sequence += 1
+
+            deadline += 1.0/rate
+            if deadline < now:
+                deadline = now + 1.0/rate
+
+    def send_video(self):
+        """Stream the frames at the frame rate to the client of the video port."""
+        while not self.stopping.is_set():
+            readable, _, _ = select.select([self.video_server], [], [], self.poll_interval)
+            if not readable:
+                continue
+
+            client, _ = self.video_server.accept()
+
+            number = 0
+            started = ardrone.metrics.clock()
+            try:
+                while not self.stopping.is_set():
+                    frame_type, payload = self.frames[number % len(self.frames)]
+                    timestamp = int((ardrone.metrics.clock() - started)*1000)
+                    client.sendall(encode_frame(number, frame_type, timestamp, payload))
+                    self.frames_sent += 1
+                    number += 1
+
+                    self.stopping.wait(max(started + float(number)/self.fps - ardrone.metrics.clock(), 0))
+            except socket.error:
+                pass
+            finally:
+                client.close()
+
+    def serve_control(self):
+        """Send the configuration to the clients of the control port when requested."""
+        clients = []
+        try:
+            while not self.stopping.is_set():
+                readable, _, _ = select.select([self.control_server] + clients, [], [], self.poll_interval/10)
+                for sock in readable:
+                    if sock is self.control_server:
+                        client, _ = self.control_server.accept()
+                        clients.append(client)
+                    elif not sock.recv(4096):
+                        clients.remove(sock)
+                        sock.close()
+
+                if self.config_requested.is_set():
+                    self.config_requested.clear()
+                    with self.lock:
+                        dump = ''.join('{} = {}\n'.format(key, value) for key, value in self.config.items()).encode()
+                    # like the drone, keep the connection open after the dump
+                    for client in clients:
+                        try:
+                            client.sendall(dump)
+                        except socket.error:
+                            pass
+        finally:
+            for client in clients:
+                client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='simulate an AR.Drone on the local host')
+    parser.add_argument('-H', '--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('-r', '--navdata-rate', type=int, help='navdata packets per second (default: like the drone)')
+    parser.add_argument('-f', '--fps', type=int, default=30, help='video frames per second')
+    parser.add_argument('-v', '--video', help='H.264 elementary stream (.h264) or recorded PaVE stream to send')
+    args = parser.parse_args()
+
+    frames = None
+    if args.video:
+        frames = load_h264(args.video) if args.video.endswith('.h264') else load_pave(args.video)
+
+    simulator = Simulator(args.host, args.navdata_rate, args.fps, frames)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.halt()
+
+
+if __name__ == '__main__':
+    main()
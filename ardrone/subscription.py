@@ -0,0 +1,254 @@
+"""
+This module fans out decoded data to subscribers with bounded queues.
+"""
+
+import collections
+import threading
+
+import ardrone.metrics
+
+
+# backpressure policies of a full subscriber queue
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+BLOCK = 'block'
+
+POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+
+class Subscription(object):
+    """Subscription.
+
+    Calls callback with every published item from a thread of its own. Items
+    wait in a queue of at most maxsize items. When the queue is full, policy
+    decides what happens to a new item:
+
+    - DROP_OLDEST: drop the oldest queued item (the callback always gets
+      the latest items)
+    - DROP_NEWEST: drop the new item (the callback gets a contiguous run of
+      items)
+    - BLOCK: make publish() wait until there is room
+
+    offer() never waits: a BLOCK subscription keeps offered items in a
+    backlog of at most backlog items (dropping the oldest) and moves them to
+    the queue from another thread of its own, so only that thread waits for
+    the callback.
+    """
+
+    def __init__(self, callback, policy=DROP_OLDEST, maxsize=2, name=None, backlog=32):
+        if policy not in POLICIES:
+            raise ValueError('unknown backpressure policy {!r}'.format(policy))
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+
+        self.callback = callback
+        self.policy = policy
+        self.maxsize = maxsize
+        self.name = name
+
+        # (published time, item) pairs
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.cancelled = False
+        # the Publisher this subscription is removed from when cancelled
+        self.publisher = None
+
+        # offered items waiting for room in the queue (BLOCK only) and the
+        # thread moving them there, started with the first offered item
+        self.backlog = collections.deque()
+        self.backlog_size = backlog
+        self.feeder = None
+
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        self.error = None
+        self.latency = ardrone.metrics.Histogram()
+
+        self.thread = threading.Thread(target=self.run, name=name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def publish(self, item):
+        """Queue an item for the callback according to the policy."""
+        with self.condition:
+            if self.cancelled:
+                return
+
+            self.published += 1
+            self.put(ardrone.metrics.clock(), item)
+
+    def offer(self, item):
+        """Queue an item for the callback without waiting (see Subscription)."""
+        if self.policy != BLOCK:
+            self.publish(item)
+            return
+
+        with self.condition:
+            if self.cancelled:
+                return
+
+            self.published += 1
+
+            if len(self.backlog) >= self.backlog_size:
+                self.backlog.popleft()
+                self.dropped += 1
+
+            self.backlog.append((ardrone.metrics.clock(), item))
+            self.condition.notify_all()
+
+            if self.feeder is None:
+                self.feeder = threading.Thread(target=self.feed, name=None if self.name is None else '{} feeder'.format(self.name))
+                self.feeder.daemon = True
+                self.feeder.start()
+
+    def put(self, published, item):
+        # called with the condition held
+        if len(self.queue) >= self.maxsize:
+            if self.policy == DROP_NEWEST:
+                self.dropped += 1
+                return
+            elif self.policy == DROP_OLDEST:
+                self.queue.popleft()
+                self.dropped += 1
+            else:
+                while len(self.queue) >= self.maxsize and not self.cancelled:
+                    self.condition.wait()
+                if self.cancelled:
+                    return
+
+        self.queue.append((published, item))
+        self.condition.notify_all()
+
+    def cancel(self):
+        """Stop delivering items (queued items are discarded)."""
+        with self.condition:
+            self.cancelled = True
+            self.queue.clear()
+            self.backlog.clear()
+            self.condition.notify_all()
+
+        if self.publisher is not None:
+            self.publisher.discard(self)
+
+        for thread in (self.thread, self.feeder):
+            if thread is not None and thread is not threading.current_thread():
+                thread.join()
+
+    def stats(self):
+        """Return the delivery counters and lag of the subscription.
+
+        lag is the number of queued (and backlogged) items and lag_seconds
+        the age of the oldest of them. dropped counts the items dropped from
+        the queue and the backlog. latency is the histogram of the time from
+        publishing an item until the callback is called with it.
+        """
+        with self.condition:
+            oldest = self.queue or self.backlog
+            return {
+                'policy': self.policy,
+                'published': self.published,
+                'delivered': self.delivered,
+                'dropped': self.dropped,
+                'errors': self.errors,
+                'lag': len(self.queue) + len(self.backlog),
+                'lag_seconds': ardrone.metrics.clock() - oldest[0][0] if oldest else 0.0,
+                'latency': self.latency.snapshot(),
+            }
+
+    def feed(self):
+        with self.condition:
+            while True:
+                while not self.backlog and not self.cancelled:
+                    self.condition.wait()
+                if self.cancelled:
+                    return
+
+                published, item = self.backlog.popleft()
+                # waits (releasing the condition) until there is room
+                self.put(published, item)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.cancelled:
+                    self.condition.wait()
+                if self.cancelled:
+                    return
+
+                published, item = self.queue.popleft()
+                self.latency.add(ardrone.metrics.clock() - published)
+                # make room for a blocked publisher
+                self.condition.notify_all()
+
+            try:
+                self.callback(item)
+            except Exception as err:
+                # a failing subscriber must not stop the others
+                self.errors += 1
+                self.error = err
+
+            self.delivered += 1
+
+
+class Publisher(object):
+    """Publisher.
+
+    Offers every published item once to each of its subscriptions (see
+    Subscription.offer()), so publishing never waits for a subscription and
+    a slow BLOCK subscription only holds up itself. BLOCK subscriptions keep
+    a backlog of at most backlog items.
+    """
+
+    def __init__(self, name='subscriber', backlog=32):
+        self.name = name
+        self.backlog = backlog
+        self.subscriptions = []
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def __bool__(self):
+        # whether anything is still subscribed (publishers skip converting
+        # items nobody receives)
+        return any(not subscription.cancelled for subscription in self.subscriptions)
+
+    def subscribe(self, callback, policy=DROP_OLDEST, maxsize=2):
+        """Return a new Subscription calling callback with every item."""
+        subscription = Subscription(callback, policy, maxsize, name='{} {}'.format(self.name, getattr(callback, '__name__', 'callback')), backlog=self.backlog)
+        subscription.publisher = self
+        with self.lock:
+            if self.closed:
+                subscription.publisher = None
+                subscription.cancel()
+            else:
+                self.subscriptions = self.subscriptions + [subscription]
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Cancel a subscription."""
+        subscription.cancel()
+
+    def discard(self, subscription):
+        """Remove a (cancelled) subscription without cancelling it."""
+        with self.lock:
+            self.subscriptions = [other for other in self.subscriptions if other is not subscription]
+
+    def publish(self, item):
+        """Queue an item for every subscription."""
+        for subscription in self.subscriptions:
+            subscription.offer(item)
+
+    def stats(self):
+        """Return the stats of every active subscription."""
+        return [subscription.stats() for subscription in self.subscriptions if not subscription.cancelled]
+
+    def close(self):
+        """Cancel all subscriptions."""
+        with self.lock:
+            self.closed = True
+            subscriptions, self.subscriptions = self.subscriptions, []
+
+        for subscription in subscriptions:
+            subscription.cancel()
@@ -1,12 +1,15 @@
+#define PY_SSIZE_T_CLEAN
 #include <Python.h>
+#include <pythread.h>
 
 #include <libavcodec/avcodec.h>
 #include <libavformat/avformat.h>
-#if LIBAVUTIL_VERSION_MAJOR > 52
-#include <libavutil/imgutils.h>
-#endif
 #include <libswscale/swscale.h>
 
+// largest width or height of a decoded image (keeps the image size and
+// line sizes within the int arithmetic of swscale)
+#define MAX_IMAGE_SIDE 16384
+
 struct PaVE {
 	uint8_t signature[4]; // "PaVE"
 	uint8_t version; // protocol version
@@ -36,14 +39,46 @@ struct PaVE {
 	uint8_t reserved2[12]; // padding to align to 64 bytes
 } __attribute__ ((packed));
 
+struct decoder {
+	AVCodecContext * context;
+	AVFrame * frame;
+	struct SwsContext * sws_context;
+};
+
+typedef struct {
+	PyObject_HEAD
+	struct decoder decoder;
+} Decoder;
+
 static PyObject * VideoDecodeError;
 
-static PyObject * video_decode(PyObject * self, PyObject * args);
+static PyObject * video_decode(PyObject * self, PyObject * args, PyObject * kwds);
+
+static int Decoder_init(Decoder * self, PyObject * args, PyObject * kwds);
+static void Decoder_dealloc(Decoder * self);
+static PyObject * Decoder_decode(Decoder * self, PyObject * args, PyObject * kwds);
 
 static PyMethodDef VideoMethods[] = {
-	{"decode",  video_decode, METH_VARARGS, "decode a PaVE video packet into an RGB image buffer"},
+	{"decode",  (PyCFunction)video_decode, METH_VARARGS | METH_KEYWORDS, "decode(packet, pixel_format='rgb24', width=0, height=0, crop=None) -- decode a PaVE video packet into an 'rgb24', 'yuv420p' or 'gray8' image buffer, optionally cropped to an (x, y, width, height) region and scaled to width x height (0 keeps the aspect ratio or size) in the same pass; calls from several threads are serialized"},
 	{NULL, NULL, 0, NULL}
 };
+
+static PyMethodDef DecoderMethods[] = {
+	{"decode",  (PyCFunction)Decoder_decode, METH_VARARGS | METH_KEYWORDS, "decode(packet, pixel_format='rgb24', width=0, height=0, crop=None) -- decode a PaVE video packet of this stream like ardrone.video.decode"},
+	{NULL, NULL, 0, NULL}
+};
+
+static PyTypeObject DecoderType = {
+	PyVarObject_HEAD_INIT(NULL, 0)
+	.tp_name = "ardrone.video.Decoder",
+	.tp_basicsize = sizeof(Decoder),
+	.tp_dealloc = (destructor)Decoder_dealloc,
+	.tp_flags = Py_TPFLAGS_DEFAULT,
+	.tp_doc = "h.264 decoder for a single video stream (use from one thread at a time)",
+	.tp_methods = DecoderMethods,
+	.tp_init = (initproc)Decoder_init,
+	.tp_new = PyType_GenericNew,
+};
 #if PY_MAJOR_VERSION > 2
 
 static struct PyModuleDef videomodule = {
@@ -56,9 +91,63 @@ static struct PyModuleDef videomodule = {
 #endif
 
 AVCodec * codec;
-AVCodecContext * context;
-AVFrame * frame;
-struct SwsContext * sws_context;
+struct decoder default_decoder;
+// serializes decode() calls, which release the GIL while using default_decoder
+static PyThread_type_lock default_lock;
+
+static int decoder_open(struct decoder * decoder) {
+	decoder->context = avcodec_alloc_context3(codec);
+	if (!decoder->context) {
+		PyErr_NoMemory();
+		return -1;
+	}
+
+	avcodec_get_context_defaults3(decoder->context, codec);
+	if (avcodec_open2(decoder->context, codec, NULL) < 0) {
+		PyErr_SetString(VideoDecodeError, "could not open h.264 codec");
+		return -1;
+	}
+
+#if LIBAVUTIL_VERSION_MAJOR > 52
+	decoder->frame = av_frame_alloc();
+#else
+	decoder->frame = avcodec_alloc_frame();
+#endif
+	if (!decoder->frame) {
+		PyErr_NoMemory();
+		return -1;
+	}
+
+	decoder->sws_context = NULL;
+
+	return 0;
+}
+
+static void decoder_close(struct decoder * decoder) {
+	if (decoder->sws_context) {
+		sws_freeContext(decoder->sws_context);
+		decoder->sws_context = NULL;
+	}
+
+	if (decoder->frame) {
+#if LIBAVUTIL_VERSION_MAJOR > 52
+		av_frame_free(&decoder->frame);
+#else
+		avcodec_free_frame(&decoder->frame);
+#endif
+		decoder->frame = NULL;
+	}
+
+	if (decoder->context) {
+#if LIBAVCODEC_VERSION_INT >= AV_VERSION_INT(55, 52, 102)
+		avcodec_free_context(&decoder->context);
+#else
+		avcodec_close(decoder->context);
+		av_free(decoder->context);
+#endif
+		decoder->context = NULL;
+	}
+}
 
 #if PY_MAJOR_VERSION > 2
 PyMODINIT_FUNC PyInit_video(void) {
@@ -67,6 +156,13 @@ PyMODINIT_FUNC initvideo(void) {
 #endif
 	PyObject * module;
 
+	if (PyType_Ready(&DecoderType) < 0)
+#if PY_MAJOR_VERSION > 2
+		return NULL;
+#else
+		return;
+#endif
+
 #if PY_MAJOR_VERSION > 2
 	module = PyModule_Create(&videomodule);
 #else
@@ -83,6 +179,9 @@ PyMODINIT_FUNC initvideo(void) {
 	Py_INCREF(VideoDecodeError);
 	PyModule_AddObject(module, "DecodeError", VideoDecodeError);
 
+	Py_INCREF(&DecoderType);
+	PyModule_AddObject(module, "Decoder", (PyObject *)&DecoderType);
+
 #if LIBAVFORMAT_VERSION_INT < AV_VERSION_INT(58, 9, 100)
 	av_register_all();
 
@@ -101,32 +200,15 @@ PyMODINIT_FUNC initvideo(void) {
 #endif
 	}
 
-	context = avcodec_alloc_context3(codec);
-	if (!context) {
-		PyErr_NoMemory();
+	if (decoder_open(&default_decoder) < 0)
 #if PY_MAJOR_VERSION > 2
 		return NULL;
 #else
 		return;
 #endif
-	}
 
-	avcodec_get_context_defaults3(context, codec);
-	if (avcodec_open2(context, codec, NULL) < 0) {
-		PyErr_SetString(VideoDecodeError, "could not open h.264 codec");
-#if PY_MAJOR_VERSION > 2
-		return NULL;
-#else
-		return;
-#endif
-	}
-
-#if LIBAVUTIL_VERSION_MAJOR > 52
-	frame = av_frame_alloc();
-#else
-	frame = avcodec_alloc_frame();
-#endif
-	if (!frame) {
+	default_lock = PyThread_allocate_lock();
+	if (!default_lock) {
 		PyErr_NoMemory();
 #if PY_MAJOR_VERSION > 2
 		return NULL;
@@ -140,33 +222,119 @@ PyMODINIT_FUNC initvideo(void) {
 #endif
 }
 
-static PyObject * video_decode(PyObject * self, PyObject * args) {
+static int Decoder_init(Decoder * self, PyObject * args, PyObject * kwds) {
+	if (!PyArg_ParseTuple(args, ""))
+		return -1;
+
+	decoder_close(&self->decoder);
+
+	if (decoder_open(&self->decoder) < 0) {
+		decoder_close(&self->decoder);
+		return -1;
+	}
+
+	return 0;
+}
+
+static void Decoder_dealloc(Decoder * self) {
+	decoder_close(&self->decoder);
+	Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+static void copy_plane(unsigned char * dst, const unsigned char * src, int src_linesize, int width, int height) {
+	int row;
+
+	for (row = 0; row < height; row++)
+		memcpy(dst + row*width, src + row*src_linesize, width);
+}
+
+static PyObject * decoder_decode(struct decoder * decoder, PyObject * args, PyObject * kwds) {
+	static char * kwlist[] = {"packet", "pixel_format", "width", "height", "crop", NULL};
+
 	unsigned char * data;
-	int data_size;
+	Py_ssize_t data_size;
+
+	const char * pixel_format = "rgb24";
+	enum AVPixelFormat format;
+
+	int width = 0;
+	int height = 0;
+
+	PyObject * crop = Py_None;
+	PyObject * crop_tuple;
+	int crop_x = 0;
+	int crop_y = 0;
+	int crop_width = 0;
+	int crop_height = 0;
 
 	struct PaVE header;
 	unsigned char * payload;
 
 	AVPacket packet;
 
+	int failed;
+
 #if LIBAVCODEC_VERSION_INT < AV_VERSION_INT(57, 106, 102)
 	int got_frame;
 	int frame_size;
 
 #endif
+	const unsigned char * source_data[4];
+	int source_linesize[4];
+
 	unsigned char * image;
-	int image_width;
-	int image_height;
-	int image_size;
+	Py_ssize_t image_size;
+	int chroma_width;
+	int chroma_height;
 
-	unsigned char * image_data[1];
-	int image_linesize[1];
+	unsigned char * image_data[4];
+	int image_linesize[4];
 
 	PyObject * py_image;
 
-	if (!PyArg_ParseTuple(args, "s#", &data, &data_size))
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "s#|siiO", kwlist, &data, &data_size, &pixel_format, &width, &height, &crop))
 		return NULL;
 
+	if (strcmp(pixel_format, "rgb24") == 0) {
+		format = AV_PIX_FMT_RGB24;
+	}
+	else if (strcmp(pixel_format, "yuv420p") == 0) {
+		format = AV_PIX_FMT_YUV420P;
+	}
+	else if (strcmp(pixel_format, "gray8") == 0) {
+		format = AV_PIX_FMT_GRAY8;
+	}
+	else {
+		PyErr_SetString(PyExc_ValueError, "pixel format must be 'rgb24', 'yuv420p' or 'gray8'");
+		return NULL;
+	}
+
+	if (width < 0 || height < 0) {
+		PyErr_SetString(PyExc_ValueError, "width and height must not be negative");
+		return NULL;
+	}
+
+	if (width > MAX_IMAGE_SIDE || height > MAX_IMAGE_SIDE) {
+		PyErr_Format(PyExc_ValueError, "width and height must not exceed %d", MAX_IMAGE_SIDE);
+		return NULL;
+	}
+
+	if (crop != Py_None) {
+		crop_tuple = PySequence_Tuple(crop);
+		if (!crop_tuple)
+			return NULL;
+
+		failed = !PyArg_ParseTuple(crop_tuple, "iiii;crop must be a (x, y, width, height) tuple", &crop_x, &crop_y, &crop_width, &crop_height);
+		Py_DECREF(crop_tuple);
+		if (failed)
+			return NULL;
+	}
+
+	if ((size_t)data_size < sizeof(struct PaVE)) {
+		PyErr_SetString(VideoDecodeError, "packet was shorter than a PaVE header");
+		return NULL;
+	}
+
 	header = *((struct PaVE *)data);
 	payload = data + header.header_size;
 
@@ -187,43 +355,157 @@ static PyObject * video_decode(PyObject * self, PyObject * args) {
 	packet.data = payload;
 	packet.size = header.payload_size;
 
+	// decode without holding the GIL so other threads (e.g. navdata) can run
+	Py_BEGIN_ALLOW_THREADS
 #if LIBAVCODEC_VERSION_INT >= AV_VERSION_INT(57, 106, 102)
-	if (avcodec_send_packet(context, &packet) != 0 || avcodec_receive_frame(context, frame) != 0) {
+	failed = avcodec_send_packet(decoder->context, &packet) != 0 || avcodec_receive_frame(decoder->context, decoder->frame) != 0;
+#else
+	frame_size = avcodec_decode_video2(decoder->context, decoder->frame, &got_frame, &packet);
+	failed = frame_size < 0 || !got_frame;
+#endif
+	Py_END_ALLOW_THREADS
+
+	if (failed) {
 		PyErr_SetString(VideoDecodeError, "could not decode frame");
 		return NULL;
 	}
-#else
-	frame_size = avcodec_decode_video2(context, frame, &got_frame, &packet);
-	if (frame_size < 0 || !got_frame) {
-		PyErr_SetString(VideoDecodeError, "could not decode frame");
+
+	if (crop == Py_None) {
+		crop_width = decoder->frame->width;
+		crop_height = decoder->frame->height;
+	}
+	else {
+		// compared without adding, which could overflow
+		if (crop_x < 0 || crop_y < 0 || crop_width <= 0 || crop_height <= 0 || crop_width > decoder->frame->width - crop_x || crop_height > decoder->frame->height - crop_y) {
+			PyErr_SetString(PyExc_ValueError, "crop must lie within the frame");
+			return NULL;
+		}
+
+		// chroma planes have half the resolution, so crop at even offsets
+		crop_x &= ~1;
+		crop_y &= ~1;
+	}
+
+	// a missing dimension keeps the aspect ratio of the (cropped) frame
+	if (width == 0 && height == 0) {
+		width = crop_width;
+		height = crop_height;
+	}
+	else if (width == 0) {
+		width = (crop_width*height + crop_height/2)/crop_height;
+	}
+	else if (height == 0) {
+		height = (crop_height*width + crop_width/2)/crop_width;
+	}
+
+	if (width == 0 || height == 0) {
+		PyErr_SetString(PyExc_ValueError, "frame size is too small");
 		return NULL;
 	}
-#endif
 
-	image_width = frame->width;
-	image_height = frame->height;
+	// keeping the aspect ratio can make the other side too large
+	if (width > MAX_IMAGE_SIDE || height > MAX_IMAGE_SIDE) {
+		PyErr_Format(PyExc_ValueError, "frame size %dx%d exceeds %d", width, height, MAX_IMAGE_SIDE);
+		return NULL;
+	}
 
-#if LIBAVUTIL_VERSION_MAJOR > 52
-	image_size = av_image_get_buffer_size(AV_PIX_FMT_RGB24, image_width, image_height, 1)*sizeof(uint8_t);
+	// crop by pointing the scaler at the top left corner of the region
+	source_data[0] = decoder->frame->data[0] + crop_y*decoder->frame->linesize[0] + crop_x;
+	source_data[1] = decoder->frame->data[1] + crop_y/2*decoder->frame->linesize[1] + crop_x/2;
+	source_data[2] = decoder->frame->data[2] + crop_y/2*decoder->frame->linesize[2] + crop_x/2;
+	source_data[3] = NULL;
+	source_linesize[0] = decoder->frame->linesize[0];
+	source_linesize[1] = decoder->frame->linesize[1];
+	source_linesize[2] = decoder->frame->linesize[2];
+	source_linesize[3] = 0;
+
+	chroma_width = (width + 1)/2;
+	chroma_height = (height + 1)/2;
+
+	// at most 3*MAX_IMAGE_SIDE^2 bytes, which fits a Py_ssize_t
+	if (format == AV_PIX_FMT_YUV420P)
+		image_size = (Py_ssize_t)width*height + 2*(Py_ssize_t)chroma_width*chroma_height;
+	else if (format == AV_PIX_FMT_GRAY8)
+		image_size = (Py_ssize_t)width*height;
+	else
+		image_size = (Py_ssize_t)width*height*3;
+
+	// convert straight into the returned bytes object
+#if PY_MAJOR_VERSION > 2
+	py_image = PyBytes_FromStringAndSize(NULL, image_size);
 #else
-	image_size = avpicture_get_size(AV_PIX_FMT_RGB24, image_width, image_height)*sizeof(uint8_t);
+	py_image = PyString_FromStringAndSize(NULL, image_size);
 #endif
+	if (!py_image)
+		return NULL;
 
-	image = (unsigned char *)av_malloc(image_size);
+#if PY_MAJOR_VERSION > 2
+	image = (unsigned char *)PyBytes_AS_STRING(py_image);
+#else
+	image = (unsigned char *)PyString_AS_STRING(py_image);
+#endif
 
 	image_data[0] = image;
-	image_linesize[0] = image_size/image_height;
+	image_data[1] = image + (Py_ssize_t)width*height;
+	image_data[2] = image + (Py_ssize_t)width*height + (Py_ssize_t)chroma_width*chroma_height;
+	image_data[3] = NULL;
+	image_linesize[0] = format == AV_PIX_FMT_RGB24 ? width*3 : width;
+	image_linesize[1] = chroma_width;
+	image_linesize[2] = chroma_width;
+	image_linesize[3] = 0;
+
+	failed = 0;
+
+	Py_BEGIN_ALLOW_THREADS
+	if (format != AV_PIX_FMT_RGB24 && width == crop_width && height == crop_height) {
+		// hand out the planes of the decoder without scaling or color conversion
+		copy_plane(image_data[0], source_data[0], source_linesize[0], width, height);
+		if (format == AV_PIX_FMT_YUV420P) {
+			copy_plane(image_data[1], source_data[1], source_linesize[1], chroma_width, chroma_height);
+			copy_plane(image_data[2], source_data[2], source_linesize[2], chroma_width, chroma_height);
+		}
+	}
+	else {
+		// crop, scale and convert in a single pass
+		decoder->sws_context = sws_getCachedContext(decoder->sws_context, crop_width, crop_height, AV_PIX_FMT_YUV420P, width, height, format, SWS_FAST_BILINEAR, NULL, NULL, NULL);
+		if (decoder->sws_context)
+			sws_scale(decoder->sws_context, (const unsigned char * const *)source_data, source_linesize, 0, crop_height, image_data, image_linesize);
+		else
+			failed = 1;
+	}
+	Py_END_ALLOW_THREADS
 
-	sws_context = sws_getCachedContext(sws_context, context->width, context->height, AV_PIX_FMT_YUV420P, context->width, context->height, AV_PIX_FMT_RGB24, SWS_FAST_BILINEAR, NULL, NULL, NULL);
-	sws_scale(sws_context, (const unsigned char * const *)frame->data, frame->linesize, 0, frame->height, image_data, image_linesize);
+	if (failed) {
+		Py_DECREF(py_image);
+		PyErr_SetString(VideoDecodeError, "could not create scaling context");
+		return NULL;
+	}
 
-#if PY_MAJOR_VERSION > 2
-	py_image = Py_BuildValue("iiy#", image_width, image_height, image, image_size);
-#else
-	py_image = Py_BuildValue("iis#", image_width, image_height, image, image_size);
-#endif
+	return Py_BuildValue("iiN", width, height, py_image);
+}
+
+static PyObject * video_decode(PyObject * self, PyObject * args, PyObject * kwds) {
+	PyObject * result;
 
-	av_free(image);
+	if (!PyThread_acquire_lock(default_lock, NOWAIT_LOCK)) {
+		// wait for another thread decoding without holding the GIL
+		Py_BEGIN_ALLOW_THREADS
+		PyThread_acquire_lock(default_lock, WAIT_LOCK);
+		Py_END_ALLOW_THREADS
+	}
+
+	result = decoder_decode(&default_decoder, args, kwds);
+
+	PyThread_release_lock(default_lock);
+
+	return result;
+}
+
+static PyObject * Decoder_decode(Decoder * self, PyObject * args, PyObject * kwds) {
+	if (!self->decoder.context) {
+		PyErr_SetString(VideoDecodeError, "decoder is not initialized");
+		return NULL;
+	}
 
-	return py_image;
+	return decoder_decode(&self->decoder, args, kwds);
 }
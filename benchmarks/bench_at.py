@@ -0,0 +1,66 @@
+"""
+Benchmark AT command encoding.
+
+Encodes PCMD, REF and CONFIG commands with ardrone.at.encode and with the
+original encoder and reports encoded commands per second for each.
+"""
+
+import argparse
+import struct
+import timeit
+
+import ardrone.at
+
+
+def f2i_reference(f):
+    """Original float reinterpretation, kept for comparison."""
+    return struct.unpack('i', struct.pack('f', f))[0]
+
+
+def encode_reference(command, seq, params=[]):
+    """Original AT command encoder, kept for comparison."""
+    params_str = []
+    for p in params:
+        if type(p) == int:
+            params_str.append('{:d}'.format(p))
+        elif type(p) == float:
+            params_str.append('{:d}'.format(f2i_reference(p)))
+        elif type(p) == str:
+            params_str.append('"{:s}"'.format(p))
+
+    return 'AT*{:s}={:d}{:s}\r'.format(command, seq, ''.join(',' + param for param in params_str)).encode()
+
+
+COMMANDS = [
+    ('PCMD', [1, -0.2, 0.05, 0.5, -1.0]),
+    ('REF', [0b10001010101000000000001000000000]),
+    ('CONFIG', ['video:video_channel', '1']),
+]
+
+
+def bench(encoder, command, params, number):
+    """Return encoded commands per second."""
+    def run():
+        for seq in range(number):
+            encoder(command, seq, params)
+
+    return number / min(timeit.repeat(run, number=1, repeat=5))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark AT command encoding')
+    parser.add_argument('-n', '--number', type=int, default=100000, help='commands encoded per run')
+    args = parser.parse_args()
+
+    for command, params in COMMANDS:
+        assert ardrone.at.encode(command, 1, params) == encode_reference(command, 1, params)
+
+        print(command)
+        reference = bench(encode_reference, command, params, args.number)
+        current = bench(ardrone.at.encode, command, params, args.number)
+        print('  reference: {:10.0f} commands/s'.format(reference))
+        print('  encode:    {:10.0f} commands/s ({:.1f}x)'.format(current, current / reference))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Benchmark an ARDrone end to end against the local simulator.
+
+Starts an ardrone.sim.Simulator on the loopback interface, connects an
+ARDrone to it and reports:
+
+- command to acknowledgement latency (CONFIG until the command ACK state
+  flag and REF until the fly state flag are seen in drone.navdata)
+- navdata packets per second delivered to drone.navdata
+- video frames per second delivered to drone.image
+
+Synthetic video frames do not decode to images, so pass a recorded stream
+with --video to measure decoded frames.
+"""
+
+import argparse
+import time
+
+import ardrone
+import ardrone.constant
+import ardrone.metrics
+import ardrone.sim
+
+
+def wait(condition, timeout=5.0):
+    """Poll condition until it holds and return whether it did."""
+    deadline = ardrone.metrics.clock() + timeout
+    while not condition():
+        if ardrone.metrics.clock() > deadline:
+            return False
+        time.sleep(0.0002)
+
+    return True
+
+
+def state(drone, name):
+    """Return a state flag of the latest navdata."""
+    navdata = drone.navdata
+    return 'state' in navdata and bool(navdata['state'][name])
+
+
+def ack_latency(drone, count):
+    """Return the histogram of CONFIG to command ACK latencies."""
+    histogram = ardrone.metrics.Histogram()
+    for index in range(count):
+        start = ardrone.metrics.clock()
+        drone.atcmd.config('custom:bench', index)
+        if not wait(lambda: state(drone, 'command')):
+            raise RuntimeError('CONFIG was not acknowledged')
+        histogram.add(ardrone.metrics.clock() - start)
+
+        drone.atcmd.ctrl(ardrone.constant.CONTROL_MODE_ACK)
+        if not wait(lambda: not state(drone, 'command')):
+            raise RuntimeError('ACK was not cleared')
+
+    return histogram
+
+
+def takeoff_latency(drone, count):
+    """Return the histogram of REF takeoff to fly state latencies."""
+    histogram = ardrone.metrics.Histogram()
+    for index in range(count):
+        start = ardrone.metrics.clock()
+        drone.takeoff()
+        if not wait(lambda: state(drone, 'fly')):
+            raise RuntimeError('takeoff was not reported')
+        histogram.add(ardrone.metrics.clock() - start)
+
+        drone.land()
+        if not wait(lambda: not state(drone, 'fly')):
+            raise RuntimeError('landing was not reported')
+
+    return histogram
+
+
+def throughput(drone, simulator, duration):
+    """Return sent and delivered navdata packets and video frames per second."""
+    def counts():
+        stats = drone.stats()
+        return (simulator.navdata_sent, simulator.frames_sent, stats['navdata']['age']['count'], stats['video']['age']['count'])
+
+    before = counts()
+    time.sleep(duration)
+    after = counts()
+
+    return [(a - b)/duration for a, b in zip(after, before)]
+
+
+def report(name, summary):
+    """Print a latency histogram summary (see ardrone.metrics.Histogram.snapshot()) in milliseconds."""
+    print('  {:8s} p50 {:7.2f} ms  p90 {:7.2f} ms  max {:7.2f} ms'.format(name, summary['p50']*1000, summary['p90']*1000, summary['max']*1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark an ARDrone end to end against the simulator')
+    parser.add_argument('-d', '--duration', type=float, default=5.0, help='seconds to measure throughput for')
+    parser.add_argument('-n', '--number', type=int, default=50, help='command round trips to measure')
+    parser.add_argument('-r', '--navdata-rate', type=int, default=200, help='navdata packets per second sent by the simulator')
+    parser.add_argument('-f', '--fps', type=int, default=30, help='video frames per second sent by the simulator')
+    parser.add_argument('-v', '--video', help='H.264 elementary stream (.h264) or recorded PaVE stream to send')
+    parser.add_argument('--shared-frames', action='store_true', help='pass frames through shared memory')
+    args = parser.parse_args()
+
+    frames = None
+    if args.video:
+        frames = ardrone.sim.load_h264(args.video) if args.video.endswith('.h264') else ardrone.sim.load_pave(args.video)
+
+    simulator = ardrone.sim.Simulator('127.0.0.1', args.navdata_rate, args.fps, frames)
+    drone = ardrone.ARDrone('127.0.0.1', shared_frames=args.shared_frames)
+    try:
+        if not wait(lambda: 'state' in drone.navdata):
+            raise RuntimeError('no navdata received from the simulator')
+
+        print('command latency ({} round trips)'.format(args.number))
+        report('CONFIG', ack_latency(drone, args.number).snapshot())
+        report('REF', takeoff_latency(drone, args.number).snapshot())
+
+        navdata_sent, frames_sent, navdata_delivered, frames_delivered = throughput(drone, simulator, args.duration)
+        print('throughput ({:.0f} s)'.format(args.duration))
+        print('  navdata  {:7.1f} packets/s delivered of {:7.1f} sent'.format(navdata_delivered, navdata_sent))
+        stats = drone.stats()
+        print('  video    {:7.1f} frames/s delivered of {:7.1f} sent {}'.format(frames_delivered, frames_sent, dict((name, stats['video'][name]) for name in ('received', 'decoded', 'dropped', 'errors'))))
+
+        print('delivery latency')
+        report('navdata', stats['navdata']['age'])
+        if stats['video']['age']['count']:
+            report('video', stats['video']['age'])
+    finally:
+        drone.halt()
+        simulator.halt()
+
+
+if __name__ == '__main__':
+    main()
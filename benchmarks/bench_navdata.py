@@ -0,0 +1,138 @@
+"""
+Benchmark navdata packet decoding.
+
+Decodes a set of synthesized navdata packets (demo only and full navdata with
+every known option block) with ardrone.navdata.decode and with the original
+byte-by-byte decoder and reports packets per second for each. Also reports
+the rate of a typical control loop access (three demo fields and the fly
+flag) through decode and through a lazy ardrone.navdata.NavdataView.
+"""
+
+import argparse
+import struct
+import timeit
+
+import ardrone.navdata
+
+
+def decode_reference(packet):
+    """Original navdata decoder, kept for comparison."""
+    offset = 0
+
+    _ = struct.unpack_from('IIII', packet, offset)
+    s = _[1]
+    state = dict()
+    for name, bit in ardrone.navdata.STATE_BITS:
+        state[name] = s >> bit & 1
+
+    data = dict()
+    data['state'] = state
+    data['header'] = _[0]
+    data['sequence'] = _[2]
+    data['vision'] = _[3]
+
+    offset += struct.calcsize('IIII')
+
+    demo_fields = [
+        'ctrl_state',
+        'battery',
+        'theta',
+        'phi',
+        'psi',
+        'altitude',
+        'vx',
+        'vy',
+        'vz',
+        'num_frames'
+    ]
+    angles = ['theta', 'phi', 'psi']
+    while True:
+        try:
+            id_nr, size = struct.unpack_from('HH', packet, offset)
+            offset += struct.calcsize('HH')
+        except struct.error:
+            break
+
+        values = []
+        for i in range(size - struct.calcsize('HH')):
+            values.append(struct.unpack_from('c', packet, offset)[0])
+            offset += struct.calcsize('c')
+
+        if id_nr == 0:
+            values = struct.unpack_from('IIfffIfffI', b''.join(values))
+            demo = dict(zip(demo_fields, values))
+            for a in angles:
+                demo[a] = int(demo[a] / 1000)
+
+            data['demo'] = demo
+
+    return data
+
+
+def option(id_nr, fmt, values=None):
+    """Pack an option block with the given layout."""
+    payload_struct = struct.Struct(fmt)
+    if values is None:
+        values = [0] * len(payload_struct.unpack(bytes(bytearray(payload_struct.size))))
+    return struct.pack('<HH', id_nr, 4 + payload_struct.size) + payload_struct.pack(*values)
+
+
+def packet(sequence, full):
+    """Synthesize a navdata packet."""
+    demo = option(0, '<IIfffIfffI', [0x20000, 87, 1500.0, -2500.0, 90000.0, 1200, 0.1, -0.2, 0.3, 0])
+    data = struct.pack('<IIII', 0x55667788, 0x0f800c15, sequence, 1) + demo
+
+    if full:
+        for id_nr, (name, fmt, fields) in sorted(ardrone.navdata.OPTIONS.items()):
+            if id_nr != 0 and id_nr != 0xffff:
+                data += option(id_nr, fmt)
+
+    return data + option(0xffff, '<I', [0])
+
+
+def control_loop(decoder):
+    """Return a decoder that reads what a typical control loop reads."""
+    def read(packet):
+        navdata = decoder(packet)
+        demo = navdata['demo']
+        return demo['altitude'], demo['theta'], demo['phi'], navdata['state']['fly']
+
+    return read
+
+
+def bench(decoder, packets, number):
+    """Return decoded packets per second."""
+    def run():
+        for p in packets:
+            decoder(p)
+
+    return number * len(packets) / min(timeit.repeat(run, number=number, repeat=3))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark navdata decoding')
+    parser.add_argument('-n', '--number', type=int, default=20, help='passes over the packet set per run')
+    parser.add_argument('-p', '--packets', type=int, default=200, help='number of packets in the packet set')
+    args = parser.parse_args()
+
+    for full in (False, True):
+        packets = [packet(sequence, full) for sequence in range(args.packets)]
+
+        decoded, reference = ardrone.navdata.decode(packets[0]), decode_reference(packets[0])
+        assert all(decoded[key] == reference[key] for key in reference)
+
+        print('{} navdata ({} bytes/packet)'.format('full' if full else 'demo', len(packets[0])))
+        reference = bench(decode_reference, packets, args.number)
+        current = bench(ardrone.navdata.decode, packets, args.number)
+        print('  reference: {:10.0f} packets/s'.format(reference))
+        print('  decode:    {:10.0f} packets/s ({:.1f}x)'.format(current, current / reference))
+
+        eager = bench(control_loop(ardrone.navdata.decode), packets, args.number)
+        lazy = bench(control_loop(ardrone.navdata.NavdataView), packets, args.number)
+        print('  control loop access')
+        print('    decode:      {:10.0f} packets/s'.format(eager))
+        print('    NavdataView: {:10.0f} packets/s ({:.1f}x)'.format(lazy, lazy / eager))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Benchmark navdata ingest.
+
+A flooder process sends synthesized navdata packets (demo only or full
+navdata) over the loopback interface as fast as possible (or at --rate
+packets per second), optionally reordering and duplicating some of them.
+The packets are received and wrapped in ardrone.navdata.NavdataView:
+
+- recvfrom: one blocking recvfrom(65535) per datagram (the original loop)
+- receiver: batches of recv_into into preallocated buffers with sequence
+  filtering by ardrone.network.NavdataReceiver
+
+For each, reports the packets handled per second while flooding, the
+packets lost on the way (mostly dropped by the kernel because the receiver
+fell behind), the reordered and duplicate packets filtered out and how many
+drones sending 200 packets per second that rate corresponds to.
+"""
+
+import argparse
+import multiprocessing
+import random
+import select
+import socket
+import time
+
+import ardrone.metrics
+import ardrone.navdata
+import ardrone.network
+import ardrone.sim
+
+
+# navdata rate of a drone in full navdata mode
+DRONE_RATE = 200
+
+
+def packets(count, full, reorder, duplicate, seed=0):
+    """Return count encoded packets with some of them reordered or duplicated."""
+    options = [(0, [0x30000, 80, 1000.0, -2000.0, 45000.0, 1200, 0.1, 0.2, 0.3, 0])]
+    if full:
+        options += sorted(ardrone.sim._zero_options.items())
+
+    encoded = [ardrone.sim.encode_navdata(0x0f800c15, sequence, options) for sequence in range(1, count + 1)]
+
+    generator = random.Random(seed)
+    for i in range(len(encoded) - 1):
+        if generator.random() < reorder:
+            encoded[i], encoded[i + 1] = encoded[i + 1], encoded[i]
+    for i in reversed(range(len(encoded))):
+        if generator.random() < duplicate:
+            encoded.insert(i, encoded[i])
+
+    return encoded
+
+
+def flood(address, encoded, rate, ready):
+    """Send the packets to address (run in the flooder process)."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    ready.wait()
+
+    started = time.time()
+    for i, data in enumerate(encoded):
+        sock.sendto(data, address)
+        if rate and i % 32 == 0:
+            delay = started + i/float(rate) - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+    sock.close()
+
+
+def ingest_recvfrom(sock, metrics, idle):
+    """Receive with one recvfrom per datagram until idle seconds pass without data."""
+    sock.settimeout(idle)
+    handled = 0
+    while True:
+        try:
+            data, addr = sock.recvfrom(65535)
+        except socket.timeout:
+            return handled
+
+        metrics.count('packets')
+        ardrone.navdata.NavdataView(data)
+        handled += 1
+
+
+def ingest_receiver(sock, metrics, idle, buffer_size):
+    """Receive with a NavdataReceiver until idle seconds pass without data."""
+    sock.setblocking(False)
+    receiver = ardrone.network.NavdataReceiver(sock, metrics, buffer_size=buffer_size)
+    handled = 0
+    while True:
+        inputready, outputready, exceptready = select.select([sock], [], [], idle)
+        if not inputready:
+            return handled
+
+        for data in receiver.receive():
+            ardrone.navdata.NavdataView(data)
+            handled += 1
+
+
+def run(mode, encoded, rate, buffer_size, idle=0.2):
+    """Flood a fresh socket and return (handled, metrics, seconds)."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    metrics = ardrone.network.stream_metrics()['navdata']
+
+    ready = multiprocessing.Event()
+    flooder = multiprocessing.Process(target=flood, args=(sock.getsockname(), encoded, rate, ready))
+    flooder.start()
+
+    ready.set()
+    started = ardrone.metrics.clock()
+    if mode == 'recvfrom':
+        handled = ingest_recvfrom(sock, metrics, idle)
+    else:
+        handled = ingest_receiver(sock, metrics, idle, buffer_size)
+    seconds = ardrone.metrics.clock() - started - idle
+
+    flooder.join()
+    sock.close()
+
+    return handled, metrics, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark navdata ingest with a local UDP flooder')
+    parser.add_argument('-n', '--number', type=int, default=100000, help='packets to send')
+    parser.add_argument('--full', action='store_true', help='send full navdata instead of demo navdata')
+    parser.add_argument('--rate', type=int, default=0, help='packets per second to send (0: as fast as possible)')
+    parser.add_argument('--reorder', type=float, default=0.01, help='fraction of packets swapped with the next one')
+    parser.add_argument('--duplicate', type=float, default=0.01, help='fraction of packets sent twice')
+    parser.add_argument('--buffer-size', type=int, default=256*1024, help='SO_RCVBUF of the receiver socket')
+    args = parser.parse_args()
+
+    encoded = packets(args.number, args.full, args.reorder, args.duplicate)
+    print('{} {} navdata packets ({} bytes/packet) at {}'.format(
+        len(encoded), 'full' if args.full else 'demo', len(encoded[0]),
+        '{} packets/s'.format(args.rate) if args.rate else 'full speed',
+    ))
+
+    for mode in ('recvfrom', 'receiver'):
+        handled, metrics, seconds = run(mode, encoded, args.rate, args.buffer_size)
+        received = metrics['packets']
+        print('  {:9s} {:9.0f} packets/s ({:6.0f} drones)  lost {:6d}  reordered {:5d}  duplicates {:5d}'.format(
+            mode, handled/seconds, handled/seconds/DRONE_RATE, len(encoded) - received, metrics['reordered'], metrics['duplicates'],
+        ))
+
+
+if __name__ == '__main__':
+    main()
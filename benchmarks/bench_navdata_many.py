@@ -0,0 +1,76 @@
+"""
+Benchmark bulk navdata decoding.
+
+Writes a file of concatenated synthesized navdata packets (demo only, full
+navdata or, with --mixed, runs of both) and decodes it:
+
+- decode: ardrone.navdata.decode() packet by packet (on a sample)
+- decode_many (1 process): ardrone.navdata.decode_many() in this process
+- decode_many (N processes): decode_many() split across a process pool
+
+and reports the packets decoded per second of each.
+"""
+
+import argparse
+import os
+import tempfile
+import timeit
+
+import ardrone.metrics
+import ardrone.navdata
+import ardrone.sim
+
+
+def packets(count, full, mixed, run=100):
+    """Return count encoded packets (switching layouts every run packets if mixed)."""
+    encoded = []
+    for sequence in range(1, count + 1):
+        demo = [0x30000, 80, 1000.0, -2000.0, 45000.0, 1200 + sequence % 100, 0.1, 0.2, 0.3, sequence]
+        options = [(0, demo)]
+        if full or (mixed and (sequence // run) % 2):
+            options += sorted(ardrone.sim._zero_options.items())
+        encoded.append(ardrone.sim.encode_navdata(0x0f800c15, sequence, options))
+
+    return encoded
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark decoding many navdata packets into columnar arrays')
+    parser.add_argument('-n', '--number', type=int, default=1000000, help='packets to decode')
+    parser.add_argument('--full', action='store_true', help='full navdata instead of demo navdata')
+    parser.add_argument('--mixed', action='store_true', help='alternate between runs of demo and full navdata')
+    parser.add_argument('--sample', type=int, default=20000, help='packets decoded one by one with decode()')
+    parser.add_argument('-p', '--processes', type=int, default=os.cpu_count(), help='processes of the pool')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='runs per measurement (the best counts)')
+    args = parser.parse_args()
+
+    # repeat a block of distinct packets to keep generating the input cheap
+    block = packets(min(args.number, 10000), args.full, args.mixed)
+    encoded = (block*(args.number//len(block) + 1))[:args.number]
+
+    with tempfile.NamedTemporaryFile(suffix='.navdata') as f:
+        for data in encoded:
+            f.write(data)
+        f.flush()
+        size = f.tell()
+
+        print('{} {} navdata packets ({:.1f} MB)'.format(
+            args.number, 'mixed' if args.mixed else 'full' if args.full else 'demo', size/1e6,
+        ))
+
+        sample = encoded[:args.sample]
+        seconds = min(timeit.repeat(lambda: [ardrone.navdata.decode(data) for data in sample], number=1, repeat=args.repeat))
+        print('  {:28s} {:12.0f} packets/s'.format('decode', len(sample)/seconds))
+
+        for processes in sorted(set([1, args.processes])):
+            times = []
+            for _ in range(args.repeat):
+                start = ardrone.metrics.clock()
+                result = ardrone.navdata.decode_many(f.name, processes, chunk_size=max(size//(4*processes), 1) if processes > 1 else ardrone.navdata.MANY_CHUNK_SIZE)
+                times.append(ardrone.metrics.clock() - start)
+            assert len(result) == args.number
+            print('  {:28s} {:12.0f} packets/s'.format('decode_many ({} process{})'.format(processes, 'es' if processes > 1 else ''), args.number/min(times)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark startup cost.
+
+Measures in fresh interpreters how long importing ardrone and some of its
+modules takes and which heavy modules (multiprocessing, PIL, the video
+decoder, ...) each import pulls in, then how long constructing an ARDrone
+with connect=False takes. With --connect, also measures the time from
+connect() until the first navdata packet of a local ardrone.sim.Simulator
+arrives (without video).
+"""
+
+import argparse
+import subprocess
+import sys
+import timeit
+
+import ardrone
+
+
+IMPORTS = ['ardrone', 'ardrone.drone', 'ardrone.navdata', 'ardrone.at']
+
+# modules that should only be imported once they are needed
+HEAVY = ['multiprocessing', 'concurrent.futures', 'PIL', 'numpy', 'ardrone.video', 'ardrone.network']
+
+SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+print(' '.join(name for name in {heavy!r} if name in sys.modules))
+'''
+
+
+def import_time(module, repeat):
+    """Return the import times of module in fresh interpreters and the heavy modules it imported."""
+    times = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', SCRIPT.format(module=module, heavy=HEAVY)], universal_newlines=True)
+        seconds, heavy = (output.splitlines() + [''])[:2]
+        times.append(float(seconds))
+
+    return sorted(times), heavy.split()
+
+
+def connect_time(repeat):
+    """Return the times from connect() until the first navdata packet arrives."""
+    import time
+
+    import ardrone.metrics
+    import ardrone.sim
+
+    times = []
+    with ardrone.sim.Simulator():
+        for _ in range(repeat):
+            drone = ardrone.ARDrone('127.0.0.1', video=False, connect=False)
+            start = ardrone.metrics.clock()
+            drone.connect()
+            while drone.metrics['navdata']['packets'] == 0:
+                time.sleep(0.0005)
+            times.append(ardrone.metrics.clock() - start)
+            drone.halt()
+
+    return sorted(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark import and construction time')
+    parser.add_argument('-r', '--repeat', type=int, default=10, help='fresh interpreters per import')
+    parser.add_argument('-n', '--number', type=int, default=1000, help='drones constructed per run')
+    parser.add_argument('--connect', action='store_true', help='also measure connecting to a local simulator')
+    args = parser.parse_args()
+
+    print('import (fresh interpreter)')
+    for module in IMPORTS:
+        times, heavy = import_time(module, args.repeat)
+        print('  {:16s} min {:7.2f} ms  median {:7.2f} ms  imports {}'.format(module, times[0]*1000, times[len(times)//2]*1000, ', '.join(heavy) or 'nothing heavy'))
+
+    construct = min(timeit.repeat(lambda: ardrone.ARDrone(connect=False), number=args.number, repeat=5))/args.number
+    print('ARDrone(connect=False)  {:7.1f} us'.format(construct*1e6))
+
+    if args.connect:
+        times = connect_time(args.repeat)
+        print('connect() to first navdata  min {:7.2f} ms  median {:7.2f} ms'.format(times[0]*1000, times[len(times)//2]*1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark video decoding.
+
+Decodes every frame of the video stream of a recording (see
+ardrone.recorder) with a fresh ardrone.video.Decoder for each decode
+setting: full frames as rgb24, yuv420p and gray8, a 160x90 gray8 thumbnail
+and a centered crop. Reports the decode time per frame and the bytes per
+frame that would be sent across the video pipe.
+"""
+
+import argparse
+
+import ardrone.metrics
+import ardrone.pave
+import ardrone.recorder
+import ardrone.video
+
+
+# (name, pixel format, width, height, crop as fractions of the frame)
+SETTINGS = [
+    ('rgb24', 'rgb24', 0, 0, None),
+    ('yuv420p', 'yuv420p', 0, 0, None),
+    ('gray8', 'gray8', 0, 0, None),
+    ('gray8 160x90', 'gray8', 160, 90, None),
+    ('rgb24 160x90', 'rgb24', 160, 90, None),
+    ('rgb24 center crop', 'rgb24', 0, 0, (0.25, 0.25, 0.5, 0.5)),
+]
+
+
+def frames(path, number):
+    """Return the raw PaVE frames of the first number video records."""
+    with ardrone.recorder.Replayer(path) as replayer:
+        data = [bytes(record.data) for record in replayer.records(streams=(ardrone.recorder.VIDEO,))]
+
+    return data[:number] if number else data
+
+
+def decode_all(data, pixel_format, width, height, crop):
+    """Decode every frame and return (seconds per frame, bytes per frame)."""
+    decoder = ardrone.video.Decoder()
+    seconds = 0.0
+    decoded = 0
+    total = 0
+    for frame in data:
+        crop_box = None
+        if crop is not None:
+            header = ardrone.pave.Header(*ardrone.pave.HEADER.unpack_from(frame))
+            frame_width, frame_height = header.display_width, header.display_height
+            crop_box = (int(frame_width*crop[0]), int(frame_height*crop[1]), int(frame_width*crop[2]), int(frame_height*crop[3]))
+
+        start = ardrone.metrics.clock()
+        try:
+            result = decoder.decode(frame, pixel_format, width, height, crop_box)
+        except ardrone.video.DecodeError:
+            continue
+        seconds += ardrone.metrics.clock() - start
+
+        decoded += 1
+        total += len(result[2])
+
+    return seconds/max(decoded, 1), total/max(decoded, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark video decoding with scaling, cropping and pixel formats')
+    parser.add_argument('recording', help='recording directory with a video stream')
+    parser.add_argument('-n', '--number', type=int, default=0, help='frames to decode (0: all)')
+    args = parser.parse_args()
+
+    data = frames(args.recording, args.number)
+    print('{} frames'.format(len(data)))
+
+    for name, pixel_format, width, height, crop in SETTINGS:
+        seconds, size = decode_all(data, pixel_format, width, height, crop)
+        print('  {:18s} {:7.3f} ms/frame  {:8.0f} bytes/frame'.format(name, seconds*1000, size))
+
+
+if __name__ == '__main__':
+    main()
@@ -29,6 +29,10 @@ setup(
     author='Lily Foster',
     author_email='lily@lily.flowers',
     install_requires=['Pillow'],
+    extras_require={
+        'numpy': ['numpy'],
+    },
+    python_requires='>=3.7',
     packages=find_packages(),
     ext_modules=[video],
     classifiers=[
@@ -40,8 +44,8 @@ setup(
         'Operating System :: MacOS :: MacOS X',
         'Operating System :: Microsoft :: Windows',
         'Programming Language :: Python',
-        'Programming Language :: Python :: 2',
         'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
         'Programming Language :: C',
         'Topic :: Scientific/Engineering',
         'Topic :: System :: Hardware :: Hardware Drivers',
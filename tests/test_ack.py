@@ -0,0 +1,98 @@
+import time
+
+import pytest
+
+import ardrone.ack
+import ardrone.navdata
+
+
+FLY = 1 << ardrone.navdata.STATE_SHIFTS['fly']
+EMERGENCY = 1 << ardrone.navdata.STATE_SHIFTS['emergency']
+
+
+class StandinATCommand(object):
+    """Records the REF commands the acknowledgements send."""
+
+    def __init__(self):
+        self.listeners = []
+        self.sent = []
+
+    def ref(self, takeoff, emergency=False):
+        self.sent.append(('REF', takeoff, emergency))
+
+    def tick(self):
+        for listener in self.listeners:
+            listener()
+
+
+def test_takeoff_and_land():
+    atcmd = StandinATCommand()
+    acks = ardrone.ack.Acknowledgements(atcmd)
+    acks.update(0)
+
+    future = acks.takeoff()
+    assert atcmd.sent == [('REF', True, False)]
+    acks.update(0)
+    assert not future.done()
+    acks.update(FLY)
+    assert future.result(0) == FLY
+
+    # already landed steps end at once
+    acks.update(0)
+    assert acks.land().result(0) == 0
+    assert sorted(acks.stats()) == ['land', 'takeoff']
+    assert acks.stats()['takeoff']['timeouts'] == 0
+
+
+def test_reset_resends_until_emergency_toggles():
+    atcmd = StandinATCommand()
+    acks = ardrone.ack.Acknowledgements(atcmd)
+    acks.update(EMERGENCY)
+
+    future = acks.reset()
+    atcmd.tick()
+    atcmd.tick()
+    assert atcmd.sent == [('REF', False, True)]*3
+    assert not future.done()
+
+    acks.update(0)
+    assert future.result(0) == 0
+    # the emergency flag is cleared afterwards
+    assert atcmd.sent[-1] == ('REF', False, False)
+    atcmd.tick()
+    assert atcmd.sent[-1] == ('REF', False, False)
+
+
+def test_state_source_is_polled_on_tick():
+    state = [0]
+    atcmd = StandinATCommand()
+    acks = ardrone.ack.Acknowledgements(atcmd, state=lambda: state[0])
+
+    future = acks.takeoff()
+    atcmd.tick()
+    assert not future.done()
+    state[0] = FLY
+    atcmd.tick()
+    assert future.result(0) == FLY
+
+
+def test_timeout_and_close():
+    atcmd = StandinATCommand()
+    acks = ardrone.ack.Acknowledgements(atcmd)
+    acks.update(0)
+
+    late = acks.takeoff(timeout=0.01)
+    landed = acks.land(timeout=10)
+    pending = acks.takeoff(timeout=10)
+    time.sleep(0.02)
+    atcmd.tick()
+
+    with pytest.raises(ardrone.ack.AcknowledgementTimeout):
+        late.result(0)
+    assert acks.stats() == {'land': dict(acks.latency['land'].snapshot(), timeouts=0)}
+    assert acks.timeouts['takeoff'] == 1
+
+    acks.close()
+    assert pending.cancelled()
+    assert landed.result(0) == 0
+    assert acks.active == []
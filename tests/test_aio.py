@@ -0,0 +1,110 @@
+import asyncio
+
+import ardrone.aio
+import ardrone.constant
+import ardrone.navdata
+import ardrone.sim
+
+
+# a loopback address of its own keeps the fixed drone ports free
+HOST = '127.0.0.2'
+
+FLY = 1 << ardrone.navdata.STATE_SHIFTS['fly']
+
+
+class StandinTransport(object):
+    """Records the datagrams sent on an endpoint."""
+
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    def sendto(self, data, addr=None):
+        self.sent.append(data)
+
+    def is_closing(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+def test_at_protocol_watchdog():
+    async def run():
+        atcmd = ardrone.aio.ATProtocol(asyncio.get_running_loop(), interval=0.01)
+        transport = StandinTransport()
+        atcmd.connection_made(transport)
+
+        atcmd.ref(True)
+        await asyncio.sleep(0.035)
+        atcmd.halt()
+        count = len(transport.sent)
+        await asyncio.sleep(0.03)
+        return transport.sent, count
+
+    sent, count = asyncio.run(run())
+    assert sent[0] == b'AT*REF=1,290718208\r'
+    # the watchdog keeps the connection alive until halted
+    assert sent[1].startswith(b'AT*COMWDG=2')
+    assert count >= 3
+    assert len(sent) == count
+    assert [int(data.split(b'=')[1].split(b',')[0].rstrip(b'\r')) for data in sent] == list(range(1, count + 1))
+
+
+def test_navdata_stream_and_takeoff():
+    async def run():
+        states = []
+        async with ardrone.aio.AsyncARDrone(HOST, video=False) as drone:
+            async for navdata in drone.navdata_stream():
+                states.append(navdata['state'].value)
+                if len(states) == 3:
+                    drone.takeoff()
+                if navdata['state']['fly']:
+                    break
+            assert drone.navdata is navdata
+        return states
+
+    with ardrone.sim.Simulator(HOST, navdata_rate=200):
+        states = asyncio.run(asyncio.wait_for(run(), 5))
+
+    assert not states[0] & FLY
+    assert states[-1] & FLY
+
+
+def test_halt_ends_streams():
+    async def run():
+        drone = ardrone.aio.AsyncARDrone(HOST, video=False)
+        await drone.connect()
+
+        async def consume():
+            return [navdata async for navdata in drone.navdata_stream()]
+
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.1)
+        await drone.halt()
+        received = await asyncio.wait_for(task, 1)
+        assert drone.navdata_queues == []
+        return received
+
+    with ardrone.sim.Simulator(HOST, navdata_rate=200):
+        received = asyncio.run(run())
+
+    assert len(received) > 0
+
+
+def test_frames_resync_after_bad_signature():
+    payloads = [bytes([number])*(100 + number) for number in range(4)]
+    data = [ardrone.sim.encode_frame(number, ardrone.constant.FRAME_TYPE_P, number, payload) for number, payload in enumerate(payloads)]
+
+    async def run():
+        reader = asyncio.StreamReader()
+        # garbage before and between the frames
+        reader.feed_data(b'junk' + data[0] + b'\x00PaV' + data[1] + data[2][:7])
+        reader.feed_data(data[2][7:] + b'PaV' + data[3][:50])
+        reader.feed_data(data[3][50:])
+        reader.feed_eof()
+        return [frame async for frame in ardrone.aio.frames(reader)]
+
+    received = asyncio.run(run())
+    assert [frame.header.frame_number for frame in received] == [0, 1, 2, 3]
+    assert [frame.data for frame in received] == data
@@ -0,0 +1,111 @@
+import struct
+
+import pytest
+
+import ardrone.at
+import ardrone.constant
+
+
+class StandinSocket(object):
+    """Records the datagrams sent to it."""
+
+    def __init__(self):
+        self.datagrams = []
+
+    def sendto(self, data, address):
+        self.datagrams.append(data)
+
+
+def commands(datagram):
+    return [command.split(b'=')[0] for command in datagram.split(b'\r') if command]
+
+
+def sender():
+    sock = StandinSocket()
+    return sock, ardrone.at.ATCommand('127.0.0.1', sock=sock, sender=False)
+
+
+def test_watchdog_only_when_idle():
+    sock, atcmd = sender()
+
+    atcmd.tick()
+    assert sock.datagrams == []
+
+    atcmd.last -= atcmd.interval
+    atcmd.tick()
+    assert sock.datagrams == [b'AT*COMWDG=1\r']
+
+    atcmd.config('control:altitude_max', 3000)
+    atcmd.tick()
+    assert len(sock.datagrams) == 2
+
+
+def test_held_commands_resent_every_tick():
+    sock, atcmd = sender()
+    atcmd.ref(True)
+    atcmd.pcmd(True, 0.1, 0, 0, 0)
+    del sock.datagrams[:]
+
+    ticked = []
+    atcmd.listeners.append(lambda: ticked.append(atcmd.ticks))
+    atcmd.tick()
+    atcmd.tick(0.01)
+
+    # REF and PCMD in one datagram per tick, with new sequence numbers
+    assert [commands(datagram) for datagram in sock.datagrams] == [[b'AT*REF', b'AT*PCMD']]*2
+    assert sock.datagrams[0].startswith(b'AT*REF=3,') and sock.datagrams[1].startswith(b'AT*REF=5,')
+    assert ticked == [1, 2]
+    assert atcmd.metrics.histograms['jitter'].max == 0.01
+
+    # the emergency flag is not held, so it does not toggle on every tick
+    atcmd.ref(False, True)
+    del sock.datagrams[:]
+    atcmd.tick()
+    assert commands(sock.datagrams[0]) == [b'AT*PCMD']
+
+
+def test_batch_coalesces_datagrams():
+    sock, atcmd = sender()
+
+    with atcmd.batch():
+        for index in range(100):
+            atcmd.config('custom:option_{}'.format(index), index)
+        assert sock.datagrams == []
+
+    assert len(sock.datagrams) > 1
+    assert all(len(datagram) <= ardrone.constant.COMMAND_MAX_SIZE for datagram in sock.datagrams)
+    sent = b''.join(sock.datagrams).split(b'\r')[:-1]
+    assert [int(command.split(b'=')[1].split(b',')[0]) for command in sent] == list(range(1, 101))
+    assert atcmd.metrics['commands'] == 100
+    assert atcmd.metrics['datagrams'] == len(sock.datagrams)
+
+
+def baseline_encode(command, seq, params):
+    """The AT command encoder before the templates."""
+    params_str = []
+    for p in params:
+        if type(p) == int:
+            params_str.append('{:d}'.format(p))
+        elif type(p) == float:
+            params_str.append('{:d}'.format(struct.unpack('i', struct.pack('f', p))[0]))
+        elif type(p) == str:
+            params_str.append('"{:s}"'.format(p))
+
+    return 'AT*{:s}={:d}{:s}\r'.format(command, seq, ''.join(',' + param for param in params_str)).encode()
+
+
+@pytest.mark.parametrize('command, params', [
+    ('COMWDG', []),
+    ('REF', [290718208]),
+    ('PCMD', [1, 0.5, -0.25, 0.0, -1.0]),
+    ('PCMD', [0, 1e-3, 3.4e38, -0.1, 0.2]),
+    ('CONFIG', ['control:altitude_max', '3000']),
+    ('LED', [3, 2.5, -7]),
+    ('CTRL', [5, 0]),
+    ('ANIM', [True, None, 4]),
+])
+def test_encode_matches_baseline(command, params):
+    for seq in (1, 2**31 - 1):
+        assert ardrone.at.encode(command, seq, params) == baseline_encode(command, seq, params)
+        # encoded twice through the cached template
+        assert ardrone.at.encode(command, seq, params) == baseline_encode(command, seq, params)
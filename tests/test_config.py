@@ -0,0 +1,114 @@
+import contextlib
+import threading
+
+import ardrone.ack
+import ardrone.config
+import ardrone.navdata
+
+
+COMMAND = 1 << ardrone.navdata.STATE_SHIFTS['command']
+
+
+class StandinATCommand(object):
+    """Records the commands the acknowledgements send."""
+
+    def __init__(self):
+        self.listeners = []
+        self.sent = []
+
+    @contextlib.contextmanager
+    def batch(self):
+        yield
+
+    def config(self, option, value):
+        self.sent.append(('CONFIG', option, value))
+
+    def ctrl(self, mode):
+        self.sent.append(('CTRL', mode))
+
+
+def acknowledge(acks):
+    """Run the command ACK handshake of the oldest config operation."""
+    acks.update(COMMAND)
+    acks.update(0)
+
+
+def configuration():
+    atcmd = StandinATCommand()
+    acks = ardrone.ack.Acknowledgements(atcmd)
+    acks.update(0)
+    return atcmd, acks, ardrone.config.Configuration(acks, '127.0.0.1')
+
+
+def configs(atcmd):
+    return [sent[1:] for sent in atcmd.sent if sent[0] == 'CONFIG']
+
+
+def test_parse():
+    values = ardrone.config.parse('general:navdata_demo = TRUE\ncontrol:accs_offset = { 1.0 -2 3e1 }\ngeneral:num_version_soft = 2.4.8\ncontrol:altitude_max = 3000\n')
+    assert values == {
+        'general:navdata_demo': True,
+        'control:accs_offset': (1.0, -2, 30.0),
+        'general:num_version_soft': '2.4.8',
+        'control:altitude_max': 3000,
+    }
+    assert ardrone.config.format_value(True) == 'TRUE'
+    assert ardrone.config.format_value((1, 2.5)) == '{ 1 2.5 }'
+
+
+def test_update_skips_known_and_pending_values():
+    atcmd, acks, config = configuration()
+
+    future = config.update({'control:altitude_max': 3000, 'control:outdoor': True})
+    assert sorted(configs(atcmd)) == [('control:altitude_max', '3000'), ('control:outdoor', 'TRUE')]
+    assert config.stats() == {'known': 0, 'pending': 2, 'sent': 2, 'skipped': 0}
+
+    # already on its way
+    again = config.set('control:outdoor', True)
+    assert not again.done()
+    assert config.stats()['skipped'] == 1
+
+    acknowledge(acks)
+    assert future.done() and again.done()
+    assert config['control:altitude_max'] == 3000
+    assert config['control:outdoor'] is True
+    assert config.stats() == {'known': 2, 'pending': 0, 'sent': 2, 'skipped': 1}
+
+    # already known
+    del atcmd.sent[:]
+    assert config.update([('control:altitude_max', 3000), ('control:outdoor', 'TRUE')]).done()
+    assert configs(atcmd) == []
+
+    # only the changed option is sent
+    config.update({'control:altitude_max': 3000, 'control:outdoor': False})
+    assert configs(atcmd) == [('control:outdoor', 'FALSE')]
+
+
+def test_failed_update_is_not_cached():
+    atcmd, acks, config = configuration()
+
+    future = config.set('video:bitrate', 2000)
+    acks.close()
+    assert future.cancelled()
+    assert 'video:bitrate' not in config
+    assert config.stats()['pending'] == 0
+
+    # sent again
+    del atcmd.sent[:]
+    config.set('video:bitrate', 2000)
+    assert configs(atcmd) == [('video:bitrate', '2000')]
+
+
+def test_acknowledged_waits_for_update():
+    atcmd, acks, config = configuration()
+    config.set('video:bitrate', 2000)
+
+    acknowledging = threading.Thread(target=acknowledge, args=(acks,))
+    with config.lock:
+        acknowledging.start()
+        acknowledging.join(0.1)
+        # the ACK waits until the cache is no longer in use
+        assert 'video:bitrate' not in config.values
+    acknowledging.join(5)
+
+    assert config['video:bitrate'] == 2000
@@ -0,0 +1,65 @@
+import pytest
+
+import ardrone
+import ardrone.aio
+
+
+def test_controls_before_connect():
+    drone = ardrone.ARDrone(connect=False, video=False)
+    assert not drone.connected
+    assert dict(drone.navdata) == {}
+
+    for control in (drone.takeoff, drone.land, drone.hover, drone.move_left, drone.stats, drone.read_config):
+        with pytest.raises(RuntimeError, match='not connected'):
+            control()
+    with pytest.raises(RuntimeError, match='not connected'):
+        drone.move(0.1, 0, 0, 0)
+    with pytest.raises(RuntimeError, match='not connected'):
+        drone.config('control:altitude_max', 3000)
+
+    # nothing to halt
+    drone.halt()
+
+
+def test_options_are_keyword_only():
+    with pytest.raises(TypeError):
+        ardrone.ARDrone('127.0.0.1', True, connect=False)
+
+    drone = ardrone.ARDrone('127.0.0.1', shared_frames=True, video=False, connect=False)
+    assert drone.host == '127.0.0.1'
+    assert drone.shared_frames
+
+
+@pytest.mark.parametrize('options', [
+    {'video_size': (-1, 0)},
+    {'video_size': (0, 20000)},
+    {'video_size': (640,)},
+    {'video_crop': (0, 0, 0, 10)},
+    {'video_crop': (-2, 0, 10, 10)},
+    {'video_crop': (1200, 0, 100, 10)},
+    {'video_crop': (0, 0, 10)},
+])
+def test_invalid_video_options(options):
+    with pytest.raises(ValueError):
+        ardrone.ARDrone(connect=False, **options)
+
+    with pytest.raises(ValueError):
+        ardrone.aio.AsyncARDrone(**options)
+
+
+def test_valid_video_options():
+    drone = ardrone.ARDrone(connect=False, video_size=(160, 0), video_crop=(640, 360, 640, 360))
+    assert drone.video_size == (160, 0)
+
+
+def test_navdata_history_options():
+    with pytest.raises(ValueError):
+        ardrone.ARDrone(connect=False, shared_navdata=True, history_size=100)
+
+    drone = ardrone.ARDrone(connect=False)
+    with pytest.raises(RuntimeError, match='history disabled'):
+        drone.navdata_history()
+
+    drone = ardrone.ARDrone(connect=False, history_size=100)
+    with pytest.raises(RuntimeError, match='not connected'):
+        drone.navdata_history()
@@ -0,0 +1,145 @@
+import socket
+import threading
+import time
+
+import pytest
+
+import ardrone.constant
+import ardrone.fleet
+import ardrone.pave
+import ardrone.sim
+
+
+class StandinDrones(object):
+    """Floods every client of a navdata port with navdata packets and swallows commands."""
+
+    def __init__(self):
+        self.nav_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.nav_socket.bind(('127.0.0.1', 0))
+        self.nav_socket.setblocking(False)
+        self.navdata_port = self.nav_socket.getsockname()[1]
+
+        self.command_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.command_socket.bind(('127.0.0.1', 0))
+        self.command_port = self.command_socket.getsockname()[1]
+
+        self.clients = set()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        sequence = 1
+        while not self.stopping.is_set():
+            try:
+                while True:
+                    _, address = self.nav_socket.recvfrom(64)
+                    self.clients.add(address)
+            except socket.error:
+                pass
+
+            packet = ardrone.sim.encode_navdata(0, sequence, [])
+            sequence += 1
+            for address in list(self.clients):
+                try:
+                    self.nav_socket.sendto(packet, address)
+                except socket.error:
+                    # a removed drone
+                    pass
+            time.sleep(0.0005)
+
+    def close(self):
+        self.stopping.set()
+        self.thread.join()
+        self.nav_socket.close()
+        self.command_socket.close()
+
+
+def add(fleet, drones):
+    return fleet.add('127.0.0.1', navdata_port=drones.navdata_port, command_port=drones.command_port, video=False)
+
+
+def test_add_and_remove_while_receiving():
+    drones = StandinDrones()
+    fleet = ardrone.fleet.Fleet(rate=100)
+    try:
+        steady = add(fleet, drones)
+
+        for cycle in range(40):
+            added = [add(fleet, drones) for _ in range(4)]
+            time.sleep(0.002)
+            for drone in added:
+                drone.halt()
+
+        ticks = steady.atcmd.ticks
+        packets = steady.metrics['navdata']['packets']
+        time.sleep(0.2)
+
+        assert fleet.thread.is_alive()
+        assert len(fleet) == 1
+        # the remaining drone is still served
+        assert steady.atcmd.ticks > ticks
+        assert steady.metrics['navdata']['packets'] > packets
+        assert steady.navdata['sequence'] > 0
+    finally:
+        fleet.halt()
+        drones.close()
+
+    assert not fleet.thread.is_alive()
+
+
+def keyframes(count):
+    frames = []
+    for number in range(count):
+        data = ardrone.sim.encode_frame(number, ardrone.constant.FRAME_TYPE_IDR, number*33, b'\x00\x00\x00\x01')
+        frames.append(ardrone.pave.Frame(ardrone.pave.Header(*ardrone.pave.HEADER.unpack_from(data)), data, time.time()))
+    return frames
+
+
+def wait_decoded(drone):
+    deadline = time.time() + 5
+    while drone.decoding and time.time() < deadline:
+        time.sleep(0.001)
+    return not drone.decoding
+
+
+def test_decode_failure_recovery():
+    drones = StandinDrones()
+    fleet = ardrone.fleet.Fleet()
+    try:
+        drone = fleet.add('127.0.0.1', navdata_port=drones.navdata_port, command_port=drones.command_port, video=False, output='gray')
+
+        def fail(frame):
+            raise ValueError('crop must lie within the frame')
+
+        # the decode workers are driven by hand, as the drone has no video
+        # connection
+        drone.decode = fail
+        for frame in keyframes(3):
+            drone.video_scheduler.extend([frame])
+            fleet.schedule(drone)
+            assert wait_decoded(drone)
+        assert drone.frame_counters.errors == 3
+        assert drone.frame_counters.decoded == 0
+
+        drone.decode = lambda frame: (4, 2, bytes(range(8)))
+        drone.video_scheduler.extend(keyframes(1))
+        fleet.schedule(drone)
+        assert wait_decoded(drone)
+        assert drone.frame_counters.decoded == 1
+        assert bytes(drone.frame) == bytes(range(8))
+    finally:
+        fleet.halt()
+        drones.close()
+
+
+def test_invalid_video_options():
+    fleet = ardrone.fleet.Fleet()
+    try:
+        with pytest.raises(ValueError):
+            fleet.add('127.0.0.1', video=False, video_crop=(0, 0, 2000, 10))
+        assert len(fleet) == 0
+        assert fleet.thread.is_alive()
+    finally:
+        fleet.halt()
@@ -0,0 +1,67 @@
+import ardrone.history
+import ardrone.navdata
+import ardrone.sim
+
+
+def navdata(sequence, altitude=1200, state=0x80000001):
+    return ardrone.navdata.NavdataView(ardrone.sim.encode_navdata(state, sequence, [(0, [0x30000, 80, 1000.0, -2000.0, 45000.0, altitude, 0.1, 0.2, 0.3, 7])]))
+
+
+def test_append_in_sequence_order():
+    history = ardrone.history.NavdataHistory(capacity=8)
+    for sequence in (1, 2, 4, 3, 5):
+        history.append(navdata(sequence, altitude=sequence*100), sequence*0.1)
+
+    assert len(history) == 5
+    samples = history.last()
+    assert list(samples['sequence']) == [1, 2, 3, 4, 5]
+    assert list(samples['altitude']) == [100, 200, 300, 400, 500]
+    assert list(samples['state']) == [0x80000001]*5
+    assert list(samples['theta']) == [1]*5
+    assert list(samples['battery']) == [80]*5
+    assert history.gaps() == []
+
+    assert list(history.last(2)['sequence']) == [4, 5]
+    assert list(history.between(0.15, 0.35)['sequence']) == [2, 3]
+
+
+def test_gaps_and_wrap_around():
+    history = ardrone.history.NavdataHistory(capacity=8)
+    for sequence in (1, 2, 5, 6, 9):
+        history.append(navdata(sequence), float(sequence))
+
+    # 9 took the slot of 1
+    assert history.gaps() == [(3, 4), (7, 8)]
+    assert list(history.last()['sequence']) == [2, 5, 6, 9]
+
+    # a jump past the capacity leaves only the new sample
+    history.append(navdata(30), 30.0)
+    assert list(history.last()['sequence']) == [30]
+    assert history.gaps() == []
+
+
+def test_restart_and_clear():
+    history = ardrone.history.NavdataHistory(capacity=8)
+    for sequence in range(100, 105):
+        history.append(navdata(sequence), float(sequence))
+
+    # the drone restarts its sequence numbers
+    history.append(navdata(1), 200.0)
+    assert list(history.last()['sequence']) == [1]
+
+    # and keeps counting from there
+    history.append(navdata(2), 201.0)
+    assert list(history.last()['time']) == [200.0, 201.0]
+
+    history.clear()
+    assert len(history) == 0
+    assert history.gaps() == []
+    assert len(history.last(4)['sequence']) == 0
+
+
+def test_without_demo_option():
+    history = ardrone.history.NavdataHistory(capacity=4)
+    history.append(ardrone.navdata.NavdataView(ardrone.sim.encode_navdata(1, 1, [])), 1.0)
+    samples = history.last()
+    assert list(samples['state']) == [1]
+    assert list(samples['altitude']) == [0]
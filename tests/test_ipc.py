@@ -0,0 +1,89 @@
+import json
+import time
+
+import pytest
+
+import ardrone.ipc
+import ardrone.navdata
+import ardrone.output
+import ardrone.sim
+
+
+def test_frame_ring_keeps_pinned_frame():
+    frame_ring = ardrone.ipc.FrameRing(slots=3, slot_size=4)
+    try:
+        slot, sequence = frame_ring.write(b'\x01'*4)
+        assert frame_ring.pin(slot, sequence)
+        view = frame_ring.view(slot, 4)
+
+        for number in range(2, 12):
+            other, _ = frame_ring.write(bytes([number])*4)
+            assert other != slot
+            assert bytes(view) == b'\x01'*4
+
+        # a frame whose slot was reused cannot be pinned
+        slot, sequence = frame_ring.write(b'\x20'*4)
+        frame_ring.write(b'\x21'*4)
+        frame_ring.write(b'\x22'*4)
+        assert not frame_ring.valid(slot, sequence)
+        assert not frame_ring.pin(slot, sequence)
+        del view
+    finally:
+        frame_ring.close(unlink=True)
+
+
+def test_frame_ring_drops_oversize_frames():
+    frame_ring = ardrone.ipc.FrameRing(slots=3, slot_size=4)
+    try:
+        assert frame_ring.write(b'\x00'*5) is None
+        assert frame_ring.write(b'\x00'*4) == (0, 1)
+    finally:
+        frame_ring.close(unlink=True)
+
+    with pytest.raises(ValueError):
+        ardrone.ipc.FrameRing(slots=2)
+
+
+def test_frame_size():
+    assert ardrone.output.frame_size(None, None) == (1280, 720)
+    assert ardrone.output.frame_size((160, 90), None) == (160, 90)
+    assert ardrone.output.frame_size((0, 1440), None) == (2560, 1440)
+    assert ardrone.output.frame_size((100, 0), (0, 0, 200, 50)) == (100, 25)
+    assert ardrone.output.frame_size(None, (10, 10, 300, 200)) == (300, 200)
+
+
+def demo_packet(sequence, altitude):
+    return ardrone.sim.encode_navdata(0x80000001, sequence, [(0, [0x30000, 80, 1000.0, -2000.0, 45000.0, altitude, 0.1, 0.2, 0.3, 7])])
+
+
+def test_navdata_snapshot():
+    snapshot = ardrone.ipc.NavdataSnapshot()
+    assert snapshot.read() is None
+    assert snapshot.to_dict() == {}
+
+    packet = demo_packet(5, 1200)
+    snapshot.write(ardrone.navdata.NavdataView(packet))
+    assert snapshot.updates == 1
+    assert snapshot.read().altitude == 1200
+
+    navdata = snapshot.to_dict()
+    decoded = ardrone.navdata.decode(packet)
+    assert navdata == dict((key, decoded[key]) for key in ('state', 'header', 'sequence', 'vision', 'demo'))
+    assert json.loads(json.dumps(navdata)) == navdata
+
+    # without a demo option
+    snapshot.write(ardrone.navdata.NavdataView(ardrone.sim.encode_navdata(0, 6, [])))
+    assert 'demo' not in snapshot.to_dict()
+
+
+def test_navdata_snapshot_with_dead_writer():
+    snapshot = ardrone.ipc.NavdataSnapshot()
+    snapshot.write(ardrone.navdata.NavdataView(demo_packet(5, 1200)))
+    assert snapshot.read().sequence == 5
+
+    # the writer died in the middle of a write
+    snapshot.fields.counter += 1
+    snapshot.fields.sequence = 6
+    started = time.time()
+    assert snapshot.read().sequence == 5
+    assert time.time() - started < 1
@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+import ardrone.metrics
+
+
+def strict_loads(line):
+    def reject(constant):
+        raise ValueError('not valid JSON: {}'.format(constant))
+
+    return json.loads(line, parse_constant=reject)
+
+
+def test_histogram_overflow():
+    histogram = ardrone.metrics.Histogram([1.0, 2.0])
+    for value in (0.5, 1.5, 3.0, 5.0):
+        histogram.add(value)
+
+    assert histogram.percentile(25) == 1.0
+    assert histogram.percentile(50) == 2.0
+    # interpolated between the last bound and the maximum
+    assert histogram.percentile(75) == 2.0 + (5.0 - 2.0)*(3 - 2)/2
+    assert histogram.percentile(100) == 5.0
+
+    assert histogram.snapshot()['buckets'] == [(1.0, 1), (2.0, 1), (None, 2)]
+
+
+def test_exporter_writes_strict_json(tmp_path):
+    metrics = ardrone.metrics.Metrics(['packets'], ['age'])
+    metrics.count('packets', 3)
+    metrics.observe('age', 100.0)
+
+    path = str(tmp_path / 'stats.jsonl')
+    exporter = ardrone.metrics.Exporter(lambda: {'navdata': metrics.snapshot()}, path)
+    with open(path, 'a') as stats_file:
+        exporter.export(stats_file)
+        exporter.export(stats_file)
+
+    with open(path) as stats_file:
+        lines = [strict_loads(line) for line in stats_file]
+
+    assert len(lines) == 2
+    assert lines[0]['navdata']['packets'] == 3
+    assert lines[0]['navdata']['age']['buckets'][-1] == [None, 1]
+
+
+def test_exporter_rejects_nan(tmp_path):
+    path = str(tmp_path / 'stats.jsonl')
+    exporter = ardrone.metrics.Exporter(lambda: {'value': float('nan')}, path)
+    with open(path, 'a') as stats_file:
+        with pytest.raises(ValueError):
+            exporter.export(stats_file)
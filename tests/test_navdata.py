@@ -0,0 +1,123 @@
+import io
+import json
+import struct
+
+import pytest
+
+import ardrone.navdata
+import ardrone.sim
+
+
+def demo_packet(sequence, state=0):
+    demo = [0x30000, 80, 1000.0, -2000.0, 45000.0, 1200 + sequence, 0.1, 0.2, 0.3, sequence]
+    return ardrone.sim.encode_navdata(state, sequence, [(0, demo)])
+
+
+def test_decode_many_path(tmp_path):
+    pytest.importorskip('numpy')
+
+    path = tmp_path / 'flight.navdata'
+    path.write_bytes(b''.join(demo_packet(sequence) for sequence in range(1, 6)))
+
+    navdata = ardrone.navdata.decode_many(path, processes=1)
+    assert list(navdata['sequence']) == [1, 2, 3, 4, 5]
+    assert list(navdata['altitude']) == [1201, 1202, 1203, 1204, 1205]
+
+    with open(str(path), 'rb') as f:
+        assert list(ardrone.navdata.decode_many(f, processes=1)['sequence']) == [1, 2, 3, 4, 5]
+
+
+def test_decode_many_file_object_without_name():
+    pytest.importorskip('numpy')
+
+    data = io.BytesIO(b''.join(demo_packet(sequence) for sequence in range(1, 4)))
+    assert list(ardrone.navdata.decode_many(data, processes=1)['sequence']) == [1, 2, 3]
+
+    with pytest.raises(TypeError):
+        ardrone.navdata.decode_many(io.StringIO('not navdata'), processes=1)
+
+
+def baseline_decode(packet):
+    """The navdata decoder before the option tables (demo option only)."""
+    offset = 0
+
+    _ = struct.unpack_from('IIII', packet, offset)
+    s = _[1]
+    state = dict((name, s >> bit & 1) for name, bit in ardrone.navdata.STATE_BITS)
+
+    data = dict()
+    data['state'] = state
+    data['header'] = _[0]
+    data['sequence'] = _[2]
+    data['vision'] = _[3]
+
+    offset += struct.calcsize('IIII')
+
+    demo_fields = ['ctrl_state', 'battery', 'theta', 'phi', 'psi', 'altitude', 'vx', 'vy', 'vz', 'num_frames']
+    while True:
+        try:
+            id_nr, size = struct.unpack_from('HH', packet, offset)
+            offset += struct.calcsize('HH')
+        except struct.error:
+            break
+
+        values = []
+        for i in range(size - struct.calcsize('HH')):
+            values.append(struct.unpack_from('c', packet, offset)[0])
+            offset += struct.calcsize('c')
+
+        if id_nr == 0:
+            demo = dict(zip(demo_fields, struct.unpack_from('IIfffIfffI', b''.join(values))))
+            for a in ['theta', 'phi', 'psi']:
+                demo[a] = int(demo[a] / 1000)
+
+            data['demo'] = demo
+
+    return data
+
+
+STATES = [0, 1, 0x80000405, 0xffffffff]
+
+
+@pytest.mark.parametrize('state', STATES)
+def test_decode_matches_baseline(state):
+    packet = ardrone.sim.encode_navdata(state, 42, [(0, [0x30000, 80, 1999.0, -2999.0, 45000.0, 1200, 0.1, 0.2, 0.3, 7])])
+    # the baseline decoder only knows the demo option
+    expected = baseline_decode(packet)
+
+    for navdata in (ardrone.navdata.decode(packet), ardrone.navdata.NavdataView(packet).to_dict()):
+        navdata = dict((key, value) for key, value in navdata.items() if key != 'checksum')
+        assert navdata == expected
+        assert type(navdata['state']) is dict
+        assert json.loads(json.dumps(navdata)) == expected
+
+
+def test_navdata_view():
+    packet = ardrone.sim.encode_navdata(0x80000001, 9, [(0, [0x30000, 80, 1000.0, -2000.0, 45000.0, 1200, 0.1, 0.2, 0.3, 7]), (1, [123])])
+    view = ardrone.navdata.NavdataView(packet)
+
+    assert view['sequence'] == 9
+    assert view['state']['fly'] == 1 and view['state']['emergency'] == 1 and view['state']['video'] == 0
+    assert view['state'].value == 0x80000001
+    assert view['demo']['altitude'] == 1200
+    assert view['demo']['theta'] == 1
+    assert view['time']['time'] == 123
+    assert 'demo' in view and 'wifi' not in view
+    assert list(view) == ['state', 'header', 'sequence', 'vision', 'demo', 'time', 'checksum']
+    with pytest.raises(KeyError):
+        view['wifi']
+
+    assert dict(view['demo']) == view.to_dict()['demo'] == ardrone.navdata.decode(packet)['demo']
+
+    # pickles as the raw packet
+    import pickle
+
+    assert pickle.loads(pickle.dumps(view)).to_dict() == view.to_dict()
+
+
+def test_navdata_view_truncated_option():
+    packet = ardrone.sim.encode_navdata(0, 1, [(0, [0x30000, 80, 0.0, 0.0, 0.0, 1, 0.0, 0.0, 0.0, 0])])
+    # cut into the checksum option: the demo option is kept
+    view = ardrone.navdata.NavdataView(packet[:-4])
+    assert 'demo' in view and 'checksum' not in view
+    assert view.to_dict() == dict((key, value) for key, value in ardrone.navdata.decode(packet).items() if key != 'checksum')
@@ -0,0 +1,141 @@
+import errno
+import multiprocessing
+import socket
+import threading
+
+import ardrone.ipc
+import ardrone.navdata
+import ardrone.network
+import ardrone.output
+import ardrone.sim
+import ardrone.subscription
+
+
+class StandinDrone(object):
+    """The attributes of an ARDrone the IPCThread uses."""
+
+    def __init__(self, frame_ring):
+        self.video_pipe, self.network_video_pipe = multiprocessing.Pipe()
+        self.nav_pipe = None
+        self.navdata_snapshot = object()
+        self.output = ardrone.output.GRAY_PLANE
+        self.metrics = ardrone.network.stream_metrics()
+        self.frame_ring = frame_ring
+        self.frame_subscribers = ardrone.subscription.Publisher()
+        self.frame = None
+        self.image = None
+
+
+def test_ipc_drops_overwritten_frame_slots():
+    width, height = 4, 2
+    frame_ring = ardrone.ipc.FrameRing(slots=3, slot_size=width*height)
+    drone = StandinDrone(frame_ring)
+
+    received = []
+    done = threading.Event()
+
+    def callback(image):
+        received.append(bytes(image))
+        if len(received) == 3:
+            done.set()
+
+    drone.frame_subscribers.subscribe(callback, ardrone.subscription.BLOCK, maxsize=8)
+
+    # the fourth frame reuses the slot of the first one before it is read
+    frames = [bytes([number])*(width*height) for number in range(1, 5)]
+    for data in frames:
+        slot, sequence = frame_ring.write(data)
+        drone.network_video_pipe.send((0.0, 0.0, slot, width, height, sequence))
+
+    ipc_thread = ardrone.network.IPCThread(drone)
+    ipc_thread.start()
+    try:
+        assert done.wait(5)
+    finally:
+        ipc_thread.stop()
+        ipc_thread.join()
+        drone.frame_subscribers.close()
+
+    assert received == frames[1:]
+    assert drone.metrics['video']['stale'] == 1
+
+    # the latest frame stays pinned in its slot
+    assert frame_ring.pinned.value == 4
+    assert bytes(drone.frame) == frames[-1]
+    for data in frames:
+        frame_ring.write(bytes(len(data)))
+    assert bytes(drone.frame) == frames[-1]
+    assert bytes(drone.image) == frames[-1]
+
+    drone.frame = drone.image = None
+    frame_ring.close(unlink=True)
+
+
+class StandinSocket(object):
+    """Non-blocking socket with queued datagrams."""
+
+    def __init__(self):
+        self.datagrams = []
+
+    def recv_into(self, buf):
+        if not self.datagrams:
+            raise socket.error(errno.EAGAIN, 'no datagram pending')
+
+        data = self.datagrams.pop(0)
+        buf[:len(data)] = data
+        return len(data)
+
+
+def navdata_packet(sequence, state=0):
+    return ardrone.sim.encode_navdata(state, sequence, [])
+
+
+def receive(receiver, sock, *packets):
+    sock.datagrams.extend(packets)
+    return [ardrone.navdata.decode(packet)['sequence'] for packet in receiver.receive()]
+
+
+def test_navdata_receiver_filters_sequence():
+    sock = StandinSocket()
+    metrics = ardrone.network.stream_metrics()['navdata']
+    receiver = ardrone.network.NavdataReceiver(sock, metrics, buffer_size=None, window=256)
+
+    # reordered within a batch
+    assert receive(receiver, sock, navdata_packet(2), navdata_packet(1), navdata_packet(3)) == [1, 2, 3]
+    # late, duplicated and lost packets
+    assert receive(receiver, sock, navdata_packet(6), navdata_packet(2)) == [6]
+    assert receive(receiver, sock, navdata_packet(6), navdata_packet(7)) == [7]
+    assert receive(receiver, sock) == []
+
+    assert metrics['lost'] == 2
+    assert metrics['reordered'] == 1
+    assert metrics['duplicates'] == 1
+
+
+def test_navdata_receiver_restart():
+    sock = StandinSocket()
+    metrics = ardrone.network.stream_metrics()['navdata']
+    receiver = ardrone.network.NavdataReceiver(sock, metrics, buffer_size=None, window=256)
+    bootstrap = 1 << ardrone.navdata.STATE_SHIFTS['navdata_bootstrap']
+    com_watchdog = 1 << ardrone.navdata.STATE_SHIFTS['com_watchdog']
+
+    assert receive(receiver, sock, *[navdata_packet(sequence) for sequence in range(1, 101)]) == list(range(1, 33))
+    assert receive(receiver, sock) == list(range(33, 65))
+    assert receive(receiver, sock) == list(range(65, 97))
+    assert receive(receiver, sock) == list(range(97, 101))
+
+    # restarted at the first sequence number within the window
+    assert receive(receiver, sock, navdata_packet(1), navdata_packet(2)) == [1, 2]
+
+    # restarted in bootstrap mode and with the com watchdog flag
+    assert receive(receiver, sock, navdata_packet(50)) == [50]
+    assert receive(receiver, sock, navdata_packet(5, bootstrap), navdata_packet(6)) == [5, 6]
+    assert receive(receiver, sock, navdata_packet(50)) == [50]
+    assert receive(receiver, sock, navdata_packet(3, com_watchdog), navdata_packet(4)) == [3, 4]
+
+    # restarted by a jump back of more than the window
+    assert receive(receiver, sock, navdata_packet(1000)) == [1000]
+    assert receive(receiver, sock, navdata_packet(10), navdata_packet(11)) == [10, 11]
+
+    assert metrics['reordered'] == 0
+    assert metrics['duplicates'] == 0
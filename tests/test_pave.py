@@ -0,0 +1,89 @@
+import select
+import socket
+
+import ardrone.constant
+import ardrone.pave
+import ardrone.sim
+
+
+IDR = ardrone.constant.FRAME_TYPE_IDR
+P = ardrone.constant.FRAME_TYPE_P
+
+
+def read_stream(frame_types, timestamps=None):
+    """Serve encoded frames over a local TCP stand-in in small pieces and read them back."""
+    if timestamps is None:
+        timestamps = [number*33 for number in range(len(frame_types))]
+    stream = b''.join(ardrone.sim.encode_frame(number, frame_type, timestamp, b'\x00\x00\x00\x01' + bytes([number])*(100 + number)) for number, (frame_type, timestamp) in enumerate(zip(frame_types, timestamps)))
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    client = socket.create_connection(server.getsockname())
+    drone, _ = server.accept()
+    server.close()
+
+    client.setblocking(False)
+    reader = ardrone.pave.FrameReader(client)
+    frames = []
+    try:
+        # garbage before the first frame is skipped
+        drone.sendall(b'junk')
+        for start in range(0, len(stream), 37):
+            drone.sendall(stream[start:start + 37])
+            select.select([client], [], [], 1)
+            reader.fill()
+            frames.extend(reader.frames())
+        drone.close()
+        while not reader.closed:
+            select.select([client], [], [], 1)
+            reader.fill()
+        frames.extend(reader.frames())
+    finally:
+        client.close()
+
+    return frames
+
+
+def test_reader_splits_frames():
+    frames = read_stream([IDR, P, P])
+    assert [frame.header.frame_number for frame in frames] == [0, 1, 2]
+    assert [frame.header.payload_size for frame in frames] == [104, 105, 106]
+    assert ardrone.pave.is_keyframe(frames[0]) and not ardrone.pave.is_keyframe(frames[1])
+
+
+def test_scheduler_skips_to_newest_keyframe():
+    scheduler = ardrone.pave.FrameScheduler()
+    scheduler.extend(read_stream([IDR, P, P, IDR, P]))
+
+    frame = scheduler.next()
+    assert frame.header.frame_number == 3
+    scheduler.decoded()
+    assert scheduler.next().header.frame_number == 4
+    assert scheduler.next() is None
+
+    counters = scheduler.counters
+    assert (counters.received, counters.decoded, counters.dropped) == (5, 1, 3)
+
+
+def test_scheduler_drops_late_frames_until_keyframe():
+    scheduler = ardrone.pave.FrameScheduler(max_delay=100)
+    frames = read_stream([IDR, P, P, P, P, IDR], [0, 33, 66, 300, 333, 366])
+
+    scheduler.extend(frames[:1])
+    assert scheduler.next().header.frame_number == 0
+
+    # frame 1 is more than max_delay behind frame 4, after which the rest
+    # of its group cannot be decoded
+    scheduler.extend(frames[1:5])
+    assert scheduler.next() is None
+    assert scheduler.counters.dropped == 4
+
+    scheduler.extend(frames[5:])
+    assert scheduler.next().header.frame_number == 5
+
+    # a decode error waits for the next keyframe
+    scheduler.error()
+    scheduler.extend(read_stream([P]))
+    assert scheduler.next() is None
+    assert scheduler.counters.errors == 1
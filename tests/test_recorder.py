@@ -0,0 +1,21 @@
+import ardrone.recorder
+import ardrone.sim
+
+
+def demo_packet(sequence):
+    demo = [0x30000, 80, 1000.0, -2000.0, 45000.0, 1200, 0.1, 0.2, 0.3, sequence]
+    return ardrone.sim.encode_navdata(0, sequence, [(0, demo)])
+
+
+def test_play_navdata_only(tmp_path):
+    path = str(tmp_path / 'flight')
+    with ardrone.recorder.Recorder(path) as recorder:
+        for sequence in range(1, 11):
+            recorder.write(ardrone.recorder.NAVDATA, demo_packet(sequence), sequence*0.01, sequence)
+
+    with ardrone.recorder.Replayer(path) as replayer:
+        played = list(replayer.play(speed=None, video=False))
+
+    assert [stream for stream, received, navdata in played] == [ardrone.recorder.NAVDATA]*10
+    assert [navdata['sequence'] for stream, received, navdata in played] == list(range(1, 11))
+    assert played[0][2]['demo']['altitude'] == 1200
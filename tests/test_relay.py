@@ -0,0 +1,103 @@
+import socket
+import threading
+import time
+
+import pytest
+
+import ardrone.constant
+import ardrone.pave
+import ardrone.relay
+import ardrone.sim
+
+
+def frame(number, frame_type, size=16):
+    data = ardrone.sim.encode_frame(number, frame_type, number*33, b'\x00\x00\x00\x01' + bytes([number % 256])*(size - 4))
+    return ardrone.pave.Frame(ardrone.pave.Header(*ardrone.pave.HEADER.unpack_from(data)), data, time.time())
+
+
+def wait_clients(relay, count):
+    deadline = time.time() + 5
+    while len(relay.clients) < count and time.time() < deadline:
+        time.sleep(0.001)
+    assert len(relay.clients) == count
+
+
+def read(address, count, received):
+    for received_frame in ardrone.relay.frames(address, timeout=2):
+        received.append(received_frame)
+        if len(received) == count:
+            return
+
+
+@pytest.mark.parametrize('unix', [False, True])
+def test_clients_join_at_keyframe(tmp_path, unix):
+    address = str(tmp_path / 'relay') if unix else ('127.0.0.1', 0)
+    with ardrone.relay.Relay(address) as relay:
+        received = []
+        reader = threading.Thread(target=read, args=(relay.address, 4, received))
+        reader.start()
+        wait_clients(relay, 1)
+        client = relay.clients[0]
+
+        relay.publish(frame(0, ardrone.constant.FRAME_TYPE_P))
+        relay.publish(frame(1, ardrone.constant.FRAME_TYPE_IDR))
+        for number in range(2, 5):
+            relay.publish(frame(number, ardrone.constant.FRAME_TYPE_P))
+        reader.join()
+
+        assert [received_frame.header.frame_number for received_frame in received] == [1, 2, 3, 4]
+        assert received[0].data == frame(1, ardrone.constant.FRAME_TYPE_IDR).data
+        assert relay.stats()['published'] == 5
+        assert client.skipped == 1
+        assert client.sent == 4
+
+
+def stalled_client(relay):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.connect(relay.address)
+    wait_clients(relay, 1)
+    return sock
+
+
+def publish_gop(relay, count):
+    for number in range(count):
+        frame_type = ardrone.constant.FRAME_TYPE_IDR if number % 10 == 0 else ardrone.constant.FRAME_TYPE_P
+        relay.publish(frame(number, frame_type, size=64*1024))
+
+
+def wait(condition):
+    deadline = time.time() + 5
+    while not condition() and time.time() < deadline:
+        time.sleep(0.001)
+    return condition()
+
+
+def test_slow_client_skips():
+    with ardrone.relay.Relay(('127.0.0.1', 0), policy=ardrone.relay.SKIP, max_backlog=256*1024) as relay:
+        sock = stalled_client(relay)
+        try:
+            publish_gop(relay, 400)
+            assert wait(lambda: not relay.frames)
+            client = relay.clients[0]
+            assert client.skipped > 0
+            assert client.backlog <= relay.max_backlog
+            assert relay.disconnected == 0
+        finally:
+            sock.close()
+
+
+def test_slow_client_disconnects():
+    with ardrone.relay.Relay(('127.0.0.1', 0), policy=ardrone.relay.DISCONNECT, max_backlog=256*1024) as relay:
+        sock = stalled_client(relay)
+        try:
+            publish_gop(relay, 400)
+            assert wait(lambda: relay.disconnected == 1)
+            assert relay.clients == []
+        finally:
+            sock.close()
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        ardrone.relay.Relay(('127.0.0.1', 0), policy='wait')
@@ -0,0 +1,102 @@
+import threading
+import time
+
+import ardrone.subscription
+
+
+def test_cancel_removes_subscription():
+    publisher = ardrone.subscription.Publisher()
+    first = publisher.subscribe(lambda item: None)
+    second = publisher.subscribe(lambda item: None)
+    assert publisher
+
+    first.cancel()
+    assert publisher.subscriptions == [second]
+    assert publisher
+
+    publisher.unsubscribe(second)
+    assert publisher.subscriptions == []
+    assert not publisher
+
+    publisher.close()
+
+
+def test_delivery():
+    publisher = ardrone.subscription.Publisher()
+    received = []
+    done = threading.Event()
+
+    def callback(item):
+        received.append(item)
+        if item == 9:
+            done.set()
+
+    subscription = publisher.subscribe(callback, ardrone.subscription.BLOCK, maxsize=1)
+    for item in range(10):
+        publisher.publish(item)
+
+    assert done.wait(5)
+    assert received == list(range(10))
+    assert subscription.stats()['dropped'] == 0
+
+    publisher.close()
+    assert not publisher
+
+
+def test_block_does_not_stall_publisher():
+    publisher = ardrone.subscription.Publisher(backlog=4)
+    release = threading.Event()
+    subscription = publisher.subscribe(lambda item: release.wait(), ardrone.subscription.BLOCK, maxsize=1)
+
+    publishing = threading.Thread(target=lambda: [publisher.publish(item) for item in range(100)])
+    publishing.start()
+    publishing.join(5)
+    assert not publishing.is_alive()
+    assert subscription.stats()['dropped'] > 0
+
+    release.set()
+    publisher.close()
+    assert subscription.cancelled
+
+
+def wait_idle(subscription):
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        stats = subscription.stats()
+        if not stats['lag'] and stats['delivered'] + stats['dropped'] == stats['published']:
+            return stats
+        time.sleep(0.001)
+    raise AssertionError('subscription did not catch up: {}'.format(subscription.stats()))
+
+
+def test_block_subscriber_does_not_hold_up_others():
+    publisher = ardrone.subscription.Publisher(backlog=8)
+    release = threading.Event()
+    slow_received = []
+    fast_received = []
+
+    def slow(item):
+        release.wait()
+        slow_received.append(item)
+
+    slow_subscription = publisher.subscribe(slow, ardrone.subscription.BLOCK, maxsize=1)
+    fast_subscription = publisher.subscribe(fast_received.append, ardrone.subscription.DROP_OLDEST, maxsize=200)
+
+    for item in range(200):
+        publisher.publish(item)
+
+    # the fast subscriber gets every item while the slow one is stuck
+    fast_stats = wait_idle(fast_subscription)
+    assert fast_received == list(range(200))
+    assert fast_stats['dropped'] == 0
+
+    release.set()
+    slow_stats = wait_idle(slow_subscription)
+    assert slow_stats['published'] == 200
+    assert slow_stats['dropped'] > 0
+    assert slow_stats['delivered'] == len(slow_received) == 200 - slow_stats['dropped']
+    # the newest items survive in the backlog
+    assert slow_received[-8:] == list(range(192, 200))
+    assert slow_received == sorted(slow_received)
+
+    publisher.close()
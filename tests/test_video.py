@@ -0,0 +1,14 @@
+import pytest
+
+video = pytest.importorskip('ardrone.video')
+
+
+@pytest.mark.parametrize('width, height', [(-1, 0), (0, -1), (100000, 0), (0, 100000), (2**31 - 1, 2**31 - 1)])
+def test_decode_rejects_frame_sizes(width, height):
+    with pytest.raises(ValueError):
+        video.Decoder().decode(b'', 'rgb24', width, height)
+
+
+def test_decode_rejects_pixel_format():
+    with pytest.raises(ValueError):
+        video.Decoder().decode(b'', 'rgb48')